@@ -42,6 +42,11 @@ class BootConfig:
     world_db: str
     prod: bool
     mock: bool
+    thought_store: bool
+    embedding_dimensions: int
+    embedding_max_wait_ms: float
+    embedding_max_batch: int
+    multiplexed_subscription: bool
 
     # .env variables
     env: EnvVariables
@@ -64,6 +69,37 @@ class BootConfig:
             action="store_true",
             help="Use mock data for GPT response instead of querying the API. (saves API calls)",
         )
+        parser.add_argument(
+            "--thought_store",
+            action="store_true",
+            help=(
+                "Score npc thoughts in memory with numpy instead of sqlite, through approximate per npc indexes past"
+                " 1024 thoughts."
+            ),
+        )
+        parser.add_argument(
+            "--embedding_dimensions",
+            help="Dimensions of the stored thought embeddings, shortened by OpenAI.",
+            type=int,
+            default=1536,
+        )
+        parser.add_argument(
+            "--embedding_max_wait_ms",
+            help="Time an embedding request waits for others to be sent in the same batch.",
+            type=float,
+            default=5.0,
+        )
+        parser.add_argument(
+            "--embedding_max_batch",
+            help="Maximum number of inputs sent in a single embedding request.",
+            type=int,
+            default=64,
+        )
+        parser.add_argument(
+            "--multiplexed_subscription",
+            action="store_true",
+            help="Receive every Torii event through a single subscription instead of one per event type.",
+        )
 
         parser.add_argument("-w", "--world_db", help="location of the world db", type=str, default="/litefs/world.db")
         parser.add_argument("-l", "--logging_file", help="location of the logging file", type=str)
@@ -73,6 +109,11 @@ class BootConfig:
         self.world_db = args.world_db
         self.prod = args.prod
         self.mock = args.mock
+        self.thought_store = args.thought_store
+        self.embedding_dimensions = args.embedding_dimensions
+        self.embedding_max_wait_ms = args.embedding_max_wait_ms
+        self.embedding_max_batch = args.embedding_max_batch
+        self.multiplexed_subscription = args.multiplexed_subscription
 
     def _load_env_variables(self) -> None:
         dotenv_path = ".env.production" if self.prod is True else ".env.development"
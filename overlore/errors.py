@@ -16,3 +16,6 @@ class ErrorCodes(Enum):
     NPC_BACKSTORY_NOT_FOUND = 12
     NPC_PROFILE_NOT_DELETED = 13
     COSINE_SIMILARITY_NOT_FOUND = 14
+    NUMPY_UNAVAILABLE = 15
+    EMBEDDING_DIMENSIONS_TOO_LARGE = 16
+    MISSING_EMBEDDINGS = 17
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+
+import aiohttp
+
+logger = logging.getLogger("overlore")
+
+# Connections kept open to a single upstream (Torii, Katana)
+CONNECTIONS_PER_HOST = 16
+# Idle connections are closed after this many seconds
+KEEPALIVE_S = 30
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=5, sock_read=30)
+
+
+class HttpSessions:
+    """Long-lived aiohttp sessions, one per upstream url and event loop.
+
+    aiohttp sessions can't be shared across event loops, the json-rpc server and the torii subscriptions each get
+    their own. Sessions of a loop are closed by close() when it stops."""
+
+    _instance: HttpSessions | None = None
+    # the event loops of different threads can ask for the instance at the same time
+    _instance_lock = threading.Lock()
+
+    _lock: threading.Lock
+    _sessions: dict[tuple[asyncio.AbstractEventLoop, str], aiohttp.ClientSession]
+
+    @classmethod
+    def instance(cls) -> HttpSessions:
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    logger.debug("Creating http sessions")
+                    # only published once built, other threads don't lock once it is set
+                    instance = cls.__new__(cls)
+                    instance._lock = threading.Lock()
+                    instance._sessions = {}
+                    cls._instance = instance
+        return cls._instance
+
+    def __init__(self) -> None:
+        raise RuntimeError("Call instance() instead")
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        key = (asyncio.get_running_loop(), url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.closed:
+                session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_HOST, keepalive_timeout=KEEPALIVE_S),
+                    timeout=HTTP_TIMEOUT,
+                    headers={"Content-Type": "application/json"},
+                )
+                self._sessions[key] = session
+            return session
+
+    async def close(self) -> None:
+        """Closes the sessions of the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sessions = [session for (session_loop, _), session in self._sessions.items() if session_loop is loop]
+            self._sessions = {key: session for key, session in self._sessions.items() if key[0] is not loop}
+        for session in sessions:
+            await session.close()
@@ -13,16 +13,19 @@ from overlore.jsonrpc.methods.spawn_npc.entrypoint import Context as SpawnNpcCon
 from overlore.jsonrpc.methods.spawn_npc.entrypoint import spawn_npc
 from overlore.jsonrpc.types import JsonRpcMethod
 from overlore.katana.client import KatanaClient
-from overlore.llm.client import AsyncOpenAiClient
+from overlore.llm.client import LlmClient
+from overlore.llm.factory import create_llm_client
 from overlore.llm.guard import AsyncGuard
 from overlore.torii.client import ToriiClient
 from overlore.types import DialogueThoughts, Discussion, NpcIdentity
 
 
 def setup_json_rpc_methods(config: BootConfig) -> list[JsonRpcMethod]:
+    # shared so that concurrent calls of both methods batch their embeddings together, they all run on the server loop
+    llm_client = create_llm_client(config=config)
     json_rpc_methods: list[JsonRpcMethod] = [
-        create_generate_discussion_method(config=config),
-        create_spawn_npc_method(config=config),
+        create_generate_discussion_method(config=config, llm_client=llm_client),
+        create_spawn_npc_method(config=config, llm_client=llm_client),
         create_get_npcs_backstory_method(),
         create_get_discussions_method(),
     ]
@@ -30,14 +33,14 @@ def setup_json_rpc_methods(config: BootConfig) -> list[JsonRpcMethod]:
     return json_rpc_methods
 
 
-def create_generate_discussion_method(config: BootConfig) -> JsonRpcMethod:
+def create_generate_discussion_method(config: BootConfig, llm_client: LlmClient) -> JsonRpcMethod:
     return JsonRpcMethod(
         context=GenerateDiscussionContext(
             discussion_guard=AsyncGuard(
                 output_type=Discussion,
             ),
             dialogue_thoughts_guard=AsyncGuard(output_type=DialogueThoughts),
-            llm_client=AsyncOpenAiClient(),
+            llm_client=llm_client,
             torii_client=ToriiClient(url=config.env["TORII_GRAPHQL"]),
             katana_client=KatanaClient(url=config.env["KATANA_URL"]),
         ),
@@ -45,11 +48,11 @@ def create_generate_discussion_method(config: BootConfig) -> JsonRpcMethod:
     )
 
 
-def create_spawn_npc_method(config: BootConfig) -> JsonRpcMethod:
+def create_spawn_npc_method(config: BootConfig, llm_client: LlmClient) -> JsonRpcMethod:
     return JsonRpcMethod(
         context=SpawnNpcContext(
             guard=AsyncGuard(output_type=NpcIdentity),
-            llm_client=AsyncOpenAiClient(),
+            llm_client=llm_client,
             torii_client=ToriiClient(url=config.env["TORII_GRAPHQL"]),
             katana_client=KatanaClient(url=config.env["KATANA_URL"]),
             lore_machine_pk=config.env["LOREMACHINE_PRIVATE_KEY"],
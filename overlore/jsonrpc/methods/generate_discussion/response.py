@@ -3,7 +3,7 @@ from __future__ import annotations
 import asyncio
 import logging
 from datetime import datetime
-from typing import TypedDict, cast
+from typing import Any, Awaitable, TypedDict, cast
 
 from openai import BaseModel
 
@@ -20,14 +20,14 @@ from overlore.jsonrpc.methods.generate_discussion.utils import (
     get_most_important_event,
 )
 from overlore.katana.client import KatanaClient
-from overlore.llm.client import AsyncOpenAiClient
+from overlore.llm.client import LlmClient
 from overlore.llm.constants import ChatCompletionModel, EmbeddingsModel
 from overlore.llm.guard import AsyncGuard
 from overlore.llm.natural_language_formatter import LlmFormatter
 from overlore.sqlite.discussion_db import DiscussionDatabase
-from overlore.sqlite.types import StorableDiscussion
+from overlore.sqlite.types import StorableDiscussion, StoredEvent
 from overlore.torii.client import ToriiClient
-from overlore.types import DialogueThoughts, Discussion, NpcAndThoughts, NpcEntity, Thought
+from overlore.types import DialogueThoughts, Discussion, Embedding, NpcEntity, Thought
 
 logger = logging.getLogger("overlore")
 
@@ -37,7 +37,7 @@ create_and_store_thoughts_tasks = set()
 class Context(TypedDict):
     discussion_guard: AsyncGuard
     dialogue_thoughts_guard: AsyncGuard
-    llm_client: AsyncOpenAiClient
+    llm_client: LlmClient
     torii_client: ToriiClient
     katana_client: KatanaClient
 
@@ -61,6 +61,8 @@ class DiscussionBuilder:
     npcs: list[NpcEntity]
     katana_ts: int
     realm_name: str
+    most_important_event: StoredEvent | None
+    query_embedding: Embedding
 
     @classmethod
     async def create(cls, context: Context, params: MethodParams) -> DiscussionBuilder:
@@ -71,11 +73,14 @@ class DiscussionBuilder:
 
         self.context = context
         self.params = params
-        self.npcs = await get_npcs(self.context["torii_client"], self.params.realm_entity_id)
-        self.katana_ts = await self.context["katana_client"].get_katana_ts()
         self.realm_name = Realms.instance().name_by_id(params.realm_id)
 
-        delete_events_to_ignore_if_necessary(self.params.realm_id, self.katana_ts, self.discussion_db)
+        # none of them depend on another, the slowest one sets the latency
+        (self.npcs, self.most_important_event, self.query_embedding) = await gather_or_cancel(
+            get_npcs(self.context["torii_client"], self.params.realm_entity_id),
+            self.fetch_katana_ts_and_most_important_event(),
+            self.request_query_embedding(),
+        )
 
         return self
 
@@ -118,9 +123,25 @@ class DiscussionBuilder:
 
         return storable_discussion
 
-    async def build_prompt(self) -> str:
-        self.most_important_event = get_most_important_event(realm_id=self.params.realm_id, katana_ts=self.katana_ts)
+    async def fetch_katana_ts_and_most_important_event(self) -> StoredEvent | None:
+        self.katana_ts = await self.context["katana_client"].get_katana_ts()
+        delete_events_to_ignore_if_necessary(self.params.realm_id, self.katana_ts, self.discussion_db)
+        return get_most_important_event(realm_id=self.params.realm_id, katana_ts=self.katana_ts)
+
+    async def request_query_embedding(self) -> Embedding:
+        return await self.context["llm_client"].request_embedding(
+            input_str=self.embedding_question(),
+            model=EmbeddingsModel.TEXT_EMBEDDING_SMALL.value,
+            dimensions=self.discussion_db.embedding_profile["dimensions"],
+        )
+
+    def embedding_question(self) -> str:
+        return (
+            f'Here\'s what your Lord has to say to you and the other villagers: "{self.params.user_input}". What do you'
+            " think about that?"
+        )
 
+    async def build_prompt(self) -> str:
         npcs_thoughts = await self.get_npcs_thoughts()
 
         prompt_for_llm_call = self.prepare_prompt_for_llm_call(npcs_thoughts=npcs_thoughts)
@@ -130,46 +151,42 @@ class DiscussionBuilder:
     async def get_npcs_thoughts(self) -> list[str]:
         thoughts = []
 
-        embedding_question = (
-            f'Here\'s what your Lord has to say to you and the other villagers: "{self.params.user_input}". What do you'
-            " think about that?"
-        )
-        query_embedding = await self.context["llm_client"].request_embedding(
-            input_str=embedding_question, model=EmbeddingsModel.TEXT_EMBEDDING_SMALL.value
+        npcs_best_thoughts = self.discussion_db.get_highest_scoring_thoughts(
+            query_embedding=self.query_embedding,
+            npc_entity_ids=[npc["entity_id"] for npc in self.npcs],
+            katana_ts=self.katana_ts,
         )
 
         for npc in self.npcs:
-            try:
-                (thought, katana_ts, cosine_similarity, score) = self.discussion_db.get_highest_scoring_thought(
-                    query_embedding=query_embedding, npc_entity_id=npc["entity_id"], katana_ts=self.katana_ts
+            if npc["entity_id"] not in npcs_best_thoughts:
+                logger.error(
+                    f"Failure to fetch thoughts. NPC entity id: {npc['entity_id']}. Embedding question"
+                    f" {self.embedding_question()}. Katana ts {self.katana_ts}"
                 )
+                raise RuntimeError(ErrorCodes.NO_THOUGHT_FOUND)
 
-                logger.info(f"Thought retrieved with a score of {score} (cos_sim: {cosine_similarity}) -> {thought}")
+            (thought, katana_ts, cosine_similarity, score) = npcs_best_thoughts[npc["entity_id"]]
 
-                date_time = datetime.fromtimestamp(katana_ts)
+            logger.info(f"Thought retrieved with a score of {score} (cos_sim: {cosine_similarity}) -> {thought}")
 
-                thoughts.append(f"Thought was had on {date_time} - {npc['full_name']} : {thought}")
+            date_time = datetime.fromtimestamp(katana_ts)
 
-            except RuntimeError as e:
-                logger.error(
-                    f"Failure to fetch thoughts. NPC entity id: {npc['entity_id']}. Embedding question"
-                    f" {embedding_question}. Katana ts {self.katana_ts}"
-                )
-                raise RuntimeError(ErrorCodes.NO_THOUGHT_FOUND) from e
+            thoughts.append(f"Thought was had on {date_time} - {npc['full_name']} : {thought}")
         return thoughts
 
     def store_discussion(self, discussion: StorableDiscussion) -> None:
-        self.discussion_db.insert_discussion(
-            discussion=discussion,
-        )
-
-        if self.most_important_event:
-            self.discussion_db.insert_or_update_events_to_ignore_today(
-                katana_ts=self.katana_ts,
-                realm_id=self.params.realm_id,
-                event_id=cast(int, self.most_important_event[0]),
+        with self.discussion_db.transaction():
+            self.discussion_db.insert_discussion(
+                discussion=discussion,
             )
 
+            if self.most_important_event:
+                self.discussion_db.insert_or_update_events_to_ignore_today(
+                    katana_ts=self.katana_ts,
+                    realm_id=self.params.realm_id,
+                    event_id=cast(int, self.most_important_event[0]),
+                )
+
     async def thoughts_task(self, dialogue: str) -> None:
         thoughts: DialogueThoughts = await self.request_thoughts_with_guard(prompt=dialogue)
         await self.store_thoughts(thoughts=thoughts)
@@ -178,30 +195,32 @@ class DiscussionBuilder:
         self,
         thoughts: DialogueThoughts,
     ) -> None:
+        """Embeds the first two thoughts of every npc in a single request and stores them in a single transaction"""
+        npcs_thoughts: list[tuple[int, Thought]] = []
         for npc_and_thoughts in thoughts.npcs:
-            await self.store_thoughts_per_npc(npc_and_thoughts=npc_and_thoughts)
-
-    async def store_thoughts_per_npc(self, npc_and_thoughts: NpcAndThoughts) -> None:
-        npc_entity_id = get_entity_id_from_name(npc_and_thoughts.full_name, self.npcs)
+            npc_entity_id = get_entity_id_from_name(npc_and_thoughts.full_name, self.npcs)
+            npcs_thoughts.append((npc_entity_id, npc_and_thoughts.thoughts[0]))
+            npcs_thoughts.append((npc_entity_id, npc_and_thoughts.thoughts[1]))
+
+        thoughts_str = [self.thought_to_str(thought) for (_, thought) in npcs_thoughts]
+        embeddings = await self.context["llm_client"].request_embeddings(
+            input_strs=thoughts_str,
+            model=EmbeddingsModel.TEXT_EMBEDDING_SMALL.value,
+            dimensions=self.discussion_db.embedding_profile["dimensions"],
+        )
 
-        first_thought = npc_and_thoughts.thoughts[0]
-        second_thought = npc_and_thoughts.thoughts[1]
+        with self.discussion_db.transaction():
+            for (npc_entity_id, thought), thought_str, embedding in zip(npcs_thoughts, thoughts_str, embeddings):
+                self.discussion_db.insert_npc_thought(
+                    npc_entity_id=npc_entity_id,
+                    thought=thought_str,
+                    poignancy=thought.poignancy,
+                    katana_ts=self.katana_ts,
+                    thought_embedding=embedding,
+                )
 
-        await self.embed_and_store_thought_and_embedding(thought=first_thought, npc_entity_id=npc_entity_id)
-        await self.embed_and_store_thought_and_embedding(thought=second_thought, npc_entity_id=npc_entity_id)
-
-    async def embed_and_store_thought_and_embedding(self, thought: Thought, npc_entity_id: int) -> None:
-        thought_str = f"Thought created during a conversation in {self.realm_name} - {thought.thought}"
-        embedding = await self.context["llm_client"].request_embedding(
-            input_str=thought_str, model=EmbeddingsModel.TEXT_EMBEDDING_SMALL.value
-        )
-        self.discussion_db.insert_npc_thought(
-            npc_entity_id=npc_entity_id,
-            thought=thought_str,
-            poignancy=thought.poignancy,
-            katana_ts=self.katana_ts,
-            thought_embedding=embedding,
-        )
+    def thought_to_str(self, thought: Thought) -> str:
+        return f"Thought created during a conversation in {self.realm_name} - {thought.thought}"
 
     def prepare_prompt_for_llm_call(self, npcs_thoughts: list[str]) -> str:
         event_string = ""
@@ -252,6 +271,22 @@ class DiscussionBuilder:
         return response  # type: ignore[no-any-return]
 
 
+async def gather_or_cancel(*aws: Awaitable[Any]) -> list[Any]:
+    """Like asyncio.gather, but the first failure cancels the awaitables still running before it is raised"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        (_, pending) = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    errors = [task.exception() for task in tasks if not task.cancelled() and task.exception() is not None]
+    if errors:
+        raise cast(BaseException, errors[0])
+    return [task.result() for task in tasks]
+
+
 async def get_npcs(torii_client: ToriiClient, realm_entity_id: int) -> list[NpcEntity]:
     realm_npcs = await torii_client.get_npcs_by_realm_entity_id(realm_entity_id)
     if len(realm_npcs) < 2:
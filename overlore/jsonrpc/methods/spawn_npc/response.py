@@ -12,7 +12,7 @@ from overlore.jsonrpc.methods.spawn_npc.constants import (
     NPC_PROFILE_USER_STRING,
 )
 from overlore.katana.client import KatanaClient
-from overlore.llm.client import AsyncOpenAiClient
+from overlore.llm.client import LlmClient
 from overlore.llm.constants import ChatCompletionModel
 from overlore.llm.guard import AsyncGuard
 from overlore.llm.natural_language_formatter import LlmFormatter
@@ -37,7 +37,7 @@ class RandGenerator:
 
 class Context(TypedDict):
     guard: AsyncGuard
-    llm_client: AsyncOpenAiClient
+    llm_client: LlmClient
     torii_client: ToriiClient
     katana_client: KatanaClient
     lore_machine_pk: str
@@ -7,6 +7,7 @@ from aiohttp_cors import setup as cors_setup
 from jsonrpcserver import async_dispatch
 
 from overlore.config import BootConfig
+from overlore.http_sessions import HttpSessions
 from overlore.jsonrpc.types import JsonRpcMethod
 from overlore.jsonrpc.utils import snake_to_camel
 
@@ -59,10 +60,16 @@ def launch_json_rpc_server_loop(runner: web.AppRunner, config: BootConfig) -> No
     loop.run_forever()
 
 
+async def close_http_sessions(_app: web.Application) -> None:
+    await HttpSessions.instance().close()
+
+
 def create_aiohttp_server(methods: list[JsonRpcMethod]) -> web.AppRunner:
     app = web.Application()
 
     app[methods_key] = methods
+    # upstream sessions opened by the methods belong to the server's event loop
+    app.on_cleanup.append(close_http_sessions)
 
     routes = [web.post("/", handle_http_request)]
     app.router.add_routes(routes)
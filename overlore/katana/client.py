@@ -1,9 +1,11 @@
+import asyncio
 import json
 from typing import Any, cast
 
 import aiohttp
 
 from overlore.errors import ErrorCodes
+from overlore.http_sessions import HttpSessions
 
 
 class KatanaClient:
@@ -23,22 +25,17 @@ class KatanaClient:
 
     async def _query_katana_node(self, method: str, params: dict[str, Any]) -> Any:
         try:
-            headers = {"Content-Type": "application/json"}
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url=self.url,
-                    headers=headers,
-                    data=json.dumps(
-                        {
-                            "jsonrpc": "2.0",
-                            "method": method,
-                            "params": params,
-                            "id": 1,
-                        }
-                    ),
-                    timeout=1000,
-                ) as response:
-                    response = await response.json()
-        except aiohttp.ClientConnectorError as err:
+            async with HttpSessions.instance().session(self.url).post(
+                url=self.url,
+                data=json.dumps(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": method,
+                        "params": params,
+                        "id": 1,
+                    }
+                ),
+            ) as response:
+                return await response.json()
+        except (aiohttp.ClientConnectorError, asyncio.TimeoutError) as err:
             raise RuntimeError(ErrorCodes.KATANA_UNAVAILABLE) from err
-        return response
@@ -1,17 +1,24 @@
+import base64
 from abc import ABC, abstractmethod
 from typing import Any, cast
 
 import openai
 
+from overlore.types import Embedding
+
 
 class LlmClient(ABC):
     """Interface used to define how an LLM client should behave"""
 
     @abstractmethod
-    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> list[float]:
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
         """Request an embedding of the input string"""
         pass
 
+    async def request_embeddings(self, input_strs: list[str], *args: Any, **kwargs: Any) -> list[Embedding]:
+        """Request the embeddings of several input strings, in the same order"""
+        return [await self.request_embedding(input_str, *args, **kwargs) for input_str in input_strs]
+
     @abstractmethod
     async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
         """Request the completion of an input to a LLM"""
@@ -24,9 +31,18 @@ class AsyncOpenAiClient(LlmClient):
     def __init__(self) -> None:
         self.client = openai.AsyncClient()
 
-    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> list[float]:
-        response = await self.client.embeddings.create(input=input_str, **kwargs)
-        return response.data[0].embedding
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+        # base64 is the float32 buffer of the embedding, kept packed instead of being decoded to python floats
+        response = await self.client.embeddings.create(input=input_str, encoding_format="base64", **kwargs)
+        return base64.b64decode(cast(str, response.data[0].embedding))
+
+    async def request_embeddings(self, input_strs: list[str], *args: Any, **kwargs: Any) -> list[Embedding]:
+        if len(input_strs) == 0:
+            return []
+        response = await self.client.embeddings.create(input=input_strs, encoding_format="base64", **kwargs)
+        return [
+            base64.b64decode(cast(str, data.embedding)) for data in sorted(response.data, key=lambda data: data.index)
+        ]
 
     async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
         response = await self.client.chat.completions.create(
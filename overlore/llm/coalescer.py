@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Any, Hashable
+from weakref import WeakKeyDictionary
+
+from overlore.errors import ErrorCodes
+from overlore.llm.client import LlmClient
+from overlore.types import Embedding
+
+logger = logging.getLogger("overlore")
+
+# Time the first input of a batch waits for others to join it
+DEFAULT_MAX_WAIT_S = 0.005
+# Inputs sent in a single embeddings call, OpenAI accepts up to 2048
+DEFAULT_MAX_BATCH = 64
+
+BatchKey = tuple[Hashable, ...]
+
+
+class PendingBatch:
+    def __init__(self, args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+        self.args = args
+        self.kwargs = kwargs
+        self.input_strs: list[str] = []
+        self.futures: list[asyncio.Future[Embedding]] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class CoalescingLlmClient(LlmClient):
+    """Groups the embedding requests made within max_wait_s of each other into a single call of the wrapped client.
+
+    Only requests with the same arguments (model, dimensions, ...) share a batch. A batch is sent as soon as it holds
+    max_batch inputs. Pending batches belong to the event loop of their requests, the client can be shared between
+    the json-rpc server thread and the torii subscriptions."""
+
+    def __init__(
+        self, client: LlmClient, max_wait_s: float = DEFAULT_MAX_WAIT_S, max_batch: int = DEFAULT_MAX_BATCH
+    ) -> None:
+        self.client = client
+        self.max_wait_s = max_wait_s
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[BatchKey, PendingBatch]] = WeakKeyDictionary()
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+        return (await self.request_embeddings([input_str], *args, **kwargs))[0]
+
+    async def request_embeddings(self, input_strs: list[str], *args: Any, **kwargs: Any) -> list[Embedding]:
+        loop = asyncio.get_running_loop()
+        batches = self._batches_of(loop)
+        key = (args, tuple(sorted(kwargs.items())))
+
+        futures = []
+        for input_str in input_strs:
+            batch = batches.get(key)
+            if batch is None:
+                batch = batches[key] = PendingBatch(args, kwargs)
+                batch.timer = loop.call_later(self.max_wait_s, self._flush, batches, key)
+            future: asyncio.Future[Embedding] = loop.create_future()
+            batch.input_strs.append(input_str)
+            batch.futures.append(future)
+            futures.append(future)
+            if len(batch.input_strs) >= self.max_batch:
+                self._flush(batches, key)
+
+        return list(await asyncio.gather(*futures))
+
+    def _batches_of(self, loop: asyncio.AbstractEventLoop) -> dict[BatchKey, PendingBatch]:
+        with self._lock:
+            if loop not in self._pending:
+                self._pending[loop] = {}
+            return self._pending[loop]
+
+    def _flush(self, batches: dict[BatchKey, PendingBatch], key: BatchKey) -> None:
+        batch = batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: PendingBatch) -> None:
+        logger.debug(f"Requesting a batch of {len(batch.input_strs)} embeddings")
+        try:
+            embeddings = await self.client.request_embeddings(batch.input_strs, *batch.args, **batch.kwargs)
+        except Exception as e:
+            self._fail(batch.futures, e)
+            return
+        for future, embedding in zip(batch.futures, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+        # requests whose input got no embedding back would otherwise wait forever
+        if len(embeddings) < len(batch.futures):
+            logger.error(f"Received {len(embeddings)} embeddings for a batch of {len(batch.futures)} inputs")
+            self._fail(batch.futures[len(embeddings) :], RuntimeError(ErrorCodes.MISSING_EMBEDDINGS))
+
+    def _fail(self, futures: list[asyncio.Future[Embedding]], error: Exception) -> None:
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
+        return await self.client.request_prompt_completion(prompt, instructions, *args, **kwargs)
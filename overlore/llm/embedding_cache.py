@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, TypedDict, cast
+
+from overlore.llm.client import LlmClient
+from overlore.sqlite.discussion_db import pack_embedding
+from overlore.sqlite.embedding_cache_db import EmbeddingCacheDatabase
+from overlore.types import Embedding
+
+logger = logging.getLogger("overlore")
+
+# Most recent embeddings kept in memory in front of the database
+MEMORY_CACHE_SIZE = 256
+
+EmbeddingKey = tuple[str, int, str]
+
+
+class EmbeddingCacheMetrics(TypedDict):
+    memory_hits: int
+    disk_hits: int
+    misses: int
+
+
+class CachedLlmClient(LlmClient):
+    """Serves embeddings already requested for the same (model, dimensions, text) from an in-memory LRU, then
+    from the embedding cache database, and only asks the wrapped client on a miss.
+    The client is shared between the json-rpc server thread and the torii subscriptions, the LRU and the metrics are
+    guarded by a lock"""
+
+    def __init__(self, client: LlmClient, memory_cache_size: int = MEMORY_CACHE_SIZE) -> None:
+        self.client = client
+        self.cache_db = EmbeddingCacheDatabase.instance()
+        self.memory_cache: OrderedDict[EmbeddingKey, bytes] = OrderedDict()
+        self.memory_cache_size = memory_cache_size
+        self.metrics = EmbeddingCacheMetrics(memory_hits=0, disk_hits=0, misses=0)
+        self._lock = threading.Lock()
+
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+        return (await self.request_embeddings([input_str], *args, **kwargs))[0]
+
+    async def request_embeddings(self, input_strs: list[str], *args: Any, **kwargs: Any) -> list[Embedding]:
+        """Looks every input up in the cache, the misses are then requested in a single batch"""
+        keys = [(str(kwargs.get("model", "")), int(kwargs.get("dimensions") or 0), sha256(text)) for text in input_strs]
+        embeddings: list[bytes | None] = [self._lookup(key) for key in keys]
+
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            with self._lock:
+                self.metrics["misses"] += len(misses)
+            requested = await self.client.request_embeddings([input_strs[i] for i in misses], *args, **kwargs)
+            for i, requested_embedding in zip(misses, requested):
+                embedding = pack_embedding(requested_embedding)
+                self.cache_db.insert_embedding(*keys[i], embedding)
+                self._remember(keys[i], embedding)
+                embeddings[i] = embedding
+
+        with self._lock:
+            metrics = dict(self.metrics)
+        logger.debug(f"Embedding cache metrics: {metrics}")
+        return cast(list[Embedding], embeddings)
+
+    def _lookup(self, key: EmbeddingKey) -> bytes | None:
+        with self._lock:
+            embedding = self.memory_cache.get(key)
+            if embedding is not None:
+                self.memory_cache.move_to_end(key)
+                self.metrics["memory_hits"] += 1
+                return embedding
+
+        embedding = self.cache_db.fetch_embedding(*key)
+        if embedding is not None:
+            with self._lock:
+                self.metrics["disk_hits"] += 1
+            self._remember(key, embedding)
+        return embedding
+
+    def _remember(self, key: EmbeddingKey, embedding: bytes) -> None:
+        with self._lock:
+            self.memory_cache[key] = embedding
+            if len(self.memory_cache) > self.memory_cache_size:
+                self.memory_cache.popitem(last=False)
+
+    async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
+        return await self.client.request_prompt_completion(prompt, instructions, *args, **kwargs)
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
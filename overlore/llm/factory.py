@@ -0,0 +1,16 @@
+from overlore.config import BootConfig
+from overlore.llm.client import AsyncOpenAiClient, LlmClient
+from overlore.llm.coalescer import CoalescingLlmClient
+from overlore.llm.embedding_cache import CachedLlmClient
+
+
+def create_llm_client(config: BootConfig) -> LlmClient:
+    """OpenAI client batching and caching its embeddings. The OpenAI connections belong to the event loop which
+    first uses them, create one client per loop and share it between everything running on that loop"""
+    return CachedLlmClient(
+        CoalescingLlmClient(
+            AsyncOpenAiClient(),
+            max_wait_s=config.embedding_max_wait_ms / 1000,
+            max_batch=config.embedding_max_batch,
+        )
+    )
@@ -5,21 +5,34 @@ import time
 from types import FrameType
 
 from overlore.config import BootConfig
+from overlore.http_sessions import HttpSessions
 from overlore.jsonrpc.constants import setup_json_rpc_methods
 from overlore.jsonrpc.setup import launch_json_rpc_server
+from overlore.llm.factory import create_llm_client
 from overlore.mocks import setup_mock_json_rpc_methods
-from overlore.sqlite.discussion_db import DiscussionDatabase
+from overlore.sqlite.discussion_db import DiscussionDatabase, ThoughtEmbeddingProfile
+from overlore.sqlite.embedding_cache_db import EmbeddingCacheDatabase
 from overlore.sqlite.events_db import EventsDatabase
 from overlore.sqlite.npc_db import NpcDatabase
+from overlore.sqlite.types import LastSeenEvent
+from overlore.torii.boot_sync import SYNCED_EVENT_TYPES, BootSync, SpawnCallback
 from overlore.torii.client import ToriiClient
-from overlore.torii.subscriptions import TORII_SUBSCRIPTIONS, use_torii_subscription
+from overlore.torii.constants import EventType
+from overlore.torii.reconciliation import Reconciler
+from overlore.torii.subscriptions import (
+    MULTIPLEXED_SUBSCRIPTION_TASK_NAME,
+    Subscriptions,
+    create_torii_subscriptions,
+    process_received_spawn_npc_event,
+    use_torii_subscription,
+)
 
 logger = logging.getLogger("overlore")
 
 
 async def cancel_all_tasks() -> None:
-    subscriptions_names = [sub.name for (sub, _) in TORII_SUBSCRIPTIONS]
-    tasks = [task for task in asyncio.all_tasks() if task.get_name() in subscriptions_names]
+    tasks_names = [sub.name for sub in Subscriptions] + [MULTIPLEXED_SUBSCRIPTION_TASK_NAME]
+    tasks = [task for task in asyncio.all_tasks() if task.get_name() in tasks_names]
     for task in tasks:
         logger.info(f"Cancelling task: {task.get_name()}")
         task.cancel()
@@ -35,15 +48,20 @@ def setup() -> BootConfig:
     signal.signal(signal.SIGINT, handle_sigint)
 
     config = BootConfig()
+    embedding_profile = ThoughtEmbeddingProfile(dimensions=config.embedding_dimensions)
 
     if config.mock:
         EventsDatabase.instance().init(":memory:")
-        DiscussionDatabase.instance().init(":memory:")
+        DiscussionDatabase.instance().init(
+            ":memory:", thought_store=config.thought_store, embedding_profile=embedding_profile
+        )
         NpcDatabase.instance().init(":memory:")
+        EmbeddingCacheDatabase.instance().init(":memory:")
     else:
         EventsDatabase.instance().init()
-        DiscussionDatabase.instance().init()
+        DiscussionDatabase.instance().init(thought_store=config.thought_store, embedding_profile=embedding_profile)
         NpcDatabase.instance().init()
+        EmbeddingCacheDatabase.instance().init()
 
     return config
 
@@ -55,24 +73,44 @@ async def launch_services(config: BootConfig) -> None:
     logger.info(f"Starting JSON-RPC server on {config.env['HOST_ADDRESS']}:{config.env['HOST_PORT']}")
 
     if config.mock is False:
-        await use_torii_subscription(config=config, callback_and_subs=TORII_SUBSCRIPTIONS)
+        # the json-rpc server runs its own loop and client, this one serves every subscription of this loop
+        llm_client = create_llm_client(config=config)
+        # the server answers with the events already stored while the backfill runs
+        events_db = EventsDatabase.instance()
+        reconciler = Reconciler(
+            backfill=lambda event_types, since: sync_services(
+                config=config,
+                event_types=event_types,
+                since=since,
+                on_spawn=lambda event: process_received_spawn_npc_event(event, config, llm_client),
+            ),
+            last_seen=events_db.fetch_last_seen(),
+            store_last_seen=events_db.store_last_seen,
+        )
+        callback_and_subs = create_torii_subscriptions(llm_client=llm_client)
+        await use_torii_subscription(config=config, callback_and_subs=callback_and_subs, reconciler=reconciler)
     else:
         while True:
             time.sleep(2)
 
 
-async def sync_services(config: BootConfig) -> None:
+async def sync_services(
+    config: BootConfig,
+    event_types: list[EventType] = SYNCED_EVENT_TYPES,
+    since: dict[str, LastSeenEvent] | None = None,
+    on_spawn: SpawnCallback | None = None,
+) -> int:
     torii_client = ToriiClient(url=config.env["TORII_GRAPHQL"])
-    await torii_client.boot_sync()
+    return await BootSync(torii_client, event_types, since, on_spawn).run()
 
 
 async def start() -> None:
     config = setup()
 
-    if config.mock is False:
-        await sync_services(config=config)
-
-    await launch_services(config=config)
+    try:
+        await launch_services(config=config)
+    finally:
+        await HttpSessions.instance().close()
 
 
 def main() -> None:
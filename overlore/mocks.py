@@ -18,6 +18,7 @@ from overlore.types import (
     Characteristics,
     DialogueThoughts,
     Discussion,
+    Embedding,
     NpcAndThoughts,
     NpcEntity,
     NpcIdentity,
@@ -36,7 +37,7 @@ class MockLlmClient(LlmClient):
         self.thoughts_completion_return = thoughts_completion_return
         self.call_number = 0
 
-    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> list[float]:
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
         return self.embedding_return
 
     async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
@@ -109,7 +110,7 @@ def generate_discussion_json_rpc_method() -> JsonRpcMethod:
     context = GenerateDiscussionContext(
         discussion_guard=discussion_guard,
         dialogue_thoughts_guard=dialogue_thoughts_guard,
-        llm_client=mock_llm_client,  # type: ignore[typeddict-item]
+        llm_client=mock_llm_client,
         torii_client=mock_torii_client,  # type: ignore[typeddict-item]
         katana_client=mock_katana_client,  # type: ignore[typeddict-item]
     )
@@ -130,7 +131,7 @@ def generate_npc_profile_json_rpc_method() -> JsonRpcMethod:
     guard = AsyncGuard(output_type=NpcIdentity)
     context = SpawnNpcContext(
         guard=guard,
-        llm_client=mock_llm_client,  # type: ignore[typeddict-item]
+        llm_client=mock_llm_client,
         torii_client=mock_torii_client,  # type: ignore[typeddict-item]
         katana_client=mock_katana_client,  # type: ignore[typeddict-item]
         lore_machine_pk=TEST_PRIVATE_KEY,
@@ -1,16 +1,47 @@
 from __future__ import annotations
 
-import os
+import logging
+import threading
+from contextlib import contextmanager
 from sqlite3 import Connection
-from typing import Any, Callable
+from typing import Any, Callable, Iterator, TypedDict
 
 import sqlean
 
+logger = logging.getLogger("overlore")
+
 PreloadFunction = Callable[[Connection], None]
 FunctionCallable = Callable[..., Any | None]
 CustomFunction = tuple[str, int, FunctionCallable]
+# Statements bringing a schema from one version to the next, a database is at version N once MIGRATIONS[:N] ran
+Migration = list[str]
 
 THREADSAFE = "THREADSAFE=1"
+MEMORY_PATH = ":memory:"
+READ_STATEMENTS = ("SELECT", "WITH")
+# Databases created before schema versioning hold the schema of the first migration with a user_version of 0
+LEGACY_SCHEMA_VERSION = 1
+
+
+class PragmaProfile(TypedDict):
+    journal_mode: str
+    synchronous: str
+    mmap_size: int
+    cache_size: int
+    temp_store: str
+    busy_timeout: int
+
+
+# WAL lets readers run while a write is in progress, NORMAL sync only fsyncs on checkpoints in WAL mode,
+# a negative cache_size is expressed in KiB and busy_timeout is in milliseconds
+DEFAULT_PRAGMA_PROFILE = PragmaProfile(
+    journal_mode="WAL",
+    synchronous="NORMAL",
+    mmap_size=256 * 1024 * 1024,
+    cache_size=-64 * 1024,
+    temp_store="MEMORY",
+    busy_timeout=5000,
+)
 
 
 MAX_TIME_DAYS = 7
@@ -20,6 +51,10 @@ MAX_DISTANCE_M = 10000
 A_TIME = float(-10.0 / MAX_TIME_S)
 A_DISTANCE = float(-10.0 / MAX_DISTANCE_M)
 
+# Events outside of these bounds get a decay of 0, the extra unit keeps float rounding at the edges on the safe side
+TIME_WINDOW_S = MAX_TIME_S + 1
+DISTANCE_WINDOW_M = MAX_DISTANCE_M + 1
+
 
 def decay_function(a: float, b: float, x: float) -> float:
     y = (a * x) + b
@@ -35,64 +70,193 @@ def average(*args: Any) -> float:
     return float((sum(args)) / len(args))
 
 
+# SQL twins of decay_function and average. They evaluate the same floating point operations in the same order
+# as the Python callbacks, so scores are identical, but they run natively instead of calling back into Python per row
+def decay_sql(a: str, b: str, x: str) -> str:
+    return f"MAX(0.0, MIN(10.0, (({a}) * ({x})) + ({b})))"
+
+
+def average_sql(*args: str) -> str:
+    terms = " + ".join(f"({arg})" for arg in args)
+    return f"(({terms}) / {float(len(args))})"
+
+
 class BaseDatabase:
+    """Wraps a single writer connection and a pool of reader connections, one per thread.
+    In-memory databases only exist on the connection that created them, so they never pool readers"""
+
     db: Connection
+    _path: str
+    _extensions: list[str]
+    _functions: list[CustomFunction]
+    _preload_function: PreloadFunction
+    _pragmas: PragmaProfile
+    _transaction_depth: int
+    _transaction_owner: int | None
+    _after_commit: list[Callable[[], Any]]
+    _write_lock: threading.RLock
+    _readers: threading.local
+    _readers_lock: threading.Lock
+    _reader_connections: list[Connection]
+    _pool_readers: bool
 
     def __init__(self) -> None:
         raise RuntimeError(f"{self.__class__.__name__}: call _init from child")
 
-    def _load_extensions(self, extensions: list[str]) -> None:
+    def _load_extensions(self, extensions: list[str], connection: Connection | None = None) -> None:
+        connection = connection if connection is not None else self.db
         for ext in extensions:
-            self.db.load_extension(ext)
+            connection.load_extension(ext)
 
-    def _insert(self, query: str, values: tuple[Any, ...]) -> int:
-        cursor = self.db.cursor()
-        cursor.execute(query, values)
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Groups every write issued inside the block into a single commit.
+        Nested blocks join the outermost one, which commits on success and rolls back on error"""
+        with self._write_lock:
+            # sqlite3 only opens a transaction on its own before DML, schema changes would be committed right away
+            if self._transaction_depth == 0 and not self.db.in_transaction:
+                self.db.execute("BEGIN;")
+            self._transaction_depth += 1
+            self._transaction_owner = threading.get_ident()
+            try:
+                yield
+            except BaseException:
+                self._end_transaction(commit=False)
+                raise
+            self._end_transaction(commit=True)
+
+    def _end_transaction(self, commit: bool) -> None:
+        self._transaction_depth -= 1
+        if self._transaction_depth > 0:
+            return
+        self._transaction_owner = None
+        (callbacks, self._after_commit) = (self._after_commit, [])
+        if not commit:
+            self.db.rollback()
+            return
         self.db.commit()
-        added_id = cursor.lastrowid if cursor.lastrowid else 0
+        for callback in callbacks:
+            callback()
+
+    def _on_commit(self, callback: Callable[[], Any]) -> None:
+        """Runs the callback once the writes issued so far are committed, right away outside of a transaction"""
+        with self._write_lock:
+            if self._transaction_depth == 0:
+                callback()
+            else:
+                self._after_commit.append(callback)
+
+    def _commit(self) -> None:
+        if self._transaction_depth == 0:
+            self.db.commit()
+
+    def _insert(self, query: str, values: tuple[Any, ...]) -> int:
+        with self._write_lock:
+            cursor = self.db.cursor()
+            cursor.execute(query, values)
+            self._commit()
+        # lastrowid keeps the previous rowid when a conflict clause skipped the insert
+        added_id = cursor.lastrowid if cursor.rowcount > 0 and cursor.lastrowid else 0
         return added_id
 
+    def _insert_many(self, query: str, values: list[tuple[Any, ...]]) -> int:
+        with self._write_lock:
+            cursor = self.db.cursor()
+            cursor.executemany(query, values)
+            self._commit()
+        added_entries_count = cursor.rowcount
+        return added_entries_count
+
     def _update(self, query: str, values: tuple[Any, ...]) -> int:
-        cursor = self.db.cursor()
-        cursor.execute(query, values)
-        self.db.commit()
+        with self._write_lock:
+            cursor = self.db.cursor()
+            cursor.execute(query, values)
+            self._commit()
         updated_entries_count = cursor.rowcount
         return updated_entries_count
 
     def _delete(self, query: str, values: tuple[Any, ...]) -> None:
-        cursor = self.db.cursor()
-        cursor.execute(query, values)
-        self.db.commit()
+        with self._write_lock:
+            cursor = self.db.cursor()
+            cursor.execute(query, values)
+            self._commit()
+
+    def _apply_pragmas(self, pragmas: PragmaProfile, connection: Connection | None = None) -> None:
+        connection = connection if connection is not None else self.db
+        for name, value in pragmas.items():
+            connection.execute(f"PRAGMA {name}={value};")
 
-    def _use_first_boot_queries(self, queries: list[str]) -> None:
+    def _apply_migration(self, queries: Migration) -> None:
         for query in queries:
             self.db.execute(query)
 
+    def _schema_version(self) -> int:
+        version: int = self.db.execute("PRAGMA user_version;").fetchone()[0]
+        if version == 0 and self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1;").fetchone():
+            return LEGACY_SCHEMA_VERSION
+        return version
+
+    def _migrate(self, migrations: list[Migration]) -> None:
+        current_version = self._schema_version()
+        for version, migration in enumerate(migrations[current_version:], start=current_version + 1):
+            logger.info(f"Migrating {self.__class__.__name__} schema to version {version}")
+            with self.transaction():
+                self._apply_migration(migration)
+                self.db.execute(f"PRAGMA user_version={version};")
+
     def execute_query(self, query: str, params: tuple[Any, ...]) -> list[Any]:
-        cursor = self.db.cursor()
-        cursor.execute(query, params)
-        records = cursor.fetchall()
+        if self._is_pooled_read(query):
+            cursor = self._reader().cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        with self._write_lock:
+            cursor = self.db.cursor()
+            cursor.execute(query, params)
+            records = cursor.fetchall()
         return records
 
+    def _is_pooled_read(self, query: str) -> bool:
+        if not self._pool_readers:
+            return False
+        # a thread inside a transaction must keep reading through the writer to see its own uncommitted writes
+        if self._transaction_depth > 0 and self._transaction_owner == threading.get_ident():
+            return False
+        return query.lstrip().upper().startswith(READ_STATEMENTS)
+
+    def _reader(self) -> Connection:
+        reader: Connection | None = getattr(self._readers, "connection", None)
+        if reader is None:
+            reader = self._connect()
+            reader.execute("PRAGMA query_only=1;")
+            with self._readers_lock:
+                self._reader_connections.append(reader)
+            self._readers.connection = reader
+        return reader
+
     def close_conn(self) -> None:
+        self._pool_readers = False
+        with self._readers_lock:
+            for reader in self._reader_connections:
+                reader.close()
+            self._reader_connections = []
         self.db.close()
 
-    def create_db_functions(self, functions: list[CustomFunction]) -> None:
-        for func in functions:
-            self.db.create_function(name=func[0], narg=func[1], func=func[2])
+    def create_db_functions(self, functions: list[CustomFunction], connection: Connection | None = None) -> None:
+        if connection is not None:
+            for func in functions:
+                connection.create_function(name=func[0], narg=func[1], func=func[2])
+            return
 
-    def _init(
-        self,
-        path: str,
-        extensions: list[str],
-        migrations: list[str],
-        functions: list[CustomFunction],
-        preload: PreloadFunction,
-    ) -> None:
-        db_first_launch = not os.path.exists(path)
+        self._functions = [*self._functions, *functions]
+        with self._readers_lock:
+            connections = [self.db, *self._reader_connections]
+        for conn in connections:
+            self.create_db_functions(functions, connection=conn)
 
-        self.db: Connection = sqlean.connect(path, check_same_thread=False)
-        threadsafety = self.db.execute(
+    def _connect(self) -> Connection:
+        connection: Connection = sqlean.connect(self._path, check_same_thread=False)
+        threadsafety = connection.execute(
             """
             select * from pragma_compile_options
             where compile_options like 'THREADSAFE=%'
@@ -101,11 +265,41 @@ class BaseDatabase:
         if threadsafety != THREADSAFE:
             raise SystemError("SQlean is not configured for thread safety")
 
-        self.db.enable_load_extension(True)
-        preload(self.db)
-        self._load_extensions(extensions)
-        self.db.enable_load_extension(False)
+        self._apply_pragmas(self._pragmas, connection=connection)
+
+        connection.enable_load_extension(True)
+        self._preload_function(connection)
+        self._load_extensions(self._extensions, connection=connection)
+        connection.enable_load_extension(False)
+
+        self.create_db_functions(self._functions, connection=connection)
+        return connection
+
+    def _init(
+        self,
+        path: str,
+        extensions: list[str],
+        migrations: list[Migration],
+        functions: list[CustomFunction],
+        preload: PreloadFunction,
+        pragmas: PragmaProfile = DEFAULT_PRAGMA_PROFILE,
+    ) -> None:
+        self._path = path
+        self._extensions = extensions
+        self._functions = []
+        self._preload_function = preload
+        self._pragmas = pragmas
+
+        self._transaction_depth = 0
+        self._transaction_owner = None
+        self._after_commit = []
+        self._write_lock = threading.RLock()
+        self._readers = threading.local()
+        self._readers_lock = threading.Lock()
+        self._reader_connections = []
+        self._pool_readers = path != MEMORY_PATH
+
+        self.db = self._connect()
 
-        if db_first_launch:
-            self._use_first_boot_queries(migrations)
+        self._migrate(migrations)
         self.create_db_functions(functions)
@@ -2,51 +2,139 @@ from __future__ import annotations
 
 import json
 import logging
+import math
+import struct
 from sqlite3 import Connection
-from typing import Tuple, cast
+from typing import Tuple, TypedDict, cast
 
 import sqlite_vss
 
 from overlore.errors import ErrorCodes
-from overlore.sqlite.base_db import A_TIME, BaseDatabase, average, decay_function
+from overlore.sqlite.base_db import (
+    A_TIME,
+    DEFAULT_PRAGMA_PROFILE,
+    BaseDatabase,
+    Migration,
+    PragmaProfile,
+    average,
+    decay_function,
+)
+from overlore.sqlite.thought_store import NUMPY_AVAILABLE, ThoughtStore
 from overlore.sqlite.types import StorableDiscussion
+from overlore.types import Embedding
 
 logger = logging.getLogger("overlore")
 
 
+class ThoughtEmbeddingProfile(TypedDict):
+    # text-embedding-3 embeddings can be shortened (512, 256, ...), 1536 is the full text-embedding-3-small size
+    dimensions: int
+
+
+DEFAULT_EMBEDDING_PROFILE = ThoughtEmbeddingProfile(dimensions=1536)
+
+# Thoughts of the requested npcs are read through the npc_entity_id index and scored against the query embedding,
+# then blended with poignancy and recency. Only the best thought of each npc is kept.
+# Npc entity ids are bound as a json array
+THOUGHT_SCORE_QUERY = """
+    SELECT npc_entity_id, thought, ts, cos_similarity, score FROM (
+        SELECT npc_entity_id, thought, ts, cos_similarity, score,
+        ROW_NUMBER() OVER (PARTITION BY npc_entity_id ORDER BY score DESC) AS rank
+        FROM (
+            SELECT npc_entity_id, thought, average(cos_similarity, poignancy, decayFunction(?, 10, ? - ts)) as score, cos_similarity, ts
+            FROM (
+                SELECT vss_cosine_similarity(?, embedding) * 10.0 AS cos_similarity, npc_entity_id, thought, poignancy, ts
+                FROM npc_thought
+                WHERE npc_entity_id IN (SELECT value FROM json_each(?))
+            )
+        )
+    )
+    WHERE rank = 1
+"""
+
+
+def pack_embedding(embedding: Embedding) -> bytes:
+    if isinstance(embedding, bytes):
+        return embedding
+    return struct.pack(f"<{len(embedding)}f", *embedding)
+
+
+def unpack_embedding(embedding: Embedding) -> list[float]:
+    if isinstance(embedding, bytes):
+        return list(struct.unpack(f"<{len(embedding) // 4}f", embedding))
+    return embedding
+
+
+def normalize(embedding: Embedding) -> bytes:
+    values = unpack_embedding(embedding)
+    norm = math.sqrt(sum(value * value for value in values))
+    return pack_embedding([value / norm for value in values] if norm > 0.0 else values)
+
+
+def fit_embedding(embedding: Embedding, dimensions: int) -> bytes:
+    """Shortens a text-embedding-3 embedding the way its dimensions parameter does, by keeping its first
+    dimensions and normalizing them"""
+    size = len(embedding) // 4 if isinstance(embedding, bytes) else len(embedding)
+    if size <= dimensions:
+        return pack_embedding(embedding)
+    return normalize(unpack_embedding(embedding)[:dimensions])
+
+
 class DiscussionDatabase(BaseDatabase):
     _instance: DiscussionDatabase | None = None
+    PRAGMAS: PragmaProfile = DEFAULT_PRAGMA_PROFILE
     EXTENSIONS: list[str] = []
-    MIGRATIONS: list[str] = [
-        """
-            CREATE TABLE IF NOT EXISTS discussion (
-                discussion JSON,
-                user_input TEXT,
-                input_score INTEGER,
-                realm_id INTEGER NOT NULL,
-                ts INTEGER NOT NULL
-            );
-        """,
-        """
-            CREATE TABLE IF NOT EXISTS events_to_ignore_today (
-                realm_id INTEGER PRIMARY KEY,
-                creation_ts INTEGER NOT NULL,
-                events_id TEXT
-            );
-        """,
-        """
-            CREATE TABLE IF NOT EXISTS npc_thought (
-                npc_entity_id INTEGER NOT NULL,
-                thought TEXT,
-                poignancy INTEGER,
-                ts INTEGER
-            );
-        """,
-        """
-            CREATE VIRTUAL TABLE IF NOT EXISTS vss_npc_thought using vss0(
-                embedding(1536)
-            );
-        """,
+    thought_store: ThoughtStore | None
+    embedding_profile: ThoughtEmbeddingProfile
+    MIGRATIONS: list[Migration] = [
+        [
+            """
+                CREATE TABLE IF NOT EXISTS discussion (
+                    discussion JSON,
+                    user_input TEXT,
+                    input_score INTEGER,
+                    realm_id INTEGER NOT NULL,
+                    ts INTEGER NOT NULL
+                );
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS events_to_ignore_today (
+                    realm_id INTEGER PRIMARY KEY,
+                    creation_ts INTEGER NOT NULL,
+                    events_id TEXT
+                );
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS npc_thought (
+                    npc_entity_id INTEGER NOT NULL,
+                    thought TEXT,
+                    poignancy INTEGER,
+                    ts INTEGER
+                );
+            """,
+            """
+                CREATE VIRTUAL TABLE IF NOT EXISTS vss_npc_thought using vss0(
+                    embedding(1536)
+                );
+            """,
+        ],
+        [
+            """CREATE INDEX IF NOT EXISTS discussion_realm_id_ts_idx ON discussion (realm_id, ts);""",
+            """CREATE INDEX IF NOT EXISTS npc_thought_npc_entity_id_idx ON npc_thought (npc_entity_id);""",
+        ],
+        [
+            # vss0 can neither look embeddings up by rowid nor filter a search, every lookup of a few npcs scanned
+            # the thoughts of all of them. The embeddings are now also kept in npc_thought, whose npc_entity_id
+            # index partitions them by npc
+            """ALTER TABLE npc_thought ADD COLUMN embedding BLOB;""",
+            """
+                UPDATE npc_thought SET embedding = stored.embedding
+                FROM (SELECT rowid AS thought_rowid, embedding FROM vss_npc_thought) AS stored
+                WHERE stored.thought_rowid = npc_thought.rowid;
+            """,
+            # embeddings are only scored from npc_thought, the vss0 copy would double their size on disk
+            """DROP TABLE vss_npc_thought;""",
+        ],
     ]
 
     @classmethod
@@ -62,44 +150,91 @@ class DiscussionDatabase(BaseDatabase):
     def _preload(self, db: Connection) -> None:
         sqlite_vss.load(db)
 
-    def init(self, path: str = "./databases/discussion.db") -> DiscussionDatabase:
+    def init(
+        self,
+        path: str = "./databases/discussion.db",
+        pragmas: PragmaProfile | None = None,
+        thought_store: bool = False,
+        embedding_profile: ThoughtEmbeddingProfile = DEFAULT_EMBEDDING_PROFILE,
+    ) -> DiscussionDatabase:
         self._init(
             path=path,
             extensions=self.EXTENSIONS,
             migrations=self.MIGRATIONS,
             functions=[("average", -1, average), ("decayFunction", 3, decay_function)],
             preload=self._preload,
+            pragmas=pragmas if pragmas is not None else self.PRAGMAS,
         )
+        self._apply_embedding_profile(embedding_profile)
+        self.thought_store = None
+        if thought_store:
+            self.warm_thought_store()
         return self
 
-    def get_highest_scoring_thought(
-        self, query_embedding: list[float], npc_entity_id: int, katana_ts: int
-    ) -> tuple[str, int, float, float]:
-        query = """
-            SELECT thought, ts, cos_similarity, score FROM (
-                SELECT thought, average(cos_similarity, poignancy, decayFunction(?, 10, ? - ts)) as score, cos_similarity, ts
-                FROM(
-                    SELECT vss_cosine_similarity(?, vss_npc_thought.embedding) * 10.0 AS cos_similarity, npc_thought.thought, npc_thought.poignancy, npc_thought.ts
-                    FROM vss_npc_thought
-                    INNER JOIN npc_thought ON vss_npc_thought.rowid = npc_thought.rowid
-                    WHERE npc_thought.npc_entity_id = ?
-                )
-                ORDER BY score DESC
+    def _stored_embedding_profile(self) -> ThoughtEmbeddingProfile | None:
+        """Profile of the stored embeddings, None until the first thought is stored"""
+        size = self.execute_query("SELECT length(embedding) FROM npc_thought WHERE embedding IS NOT NULL LIMIT 1;", ())
+        if not size:
+            return None
+        return ThoughtEmbeddingProfile(dimensions=size[0][0] // 4)
+
+    def _apply_embedding_profile(self, embedding_profile: ThoughtEmbeddingProfile) -> None:
+        """Shortens the stored embeddings when the profile has less dimensions than them"""
+        stored_profile = self._stored_embedding_profile()
+        if stored_profile is None or stored_profile == embedding_profile:
+            self.embedding_profile = embedding_profile
+            return
+        self.embedding_profile = stored_profile
+        if embedding_profile["dimensions"] > stored_profile["dimensions"]:
+            raise RuntimeError(ErrorCodes.EMBEDDING_DIMENSIONS_TOO_LARGE)
+
+        logger.info(f"Shortening thought embeddings from {stored_profile} to {embedding_profile}")
+        # a failed rebuild rolls every embedding back, the profile is only kept once the rebuild is committed
+        with self.transaction():
+            self._insert_many(
+                "UPDATE npc_thought SET embedding = ? WHERE rowid = ?;",
+                [
+                    (fit_embedding(embedding, embedding_profile["dimensions"]), rowid)
+                    for (rowid, embedding) in self.execute_query(
+                        "SELECT rowid, embedding FROM npc_thought WHERE embedding IS NOT NULL;", ()
+                    )
+                ],
             )
-        """
-        values = (
-            A_TIME,
-            katana_ts,
-            json.dumps(query_embedding),
-            npc_entity_id,
-        )
+        self.embedding_profile = embedding_profile
+
+    def warm_thought_store(self) -> None:
+        """Loads every thought in memory, they are then scored by the thought store instead of sqlite"""
+        if not NUMPY_AVAILABLE:
+            logger.error("numpy is not installed, thoughts will be scored by sqlite")
+            return
+        thought_store = ThoughtStore()
+        for npc_entity_id, thought, poignancy, ts, embedding in self.execute_query(
+            "SELECT npc_entity_id, thought, poignancy, ts, embedding FROM npc_thought ORDER BY rowid ASC;", ()
+        ):
+            thought_store.add(npc_entity_id, thought, embedding, poignancy, ts)
+        logger.info(f"Loaded {len(thought_store)} thoughts in the thought store")
+        self.thought_store = thought_store
 
-        res = self.execute_query(query, values)
+    def get_highest_scoring_thought(
+        self, query_embedding: Embedding, npc_entity_id: int, katana_ts: int
+    ) -> tuple[str, int, float, float]:
+        thoughts = self.get_highest_scoring_thoughts(query_embedding, [npc_entity_id], katana_ts)
 
-        if not res:
+        if npc_entity_id not in thoughts:
             raise RuntimeError(ErrorCodes.COSINE_SIMILARITY_NOT_FOUND.value)
 
-        return cast(Tuple[str, int, float, float], res[0])
+        return thoughts[npc_entity_id]
+
+    def get_highest_scoring_thoughts(
+        self, query_embedding: Embedding, npc_entity_ids: list[int], katana_ts: int
+    ) -> dict[int, tuple[str, int, float, float]]:
+        """Best thought of each npc in a single query, npcs without any thought are left out"""
+        query = fit_embedding(query_embedding, self.embedding_profile["dimensions"])
+        if self.thought_store is not None:
+            return self.thought_store.best_thoughts(query, npc_entity_ids, katana_ts)
+
+        res = self.execute_query(THOUGHT_SCORE_QUERY, (A_TIME, katana_ts, query, json.dumps(npc_entity_ids)))
+        return {row[0]: cast(Tuple[str, int, float, float], tuple(row[1:])) for row in res}
 
     def insert_discussion(self, discussion: StorableDiscussion) -> int:
         return self._insert(
@@ -152,21 +287,27 @@ class DiscussionDatabase(BaseDatabase):
         return -1
 
     def insert_npc_thought(
-        self, npc_entity_id: int, thought: str, poignancy: int, katana_ts: int, thought_embedding: list[float]
+        self, npc_entity_id: int, thought: str, poignancy: int, katana_ts: int, thought_embedding: Embedding
     ) -> int:
         if len(thought_embedding) == 0:
             raise RuntimeError(ErrorCodes.INSERTING_EMPTY_EMBEDDING)
+        embedding = fit_embedding(thought_embedding, self.embedding_profile["dimensions"])
 
-        added_row_id = self._insert(
-            "INSERT INTO npc_thought (npc_entity_id, thought, poignancy, ts) VALUES (?, ?, ?, ?);",
-            (npc_entity_id, thought, poignancy, katana_ts),
-        )
-        self._insert(
-            "INSERT INTO vss_npc_thought (rowid, embedding) VALUES (?, ?);",
-            (added_row_id, json.dumps(thought_embedding)),
-        )
+        with self.transaction():
+            added_row_id = self._insert(
+                "INSERT INTO npc_thought (npc_entity_id, thought, poignancy, ts, embedding) VALUES (?, ?, ?, ?, ?);",
+                (npc_entity_id, thought, poignancy, katana_ts, embedding),
+            )
+            if self.thought_store is not None:
+                thought_store = self.thought_store
+                self._on_commit(lambda: thought_store.add(npc_entity_id, thought, embedding, poignancy, katana_ts))
         return added_row_id
 
+    def count_npc_thoughts(self, npc_entity_id: int) -> int:
+        return cast(
+            int, self.execute_query("SELECT count(*) FROM npc_thought WHERE npc_entity_id = ?;", (npc_entity_id,))[0][0]
+        )
+
     def fetch_npc_thought_by_row_id(self, row_id: int) -> str:
         self.execute_query("SELECT thought FROM npc_thought WHERE rowid = ?;", (row_id,))
         return cast(str, self.execute_query("SELECT thought FROM npc_thought WHERE rowid = ?;", (row_id,))[0][0])
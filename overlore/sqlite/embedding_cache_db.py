@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import logging
+import time
+from sqlite3 import Connection
+from typing import cast
+
+from overlore.sqlite.base_db import DEFAULT_PRAGMA_PROFILE, BaseDatabase, Migration, PragmaProfile
+
+logger = logging.getLogger("overlore")
+
+# About 60MB of full size float32 embeddings
+MAX_CACHED_EMBEDDINGS = 10_000
+# Disk hits only write their last use back when the stored one is older than this
+TOUCH_INTERVAL_S = 60
+
+
+class EmbeddingCacheDatabase(BaseDatabase):
+    _instance: EmbeddingCacheDatabase | None = None
+
+    PRAGMAS: PragmaProfile = DEFAULT_PRAGMA_PROFILE
+    EXTENSIONS: list[str] = []
+    MIGRATIONS: list[Migration] = [
+        [
+            """
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    last_used INTEGER NOT NULL,
+                    PRIMARY KEY (model, dimensions, text_hash)
+                );
+            """,
+            """CREATE INDEX IF NOT EXISTS embedding_cache_last_used_idx ON embedding_cache (last_used);""",
+        ],
+    ]
+    max_entries: int
+    touch_interval_s: float
+
+    @classmethod
+    def instance(cls) -> EmbeddingCacheDatabase:
+        if cls._instance is None:
+            logger.debug("Creating embedding cache db interface")
+            cls._instance = cls.__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        raise RuntimeError("Call instance() instead")
+
+    def _preload(self, db: Connection) -> None:
+        pass
+
+    def init(
+        self,
+        path: str = "./databases/embedding_cache.db",
+        pragmas: PragmaProfile | None = None,
+        max_entries: int = MAX_CACHED_EMBEDDINGS,
+        touch_interval_s: float = TOUCH_INTERVAL_S,
+    ) -> EmbeddingCacheDatabase:
+        self._init(
+            path,
+            self.EXTENSIONS,
+            self.MIGRATIONS,
+            [],
+            self._preload,
+            pragmas if pragmas is not None else self.PRAGMAS,
+        )
+        self.max_entries = max_entries
+        self.touch_interval_s = touch_interval_s
+        return self
+
+    def fetch_embedding(self, model: str, dimensions: int, text_hash: str) -> bytes | None:
+        """Eviction only needs a rough order, hits of an embedding used less than touch_interval_s ago don't write"""
+        key = (model, dimensions, text_hash)
+        res = self.execute_query(
+            "SELECT embedding, last_used FROM embedding_cache WHERE model = ? AND dimensions = ? AND text_hash = ?;",
+            key,
+        )
+        if not res:
+            return None
+        (embedding, last_used) = res[0]
+        now = time.time_ns()
+        if now - last_used >= self.touch_interval_s * 1e9:
+            self._update(
+                "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash = ?;",
+                (now, *key),
+            )
+        return cast(bytes, embedding)
+
+    def insert_embedding(self, model: str, dimensions: int, text_hash: str, embedding: bytes) -> None:
+        """Stores the embedding then evicts the least recently used ones over max_entries"""
+        with self.transaction():
+            self._insert(
+                "INSERT INTO embedding_cache (model, dimensions, text_hash, embedding, last_used) VALUES (?, ?, ?, ?,"
+                " ?) ON CONFLICT(model, dimensions, text_hash) DO UPDATE SET embedding = excluded.embedding,"
+                " last_used = excluded.last_used;",
+                (model, dimensions, text_hash, embedding, time.time_ns()),
+            )
+            self._delete(
+                "DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY last_used DESC"
+                " LIMIT -1 OFFSET ?);",
+                (self.max_entries,),
+            )
+
+    def count_embeddings(self) -> int:
+        return cast(int, self.execute_query("SELECT count(*) FROM embedding_cache;", ())[0][0])
@@ -1,45 +1,117 @@
 from __future__ import annotations
 
+import json
 import logging
 from sqlite3 import Connection
 from typing import Any, cast
 
 from overlore.eternum.realms import Realms
 from overlore.eternum.types import RealmPosition
-from overlore.sqlite.base_db import A_DISTANCE, A_TIME, BaseDatabase, average, decay_function
-from overlore.sqlite.types import StoredEvent
+from overlore.sqlite.base_db import (
+    A_DISTANCE,
+    A_TIME,
+    DEFAULT_PRAGMA_PROFILE,
+    DISTANCE_WINDOW_M,
+    TIME_WINDOW_S,
+    BaseDatabase,
+    Migration,
+    PragmaProfile,
+    average_sql,
+    decay_sql,
+)
+from overlore.sqlite.hot_events import HotEvent, HotEventIndex
+from overlore.sqlite.types import LastSeenEvent, StoredEvent, SyncPosition
 from overlore.types import ParsedEvent
 
 logger = logging.getLogger("overlore")
 
 QUERY_RES_POS_INDEX_START = 9
 
+# Distance and recency decays averaged with the importance of the event, see decay_function and average
+RELEVANCE_SCORE = average_sql(
+    decay_sql("?", "10", "MIN(Distance(MakePoint(?, ?), active_pos), Distance(MakePoint(?, ?), passive_pos))"),
+    decay_sql("?", "10", "? - ts"),
+    "importance",
+)
+
+# Bound as a json array so the query text stays the same whatever the number of ignored events
+EXCLUSION_CLAUSE = "rowid NOT IN (SELECT value FROM json_each(?))"
+
+HOT_EVENT_COLUMNS = "rowid, ts, importance, X(active_pos), Y(active_pos), X(passive_pos), Y(passive_pos)"
+
+# Relies on the unique index on torii_event_id so that replaying an event is a single index lookup
+INSERT_EVENT_QUERY = (
+    "INSERT INTO events (torii_event_id, event_type, active_realm_entity_id, active_realm_id,"
+    " passive_realm_entity_id, passive_realm_id, importance, ts, type_specific_data, active_pos, passive_pos)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, MakePoint(?, ?), MakePoint(?, ?)) ON CONFLICT(torii_event_id) DO NOTHING;"
+)
+
 
 class EventsDatabase(BaseDatabase):
     _instance: EventsDatabase | None = None
     realms: Realms
+    hot_events: HotEventIndex
 
+    PRAGMAS: PragmaProfile = DEFAULT_PRAGMA_PROFILE
     EXTENSIONS = ["mod_spatialite"]
-    MIGRATIONS = [
-        # this needs to be executed first
-        """SELECT InitSpatialMetaData(1);""",
-        """
-            CREATE TABLE IF NOT EXISTS events (
-                event_type INTEGER NOT NULL,
-                torii_event_id TEXT,
-                active_realm_entity_id INTEGER NOT NULL,
-                active_realm_id INTEGER NOT NULL,
-                passive_realm_entity_id INTEGER NOT NULL,
-                passive_realm_id INTEGER NOT NULL,
-                importance FLOAT NOT NULL,
-                ts INTEGER NOT NULL,
-                type_specific_data TEXT
-            );
-        """,
-        # maker/attacker
-        """SELECT AddGeometryColumn('events', 'active_pos', 0, 'POINT', 'XY', 1);""",
-        # taker/target
-        """SELECT AddGeometryColumn('events', 'passive_pos', 0, 'POINT', 'XY', 1);""",
+    MIGRATIONS: list[Migration] = [
+        [
+            # this needs to be executed first
+            """SELECT InitSpatialMetaData(1);""",
+            """
+                CREATE TABLE IF NOT EXISTS events (
+                    event_type INTEGER NOT NULL,
+                    torii_event_id TEXT,
+                    active_realm_entity_id INTEGER NOT NULL,
+                    active_realm_id INTEGER NOT NULL,
+                    passive_realm_entity_id INTEGER NOT NULL,
+                    passive_realm_id INTEGER NOT NULL,
+                    importance FLOAT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    type_specific_data TEXT
+                );
+            """,
+            # maker/attacker
+            """SELECT AddGeometryColumn('events', 'active_pos', 0, 'POINT', 'XY', 1);""",
+            # taker/target
+            """SELECT AddGeometryColumn('events', 'passive_pos', 0, 'POINT', 'XY', 1);""",
+        ],
+        [
+            # keep the first copy of any event stored twice so the unique index can be built
+            """
+                DELETE FROM events WHERE torii_event_id IS NOT NULL AND rowid NOT IN (
+                    SELECT MIN(rowid) FROM events WHERE torii_event_id IS NOT NULL GROUP BY torii_event_id
+                );
+            """,
+            """CREATE UNIQUE INDEX IF NOT EXISTS events_torii_event_id_idx ON events (torii_event_id);""",
+            """CREATE INDEX IF NOT EXISTS events_ts_idx ON events (ts);""",
+        ],
+        [
+            """SELECT CreateSpatialIndex('events', 'active_pos');""",
+            """SELECT CreateSpatialIndex('events', 'passive_pos');""",
+            # walked in order to find the most important event, ties going to the oldest rowid
+            """CREATE INDEX IF NOT EXISTS events_importance_idx ON events (importance DESC);""",
+        ],
+        [
+            # high-water mark of the boot sync for each event key
+            """
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    event_key TEXT PRIMARY KEY,
+                    cursor TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+            """,
+        ],
+        [
+            # last event processed live for each event key, Torii gives no cursor for them
+            """
+                CREATE TABLE IF NOT EXISTS live_state (
+                    event_key TEXT PRIMARY KEY,
+                    torii_event_id TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+            """,
+        ],
     ]
 
     @classmethod
@@ -55,16 +127,18 @@ class EventsDatabase(BaseDatabase):
     def _preload(self, db: Connection) -> None:
         pass
 
-    def init(self, path: str = "./databases/events.db") -> EventsDatabase:
+    def init(self, path: str = "./databases/events.db", pragmas: PragmaProfile | None = None) -> EventsDatabase:
         # Call parent init function
         self._init(
             path,
             self.EXTENSIONS,
             self.MIGRATIONS,
-            [("decayFunction", 3, decay_function), ("average", -1, average)],
+            [],
             self._preload,
+            pragmas if pragmas is not None else self.PRAGMAS,
         )
         self.realms = Realms.instance().init()
+        self.hot_events = HotEventIndex()
         return self
 
     def format_records(self, records: list[Any]) -> list[StoredEvent]:
@@ -81,13 +155,37 @@ class EventsDatabase(BaseDatabase):
         )
 
     def insert_event(self, event: ParsedEvent) -> int:
-        query = (
-            "INSERT INTO events (torii_event_id, event_type, active_realm_entity_id, active_realm_id,"
-            " passive_realm_entity_id, passive_realm_id, importance, ts, type_specific_data, active_pos, passive_pos)"
-            " SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, MakePoint(?,?),MakePoint(?, ?) WHERE NOT EXISTS (SELECT 1 FROM events"
-            " WHERE torii_event_id=?);"
-        )
-        values: tuple[Any, ...] = (
+        added_id: int = self._insert(INSERT_EVENT_QUERY, self._event_values(event))
+
+        if added_id != 0:
+            logger.info(f"Stored event received at rowid {added_id}: {event}")
+            self.hot_events.refresh(self._load_hot_events_after)
+
+        return added_id
+
+    def insert_events(self, events: list[ParsedEvent], sync_positions: list[SyncPosition] | None = None) -> int:
+        """Stores a batch of events in a single transaction, returns the number of events actually added.
+        The sync positions reached by the batch, if any, are stored in the same transaction"""
+        with self.transaction():
+            added_count = self._insert_many(INSERT_EVENT_QUERY, [self._event_values(event) for event in events])
+            if sync_positions:
+                self._insert_many(
+                    "INSERT INTO sync_state (event_key, cursor, created_at) VALUES (?, ?, ?) ON CONFLICT(event_key) DO"
+                    " UPDATE SET cursor = excluded.cursor, created_at = excluded.created_at;",
+                    [
+                        (position["event_key"], position["cursor"], position["created_at"])
+                        for position in sync_positions
+                    ],
+                )
+
+        logger.info(f"Stored {added_count} new events out of {len(events)} received")
+        if added_count > 0:
+            self.hot_events.refresh(self._load_hot_events_after)
+
+        return added_count
+
+    def _event_values(self, event: ParsedEvent) -> tuple[Any, ...]:
+        return (
             event["torii_event_id"],
             event["event_type"],
             event["active_realm_entity_id"],
@@ -101,15 +199,33 @@ class EventsDatabase(BaseDatabase):
             event["active_pos"][1],
             event["passive_pos"][0],
             event["passive_pos"][1],
-            event["torii_event_id"],
         )
 
-        added_id: int = self._insert(query, values)
+    def fetch_sync_position(self, event_key: str) -> SyncPosition | None:
+        res = self.execute_query("SELECT cursor, created_at FROM sync_state WHERE event_key = ?;", (event_key,))
+        if not res:
+            return None
+        return SyncPosition(event_key=event_key, cursor=res[0][0], created_at=res[0][1])
 
-        if added_id != 0:
-            logger.info(f"Stored event received at rowid {added_id}: {event}")
+    def store_last_seen(self, event_key: str, last_seen: LastSeenEvent) -> None:
+        self._insert(
+            "INSERT INTO live_state (event_key, torii_event_id, created_at) VALUES (?, ?, ?) ON CONFLICT(event_key) DO"
+            " UPDATE SET torii_event_id = excluded.torii_event_id, created_at = excluded.created_at;",
+            (event_key, last_seen["torii_event_id"], last_seen["created_at"]),
+        )
 
-        return added_id
+    def fetch_last_seen(self) -> dict[str, LastSeenEvent]:
+        """Last event processed live of each event key, unless a backfill synced further since"""
+        res = self.execute_query(
+            "SELECT live_state.event_key, torii_event_id, live_state.created_at FROM live_state LEFT JOIN sync_state"
+            " ON sync_state.event_key = live_state.event_key"
+            " WHERE sync_state.created_at IS NULL OR live_state.created_at >= sync_state.created_at;",
+            (),
+        )
+        return {
+            event_key: LastSeenEvent(torii_event_id=torii_event_id, created_at=created_at)
+            for (event_key, torii_event_id, created_at) in res
+        }
 
     def get_by_ids(self, event_ids: list[int]) -> list[StoredEvent]:
         placeholders = ", ".join(["?" for _ in event_ids])
@@ -128,15 +244,58 @@ class EventsDatabase(BaseDatabase):
 
         return self.format_records(records=records)
 
+    def _load_hot_events(self, horizon: float) -> list[HotEvent]:
+        records = self.execute_query(
+            f"""SELECT {HOT_EVENT_COLUMNS} FROM events
+                WHERE ts >= ?
+                OR rowid = (SELECT MAX(rowid) FROM events)
+                OR rowid = (SELECT rowid FROM events WHERE ts < ? ORDER BY importance DESC, rowid ASC LIMIT 1)""",
+            (horizon, horizon),
+        )
+        return cast(list[HotEvent], records)
+
+    def _load_hot_events_after(self, rowid: int) -> list[HotEvent]:
+        records = self.execute_query(f"SELECT {HOT_EVENT_COLUMNS} FROM events WHERE rowid > ?", (rowid,))
+        return cast(list[HotEvent], records)
+
     def fetch_most_relevant_event(
         self, realm_position: RealmPosition, current_time: int, stored_event_row_ids: list[int]
     ) -> StoredEvent | None:
-        where_clauses = " AND ".join([f"rowid != {event_id}" for event_id in stored_event_row_ids])
-        where_clauses = "WHERE " + where_clauses if where_clauses != "" else ""
+        """Answers from the hot event index when it can, see HotEventIndex, from the events table otherwise"""
+        if not self.hot_events.warm:
+            self.hot_events.warm_up(current_time - TIME_WINDOW_S, self._load_hot_events)
 
+        rowid = self.hot_events.best(realm_position, current_time, set(stored_event_row_ids))
+        if rowid is not None:
+            return self.get_by_ids([rowid])[0]
+
+        return self.query_most_relevant_event(realm_position, current_time, stored_event_row_ids)
+
+    def query_most_relevant_event(
+        self, realm_position: RealmPosition, current_time: int, stored_event_row_ids: list[int]
+    ) -> StoredEvent | None:
         """Attributes an importance score depending on the distance in kilometers, the recency
-        and general importance score of an event, then gets the event that scored the highest"""
-        query = f"""SELECT
+        and general importance score of an event, then gets the event that scored the highest.
+
+        Only scores the events which are either recent or close to the realm, found through the ts and spatial indexes,
+        plus the most important remaining event. Every other event has both decays at 0 and scores its importance
+        over three, so it can never beat that last one. Ties go to the oldest rowid."""
+        spatial_candidates = """SELECT rowid FROM SpatialIndex
+                            WHERE f_table_name = 'events' AND f_geometry_column = '{column}'
+                            AND search_frame = BuildMbr(?, ?, ?, ?)"""
+
+        query = f"""WITH candidates AS (
+                        SELECT rowid FROM events WHERE ts >= ?
+                        UNION
+                        {spatial_candidates.format(column="active_pos")}
+                        UNION
+                        {spatial_candidates.format(column="passive_pos")}
+                        UNION
+                        SELECT rowid FROM (
+                            SELECT rowid FROM events WHERE {EXCLUSION_CLAUSE} ORDER BY importance DESC, rowid ASC LIMIT 1
+                        )
+                    )
+                    SELECT
                     rowid,
                     event_type,
                     active_realm_entity_id,
@@ -163,21 +322,23 @@ class EventsDatabase(BaseDatabase):
                             type_specific_data,
                             active_pos,
                             passive_pos,
-                            average(
-                                decayFunction(?, 10,
-                                    MIN(
-                                        Distance(MakePoint(?,?), active_pos),
-                                        Distance(MakePoint(?,?), passive_pos)
-                                    )
-                                ),
-                                decayFunction(?, 10, ? - ts),
-                                importance
-                            ) as score
+                            {RELEVANCE_SCORE} as score
                         FROM events
-                        {where_clauses}
+                        WHERE {EXCLUSION_CLAUSE} AND rowid IN candidates
                     )
-                    ORDER BY score DESC LIMIT 1"""
+                    ORDER BY score DESC, rowid ASC LIMIT 1"""
+        frame = (
+            realm_position[0] - DISTANCE_WINDOW_M,
+            realm_position[1] - DISTANCE_WINDOW_M,
+            realm_position[0] + DISTANCE_WINDOW_M,
+            realm_position[1] + DISTANCE_WINDOW_M,
+        )
+        exclusions = json.dumps(stored_event_row_ids)
         params = (
+            current_time - TIME_WINDOW_S,
+            *frame,
+            *frame,
+            exclusions,
             A_DISTANCE,
             realm_position[0],
             realm_position[1],
@@ -185,6 +346,7 @@ class EventsDatabase(BaseDatabase):
             realm_position[1],
             A_TIME,
             current_time,
+            exclusions,
         )
 
         records = self.execute_query(query=query, params=params)
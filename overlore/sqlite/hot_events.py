@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import heapq
+import threading
+from typing import Any, Callable
+
+from overlore.eternum.types import RealmPosition
+from overlore.sqlite.base_db import A_DISTANCE, A_TIME, TIME_WINDOW_S, average
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:  # numpy is optional, the events table answers every lookup without it
+    NUMPY_AVAILABLE = False
+
+# rowid, ts, importance, X(active_pos), Y(active_pos), X(passive_pos), Y(passive_pos)
+HotEvent = tuple[int, int, float, float, float, float, float]
+
+# Upper bound of both decays, see decay_function
+MAX_DECAY = 10.0
+
+# Rows allocated on warm up on top of the events loaded, then doubled whenever full
+INITIAL_CAPACITY = 1024
+
+COLUMNS = ("rowids", "ts", "importance", "active_x", "active_y", "passive_x", "passive_y")
+DTYPES = ("int64", "int64", "float64", "float64", "float64", "float64", "float64")
+
+
+class HotEventIndex:
+    """Columnar copy of the events of the last MAX_TIME_DAYS, scored in memory as numpy arrays.
+
+    Events older than the horizon are evicted, they have no time decay left and score at most
+    (MAX_DECAY + importance) / 3. The index only answers when its best event strictly beats that bound for the most
+    important event it ever evicted, so its answer is always the one of the SQL query. Otherwise, or without numpy,
+    it returns None and the caller falls back to SQL."""
+
+    rowids: Any
+    ts: Any
+    importance: Any
+    active_x: Any
+    active_y: Any
+    passive_x: Any
+    passive_y: Any
+    count: int
+    # (ts, rowid, importance) of every indexed event, the next one to evict first
+    expiries: list[tuple[int, int, float]]
+    horizon: float | None
+    max_evicted_importance: float
+    last_rowid: int
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self.count = 0
+        if NUMPY_AVAILABLE:
+            self._allocate(INITIAL_CAPACITY)
+        self.expiries = []
+        self.horizon = None
+        self.max_evicted_importance = 0.0
+        self.last_rowid = 0
+
+    def _allocate(self, capacity: int) -> None:
+        for name, dtype in zip(COLUMNS, DTYPES):
+            column = np.zeros(capacity, dtype=dtype)
+            if self.count > 0:
+                column[: self.count] = getattr(self, name)[: self.count]
+            setattr(self, name, column)
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def warm(self) -> bool:
+        return self.horizon is not None
+
+    def warm_up(self, horizon: float, load: Callable[[float], list[HotEvent]]) -> None:
+        """load must return every event from horizon on, the most important older one and the last one stored"""
+        if not NUMPY_AVAILABLE:
+            return
+        with self._lock:
+            self._clear()
+            self.horizon = horizon
+            self._append(load(horizon))
+
+    def refresh(self, load_after: Callable[[int], list[HotEvent]]) -> None:
+        """load_after must return every event stored after the given rowid"""
+        with self._lock:
+            if self.horizon is None:
+                return
+            self._append(load_after(self.last_rowid))
+
+    def _append(self, events: list[HotEvent]) -> None:
+        for event in events:
+            (rowid, ts, importance) = event[:3]
+            self.last_rowid = max(self.last_rowid, rowid)
+            if self.horizon is not None and ts < self.horizon:
+                self.max_evicted_importance = max(self.max_evicted_importance, importance)
+                continue
+            if self.count == len(self.rowids):
+                self._allocate(2 * len(self.rowids))
+            for name, value in zip(COLUMNS, event):
+                getattr(self, name)[self.count] = value
+            self.count += 1
+            heapq.heappush(self.expiries, (ts, rowid, importance))
+
+    def _evict(self, horizon: float) -> None:
+        self.horizon = horizon
+        if len(self.expiries) == 0 or self.expiries[0][0] >= horizon:
+            return
+        while len(self.expiries) > 0 and self.expiries[0][0] < horizon:
+            (_, _, importance) = heapq.heappop(self.expiries)
+            self.max_evicted_importance = max(self.max_evicted_importance, importance)
+        kept = np.flatnonzero(self.ts[: self.count] >= horizon)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            column[: len(kept)] = column[kept]
+        self.count = len(kept)
+
+    def best(self, realm_position: RealmPosition, current_time: int, ignored_rowids: set[int]) -> int | None:
+        """Rowid of the highest scoring event, ties going to the oldest rowid, None if the index can't tell"""
+        horizon = current_time - TIME_WINDOW_S
+        with self._lock:
+            # evicted events would still have some time decay left
+            if self.horizon is None or horizon < self.horizon:
+                return None
+            self._evict(horizon)
+            if self.count == 0:
+                return None
+
+            # same floating point operations in the same order as decay_function and average
+            (x, y) = realm_position
+            closest = np.minimum(
+                np.sqrt((x - self.active_x[: self.count]) ** 2 + (y - self.active_y[: self.count]) ** 2),
+                np.sqrt((x - self.passive_x[: self.count]) ** 2 + (y - self.passive_y[: self.count]) ** 2),
+            )
+            distance_decay = np.clip(A_DISTANCE * closest + 10, 0.0, 10.0)
+            time_decay = np.clip(A_TIME * (current_time - self.ts[: self.count]) + 10, 0.0, 10.0)
+            scores = (distance_decay + time_decay + self.importance[: self.count]) / 3.0
+
+            rowids = self.rowids[: self.count]
+            if ignored_rowids:
+                scores[np.isin(rowids, list(ignored_rowids))] = -1.0
+            best_score = float(scores.max())
+            if best_score <= average(MAX_DECAY, 0.0, self.max_evicted_importance):
+                return None
+            return int(rowids[scores == best_score].min())
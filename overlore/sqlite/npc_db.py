@@ -5,7 +5,7 @@ from sqlite3 import Connection
 from typing import cast
 
 from overlore.errors import ErrorCodes
-from overlore.sqlite.base_db import BaseDatabase
+from overlore.sqlite.base_db import DEFAULT_PRAGMA_PROFILE, BaseDatabase, Migration, PragmaProfile
 from overlore.sqlite.constants import Profile
 from overlore.types import Backstory, Characteristics, NpcProfile
 
@@ -15,27 +15,34 @@ logger = logging.getLogger("overlore")
 class NpcDatabase(BaseDatabase):
     _instance: NpcDatabase | None = None
 
+    PRAGMAS: PragmaProfile = DEFAULT_PRAGMA_PROFILE
     EXTENSIONS: list[str] = []
-    MIGRATIONS: list[str] = [
-        """
-            CREATE TABLE IF NOT EXISTS npc_profile (
-                realm_entity_id INTEGER NOT NULL,
-                full_name TEXT,
-                age INTEGER,
-                role INTEGER,
-                sex INTEGER,
-                character_trait TEXT,
-                backstory TEXT,
-                backstory_poignancy INT
-            );
-        """,
-        """
-            CREATE TABLE IF NOT EXISTS npc_backstory (
-                npc_entity_id INTEGER NOT NULL,
-                backstory TEXT,
-                poignancy INT
-            );
-        """,
+    MIGRATIONS: list[Migration] = [
+        [
+            """
+                CREATE TABLE IF NOT EXISTS npc_profile (
+                    realm_entity_id INTEGER NOT NULL,
+                    full_name TEXT,
+                    age INTEGER,
+                    role INTEGER,
+                    sex INTEGER,
+                    character_trait TEXT,
+                    backstory TEXT,
+                    backstory_poignancy INT
+                );
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS npc_backstory (
+                    npc_entity_id INTEGER NOT NULL,
+                    backstory TEXT,
+                    poignancy INT
+                );
+            """,
+        ],
+        [
+            """CREATE INDEX IF NOT EXISTS npc_profile_realm_entity_id_idx ON npc_profile (realm_entity_id);""",
+            """CREATE INDEX IF NOT EXISTS npc_backstory_npc_entity_id_idx ON npc_backstory (npc_entity_id);""",
+        ],
     ]
 
     @classmethod
@@ -51,13 +58,14 @@ class NpcDatabase(BaseDatabase):
     def _preload(self, db: Connection) -> None:
         pass
 
-    def init(self, path: str = "./databases/npc.db") -> NpcDatabase:
+    def init(self, path: str = "./databases/npc.db", pragmas: PragmaProfile | None = None) -> NpcDatabase:
         self._init(
             path,
             self.EXTENSIONS,
             self.MIGRATIONS,
             [],
             self._preload,
+            pragmas if pragmas is not None else self.PRAGMAS,
         )
         return self
 
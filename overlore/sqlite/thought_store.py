@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging
+import math
+import threading
+from typing import Any
+
+from overlore.errors import ErrorCodes
+from overlore.sqlite.base_db import A_TIME
+from overlore.types import Embedding
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:  # numpy is optional, the thought store is disabled without it
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger("overlore")
+
+# Rows allocated for an npc on its first thought, then doubled whenever full
+INITIAL_CAPACITY = 16
+# Npcs with fewer thoughts are scored exactly, more go through their inverted lists
+ANN_MIN_THOUGHTS = 1024
+# Inverted lists searched for a query, out of about sqrt(thoughts) per npc
+ANN_PROBES = 16
+# Most similar thoughts of the lists searched, re-ranked by the poignancy and recency blend
+ANN_CANDIDATES = 64
+# k-means training of the inverted lists
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+
+
+class NpcThoughts:
+    """Thoughts of a single npc as contiguous arrays, only the first count rows are in use"""
+
+    def __init__(self, dimensions: int) -> None:
+        self.count = 0
+        self.thoughts: list[str] = []
+        self.embeddings = np.zeros((INITIAL_CAPACITY, dimensions), dtype=np.float32)
+        self.norms = np.zeros(INITIAL_CAPACITY, dtype=np.float32)
+        self.poignancy = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self.ts = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+
+        self.inverted_lists: InvertedLists | None = None
+        self.trained_count = 0
+
+    def append(self, thought: str, embedding: Any, poignancy: int, ts: int) -> None:
+        if self.count == len(self.ts):
+            self._grow()
+        self.thoughts.append(thought)
+        self.embeddings[self.count] = embedding
+        self.norms[self.count] = np.linalg.norm(embedding)
+        self.poignancy[self.count] = poignancy
+        self.ts[self.count] = ts
+        self.count += 1
+
+        # retraining once the thoughts doubled keeps the lists balanced for an amortized constant cost
+        if self.count >= max(ANN_MIN_THOUGHTS, 2 * self.trained_count):
+            self.inverted_lists = InvertedLists(self.unit_embeddings(slice(0, self.count)))
+            self.trained_count = self.count
+        elif self.inverted_lists is not None:
+            self.inverted_lists.add(self.count - 1, self.unit_embeddings(slice(self.count - 1, self.count))[0])
+
+    def unit_embeddings(self, rows: Any) -> Any:
+        norms = self.norms[rows]
+        return np.divide(
+            self.embeddings[rows], norms[:, None], out=np.zeros_like(self.embeddings[rows]), where=norms[:, None] != 0
+        )
+
+    def _grow(self) -> None:
+        self.embeddings = grow(self.embeddings)
+        self.norms = grow(self.norms)
+        self.poignancy = grow(self.poignancy)
+        self.ts = grow(self.ts)
+
+    def best(self, query: Any, query_norm: float, katana_ts: int) -> tuple[str, int, float, float]:
+        """Same blend as DiscussionDatabase.get_highest_scoring_thoughts, scored as one matrix-vector product.
+        Npcs with inverted lists only score the ANN_CANDIDATES most similar thoughts of the lists closest to the
+        query, the work grows with the square root of their thoughts instead of their number"""
+        rows = np.arange(self.count)
+        if self.inverted_lists is not None and query_norm != 0:
+            probed = self.inverted_lists.search(query / query_norm, ANN_PROBES)
+            rows = probed if len(probed) > 0 else rows
+        norms = self.norms[rows] * query_norm
+        dot_products = self.embeddings[rows] @ query
+        cos_similarity = np.divide(dot_products, norms, out=np.zeros_like(dot_products), where=norms != 0) * 10.0
+        if self.inverted_lists is not None and len(rows) > ANN_CANDIDATES:
+            candidates = np.argpartition(cos_similarity, -ANN_CANDIDATES)[-ANN_CANDIDATES:]
+            (rows, cos_similarity) = (rows[candidates], cos_similarity[candidates])
+        decay = np.clip(A_TIME * (katana_ts - self.ts[rows]) + 10, 0.0, 10.0)
+        scores = (cos_similarity + self.poignancy[rows] + decay) / 3
+        best = int(np.argmax(scores))
+        i = int(rows[best])
+        return (self.thoughts[i], int(self.ts[i]), float(cos_similarity[best]), float(scores[best]))
+
+
+class InvertedLists:
+    """Splits the unit embeddings of a npc around about sqrt(count) k-means centroids, like a faiss IVF index"""
+
+    def __init__(self, unit_embeddings: Any) -> None:
+        self.centroids = kmeans(unit_embeddings, max(1, math.isqrt(len(unit_embeddings))))
+        assignments = np.argmax(unit_embeddings @ self.centroids.T, axis=1)
+        self.lists: list[list[int]] = [[] for _ in range(len(self.centroids))]
+        for row, centroid in enumerate(assignments):
+            self.lists[centroid].append(row)
+
+    def add(self, row: int, unit_embedding: Any) -> None:
+        self.lists[int(np.argmax(self.centroids @ unit_embedding))].append(row)
+
+    def search(self, unit_query: Any, probes: int) -> Any:
+        """Rows of the lists whose centroids are the closest to the query"""
+        similarities = self.centroids @ unit_query
+        closest = np.argsort(-similarities)[:probes]
+        return np.concatenate([np.asarray(self.lists[centroid], dtype=np.int64) for centroid in closest])
+
+
+class ThoughtStore:
+    """In-process copy of npc_thought, keyed by npc entity id"""
+
+    def __init__(self) -> None:
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError(ErrorCodes.NUMPY_UNAVAILABLE)
+        self._lock = threading.Lock()
+        self._npcs: dict[int, NpcThoughts] = {}
+
+    def __len__(self) -> int:
+        return sum(npc.count for npc in self._npcs.values())
+
+    def add(self, npc_entity_id: int, thought: str, embedding: Embedding, poignancy: int, ts: int) -> None:
+        vector = to_vector(embedding)
+        with self._lock:
+            if npc_entity_id not in self._npcs:
+                self._npcs[npc_entity_id] = NpcThoughts(len(vector))
+            self._npcs[npc_entity_id].append(thought, vector, poignancy, ts)
+
+    def best_thoughts(
+        self, query_embedding: Embedding, npc_entity_ids: list[int], katana_ts: int
+    ) -> dict[int, tuple[str, int, float, float]]:
+        query = to_vector(query_embedding)
+        query_norm = float(np.linalg.norm(query))
+        with self._lock:
+            return {
+                npc_entity_id: self._npcs[npc_entity_id].best(query, query_norm, katana_ts)
+                for npc_entity_id in npc_entity_ids
+                if npc_entity_id in self._npcs
+            }
+
+
+def to_vector(embedding: Embedding) -> Any:
+    if isinstance(embedding, bytes):
+        return np.frombuffer(embedding, dtype="<f4")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def kmeans(unit_embeddings: Any, clusters: int) -> Any:
+    """Spherical k-means on a sample of the embeddings, seeded so a restart rebuilds the same lists"""
+    rng = np.random.default_rng(0)
+    sample_size = min(len(unit_embeddings), KMEANS_SAMPLES_PER_LIST * clusters)
+    sample = unit_embeddings[rng.choice(len(unit_embeddings), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, clusters, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.eye(clusters, dtype=sample.dtype)[assignments].T @ sample
+        norms = np.linalg.norm(sums, axis=1)
+        # empty clusters keep their centroid
+        filled = norms != 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids
+
+
+def grow(array: Any) -> Any:
+    grown = np.zeros((2 * array.shape[0], *array.shape[1:]), dtype=array.dtype)
+    grown[: array.shape[0]] = array
+    return grown
@@ -23,6 +23,20 @@ from overlore.types import DialogueSegment, Discussion, NpcEntity
 StoredEvent: TypeAlias = list[int | str | RealmPosition]
 
 
+class SyncPosition(TypedDict):
+    # key of the synced events, see EventType
+    event_key: str
+    # Torii cursor of the last synced event
+    cursor: str
+    created_at: str
+
+
+class LastSeenEvent(TypedDict):
+    # Torii id of the last event processed live, Torii cursors can't be built from it
+    torii_event_id: str
+    created_at: str
+
+
 class StoredSegment(TypedDict):
     npc_entity_id: int
     segment: str
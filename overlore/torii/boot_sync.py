@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, cast
+
+from overlore.sqlite.events_db import EventsDatabase
+from overlore.sqlite.types import LastSeenEvent, SyncPosition
+from overlore.torii.client import ToriiClient
+from overlore.torii.constants import EventType
+from overlore.torii.parsing import parse_event
+from overlore.types import ParsedEvent, ToriiEmittedEvent, ToriiEventEdge
+
+logger = logging.getLogger("overlore")
+
+# Event types stored in the events table
+SYNCED_EVENT_TYPES = [EventType.ORDER_ACCEPTED, EventType.COMBAT_OUTCOME]
+# Spawned npcs are handed to a callback instead
+BACKFILLED_EVENT_TYPES = [*SYNCED_EVENT_TYPES, EventType.NPC_SPAWNED]
+# Pages waiting in front of the parser, then of the writer, before their producer is paused
+PAGES_BUFFERED = 4
+# Events written in a single transaction, pages already parsed are joined up to this size
+WRITE_BATCH_SIZE = 2000
+PROGRESS_INTERVAL_S = 5.0
+
+FetchedPage = tuple[EventType, list[ToriiEventEdge]]
+# events to store, npc spawns to hand to the spawn callback and the position reached
+ParsedPage = tuple[list[ParsedEvent], list[ToriiEmittedEvent], SyncPosition]
+SpawnCallback = Callable[[ToriiEmittedEvent], Awaitable[Any]]
+
+
+class BootSync:
+    """Backfills the events Torii stored since the last sync.
+
+    One fetcher per event type pages through Torii, a parser turns the pages into events and a writer stores them in
+    batches from a worker thread, so the event loop stays free for the subscriptions. The stages are connected by
+    bounded queues: a slow writer pauses the parser, which pauses the fetchers. Every stage keeps the order of the
+    pages so the sync position stored with a batch is always the last one reached.
+
+    Event types with a last event seen live in since are caught up from that event instead of their sync position.
+    Npc spawns are handed to on_spawn, which has to skip the npcs it already stored."""
+
+    def __init__(
+        self,
+        torii_client: ToriiClient,
+        event_types: list[EventType] = SYNCED_EVENT_TYPES,
+        since: dict[str, LastSeenEvent] | None = None,
+        on_spawn: SpawnCallback | None = None,
+    ) -> None:
+        self.torii_client = torii_client
+        self.events_db = EventsDatabase.instance()
+        if on_spawn is None and EventType.NPC_SPAWNED in event_types:
+            logger.warning("No spawn callback, spawned npcs won't be backfilled")
+            event_types = [event_type for event_type in event_types if event_type != EventType.NPC_SPAWNED]
+        self.event_types = event_types
+        self.since = since if since is not None else {}
+        self.on_spawn = on_spawn
+        self.synced_count = 0
+        self.added_count = 0
+
+    async def run(self) -> int:
+        """Returns the number of events added"""
+        self.pages: asyncio.Queue[FetchedPage | None] = asyncio.Queue(maxsize=PAGES_BUFFERED)
+        self.parsed_pages: asyncio.Queue[ParsedPage | None] = asyncio.Queue(maxsize=PAGES_BUFFERED)
+        self.started_at = self.last_report_at = time.monotonic()
+
+        tasks = [
+            *[asyncio.create_task(self.fetch(event_type)) for event_type in self.event_types],
+            asyncio.create_task(self.parse()),
+            asyncio.create_task(self.write()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        logger.info(
+            f"Boot sync done: {self.added_count} new events out of {self.synced_count} synced in"
+            f" {time.monotonic() - self.started_at:.1f}s"
+        )
+        return self.added_count
+
+    async def fetch(self, event_type: EventType) -> None:
+        last_seen = self.since.get(event_type.value)
+        if last_seen is not None:
+            await self.catch_up(event_type, last_seen)
+            await self.pages.put(None)
+            return
+
+        sync_position = self.events_db.fetch_sync_position(event_type.value)
+        cursor = sync_position["cursor"] if sync_position is not None else None
+
+        has_next_page = True
+        while has_next_page:
+            (edges, has_next_page) = await self.torii_client.get_events_page(event_type, cursor)
+            if len(edges) == 0:
+                break
+            await self.pages.put((event_type, edges))
+            cursor = edges[-1]["cursor"]
+
+        await self.pages.put(None)
+
+    async def catch_up(self, event_type: EventType, last_seen: LastSeenEvent) -> None:
+        """Pages back from the newest event to the last one seen live, then queues the events missed since oldest
+        first. Torii cursors can't be built from a live event, this saves paging forward from an older sync position"""
+        missed_pages: list[list[ToriiEventEdge]] = []
+        cursor = None
+        has_previous_page = True
+        while has_previous_page:
+            (edges, has_previous_page) = await self.torii_client.get_previous_events_page(event_type, cursor)
+            if len(edges) == 0:
+                break
+            missed = [edge for edge in edges if not seen_before(edge, last_seen)]
+            # the newest event moves the sync position forward even when nothing was missed
+            missed_pages.append(missed if missed or missed_pages else edges[-1:])
+            if len(missed) < len(edges):
+                break
+            cursor = edges[0]["cursor"]
+
+        for edges in reversed(missed_pages):
+            if edges:
+                await self.pages.put((event_type, edges))
+
+    async def parse(self) -> None:
+        fetchers_running = len(self.event_types)
+        while fetchers_running > 0:
+            page = await self.pages.get()
+            if page is None:
+                fetchers_running -= 1
+                continue
+
+            (event_type, edges) = page
+            sync_position = SyncPosition(
+                event_key=event_type.value, cursor=edges[-1]["cursor"], created_at=edges[-1]["node"]["createdAt"]
+            )
+            if event_type == EventType.NPC_SPAWNED:
+                await self.parsed_pages.put(
+                    ([], [ToriiEmittedEvent(eventEmitted=edge["node"]) for edge in edges], sync_position)
+                )
+            else:
+                await self.parsed_pages.put(([parse_event(event=edge["node"]) for edge in edges], [], sync_position))
+
+        await self.parsed_pages.put(None)
+
+    async def write(self) -> None:
+        done = False
+        while not done:
+            parsed_page = await self.parsed_pages.get()
+            if parsed_page is None:
+                break
+
+            (events, spawns, sync_position) = parsed_page
+            (events, spawns) = (list(events), list(spawns))
+            sync_positions = {sync_position["event_key"]: sync_position}
+            # join the pages parsed while the previous batch was written
+            while len(events) + len(spawns) < WRITE_BATCH_SIZE and not self.parsed_pages.empty():
+                parsed_page = self.parsed_pages.get_nowait()
+                if parsed_page is None:
+                    done = True
+                    break
+                events.extend(parsed_page[0])
+                spawns.extend(parsed_page[1])
+                sync_positions[parsed_page[2]["event_key"]] = parsed_page[2]
+
+            # spawns are handled before their sync position is stored, a failed sync hands them again next time
+            for spawn in spawns:
+                self.added_count += await self.spawn(spawn)
+            self.added_count += await asyncio.to_thread(
+                self.events_db.insert_events, events, list(sync_positions.values())
+            )
+            self.synced_count += len(events) + len(spawns)
+            self.report_progress()
+
+    async def spawn(self, event: ToriiEmittedEvent) -> int:
+        if self.on_spawn is None:
+            return 0
+        # a failed spawn is handed again by a later backfill, it must not stop the events one
+        try:
+            return 1 if await self.on_spawn(event) else 0
+        except Exception:
+            logger.exception("Unable to process spawn event %s", event)
+            return 0
+
+    def report_progress(self) -> None:
+        now = time.monotonic()
+        if now - self.last_report_at < PROGRESS_INTERVAL_S:
+            return
+        self.last_report_at = now
+        logger.info(
+            f"Boot sync: {self.synced_count} events synced at {self.synced_count / (now - self.started_at):.0f}"
+            f" events/s, {self.pages.qsize() + self.parsed_pages.qsize()} pages behind"
+        )
+
+
+def seen_before(edge: ToriiEventEdge, last_seen: LastSeenEvent) -> bool:
+    """Events created in the same second as the last one seen are kept, storing them again is a no-op"""
+    node = edge["node"]
+    return cast(str, node.get("id")) == last_seen["torii_event_id"] or node["createdAt"] < last_seen["created_at"]
@@ -1,76 +1,118 @@
+import asyncio
 import json
 import logging
-from typing import Any, cast
+from typing import Any, ClassVar, cast
 
 import aiohttp
 from starknet_py.cairo.felt import decode_shortstring
 
 from overlore.errors import ErrorCodes
+from overlore.http_sessions import HttpSessions
 from overlore.sqlite.events_db import EventsDatabase
-from overlore.torii.parsing import parse_event
+from overlore.torii.constants import EventType
 from overlore.torii.query import Queries
-from overlore.types import NpcEntity, ToriiDataNode
+from overlore.types import NpcEntity, ToriiEventEdge
 from overlore.utils import unpack_characteristics
 
 logger = logging.getLogger("overlore")
 
+# Events requested per page of the boot sync
+SYNC_PAGE_SIZE = 500
+
 
 class ToriiClient:
+    # origin realm id by npc entity id, shared by every client
+    origin_realm_ids: ClassVar[dict[int, int]] = {}
+
     def __init__(self, url: str) -> None:
         self.events_db = EventsDatabase.instance()
         self.url = url
 
-    async def boot_sync(self) -> None:
-        self.store_synced_events(
-            events=await self.get_synced_events(query=Queries.ORDER_ACCEPTED_EVENT_QUERY.value),
+    async def get_events_page(self, event_type: EventType, cursor: str | None) -> tuple[list[ToriiEventEdge], bool]:
+        """Up to SYNC_PAGE_SIZE events stored by Torii after the cursor, and whether more follow them"""
+        query_results = await self.run_torii_query(
+            query=Queries.EVENTS.value.format(
+                event_hash=event_type.value,
+                window=f"first: {SYNC_PAGE_SIZE}" + (f', after: "{cursor}"' if cursor is not None else ""),
+            ),
         )
-        self.store_synced_events(
-            events=await self.get_synced_events(query=Queries.COMBAT_OUTCOME_EVENT_QUERY.value),
+        return (
+            cast(list[ToriiEventEdge], query_results["events"]["edges"]),
+            bool(query_results["events"]["pageInfo"]["hasNextPage"]),
         )
 
-    def store_synced_events(self, events: list[ToriiDataNode]) -> None:
-        for event in events:
-            parsed_event = parse_event(event=event)
-            self.events_db.insert_event(event=parsed_event)
-
-    async def get_synced_events(self, query: str) -> list[ToriiDataNode]:
-        query_results = await self.run_torii_query(query=query)
-        events = [query_result["node"] for query_result in query_results["events"]["edges"]]
-        return events
+    async def get_previous_events_page(
+        self, event_type: EventType, cursor: str | None
+    ) -> tuple[list[ToriiEventEdge], bool]:
+        """Up to SYNC_PAGE_SIZE events stored by Torii before the cursor, the newest ones without cursor, and whether
+        more precede them. Edges keep their ascending order"""
+        query_results = await self.run_torii_query(
+            query=Queries.EVENTS.value.format(
+                event_hash=event_type.value,
+                window=f"last: {SYNC_PAGE_SIZE}" + (f', before: "{cursor}"' if cursor is not None else ""),
+            ),
+        )
+        return (
+            cast(list[ToriiEventEdge], query_results["events"]["edges"]),
+            bool(query_results["events"]["pageInfo"]["hasPreviousPage"]),
+        )
 
     async def get_npcs_by_realm_entity_id(self, realm_entity_id: int) -> list[NpcEntity]:
         query_results = await self.run_torii_query(
             query=Queries.NPC_BY_CURRENT_REALM_ENTITY_ID.value.format(realm_entity_id=realm_entity_id),
         )
+        nodes = [query_result["node"] for query_result in query_results["npcModels"]["edges"]]
+        origin_realm_ids = await self.get_realm_ids_from_npc_entity_ids(
+            [int(node["entity_id"], base=16) for node in nodes]
+        )
         npcs = [
             NpcEntity(
-                character_trait=decode_shortstring(int(query_result["node"]["character_trait"], base=16)),
-                full_name=decode_shortstring(int(query_result["node"]["full_name"], base=16)),
-                characteristics=unpack_characteristics(int(query_result["node"]["characteristics"], base=16)),
-                entity_id=int(query_result["node"]["entity_id"], base=16),
-                current_realm_entity_id=int(query_result["node"]["current_realm_entity_id"], base=16),
-                origin_realm_id=await self.get_realm_id_from_npc_entity_id(
-                    int(query_result["node"]["entity_id"], base=16),
-                ),
+                character_trait=decode_shortstring(int(node["character_trait"], base=16)),
+                full_name=decode_shortstring(int(node["full_name"], base=16)),
+                characteristics=unpack_characteristics(int(node["characteristics"], base=16)),
+                entity_id=int(node["entity_id"], base=16),
+                current_realm_entity_id=int(node["current_realm_entity_id"], base=16),
+                origin_realm_id=origin_realm_ids[int(node["entity_id"], base=16)],
             )
-            for query_result in query_results["npcModels"]["edges"]
+            for node in nodes
         ]
         return npcs
 
     async def get_realm_id_from_npc_entity_id(self, npc_entity_id: int) -> int:
-        query_result = await self.run_torii_query(
-            query=Queries.REALM_ENTITY_ID_BY_NPC_ENTITY_ID.value.format(
-                npc_entity_id=npc_entity_id,
-            ),
-        )
+        return (await self.get_realm_ids_from_npc_entity_ids([npc_entity_id]))[npc_entity_id]
+
+    async def get_realm_ids_from_npc_entity_ids(self, npc_entity_ids: list[int]) -> dict[int, int]:
+        """Resolves the origin realm of every npc with two aliased queries, whatever their number.
+        An npc never changes origin realm so the results are kept for the lifetime of the process"""
+        missing = [npc_entity_id for npc_entity_id in set(npc_entity_ids) if npc_entity_id not in self.origin_realm_ids]
+        if missing:
+            query_result = await self.run_torii_query(
+                query=Queries.BATCH.value.format(
+                    fields="".join(
+                        Queries.REALM_ENTITY_ID_BY_NPC_ENTITY_ID_FIELD.value.format(npc_entity_id=npc_entity_id)
+                        for npc_entity_id in missing
+                    )
+                ),
+            )
+            entity_owner_ids = {
+                npc_entity_id: int(query_result[f"npc_{npc_entity_id}"]["edges"][0]["node"]["entity_owner_id"], base=16)
+                for npc_entity_id in missing
+            }
+
+            query_result = await self.run_torii_query(
+                query=Queries.BATCH.value.format(
+                    fields="".join(
+                        Queries.REALM_ID_BY_REALM_ENTITY_ID_FIELD.value.format(realm_entity_id=realm_entity_id)
+                        for realm_entity_id in set(entity_owner_ids.values())
+                    )
+                ),
+            )
+            for npc_entity_id, entity_owner_id in entity_owner_ids.items():
+                self.origin_realm_ids[npc_entity_id] = int(
+                    query_result[f"realm_{entity_owner_id}"]["edges"][0]["node"]["realm_id"], base=16
+                )
 
-        entity_owner_id = int(query_result["entityOwnerModels"]["edges"][0]["node"]["entity_owner_id"], base=16)
-        query_result = await self.run_torii_query(
-            query=Queries.REALM_ID_BY_REALM_ENTITY_ID.value.format(
-                realm_entity_id=entity_owner_id,
-            ),
-        )
-        return int(query_result["realmModels"]["edges"][0]["node"]["realm_id"], base=16)
+        return {npc_entity_id: self.origin_realm_ids[npc_entity_id] for npc_entity_id in npc_entity_ids}
 
     async def get_realm_owner_wallet_address(self, realm_entity_id: int) -> str:
         data = await self.run_torii_query(Queries.OWNER.value.format(entity_id=realm_entity_id))
@@ -84,18 +126,16 @@ class ToriiClient:
 
     async def run_torii_query(self, query: str) -> Any:
         try:
-            headers = {"Content-Type": "application/json"}
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url=self.url, headers=headers, data=json.dumps({"query": query}), timeout=1000
-                ) as response:
-                    json_response = cast(dict[str, Any], await response.json())
+            async with HttpSessions.instance().session(self.url).post(
+                url=self.url, data=json.dumps({"query": query})
+            ) as response:
+                json_response = cast(dict[str, Any], await response.json())
             data = json_response["data"]
             if data is None:
                 raise RuntimeError(ErrorCodes.NO_DATA_AVAILABLE)
         except KeyError as e:
             logger.exception("KeyError accessing %s in JSON response: %s", e, response)
-        except aiohttp.ClientConnectorError as err:
+        except (aiohttp.ClientConnectorError, asyncio.TimeoutError) as err:
             raise RuntimeError(ErrorCodes.TORII_UNAVAILABLE) from err
         else:
             return data
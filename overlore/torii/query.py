@@ -1,16 +1,20 @@
 import logging
 from enum import Enum
 
-from overlore.torii.constants import EventType
-
 logger = logging.getLogger("overlore")
 
 
 class Queries(Enum):
+    # window is either 'first: <n>, after: "<cursor>"' or 'last: <n>, before: "<cursor>"', without cursor at the edges
     EVENTS = """
     query events {{
-        events(keys:["{event_hash}"]) {{
+        events(keys:["{event_hash}"], {window}) {{
+            pageInfo {{
+                hasNextPage
+                hasPreviousPage
+            }}
             edges {{
+                cursor
                 node {{
                     id
                     keys
@@ -51,29 +55,29 @@ class Queries(Enum):
         }}
     """
 
-    REALM_ENTITY_ID_BY_NPC_ENTITY_ID = """
-        query {{
-            entityOwnerModels (where: {{entity_id: "{npc_entity_id}"}}) {{
-                    edges {{
-                        node {{
-                            entity_owner_id
-                        }}
+    # Aliased fields of a single query, one per entity, see BATCH
+    REALM_ENTITY_ID_BY_NPC_ENTITY_ID_FIELD = """
+            npc_{npc_entity_id}: entityOwnerModels (where: {{entity_id: "{npc_entity_id}"}}) {{
+                edges {{
+                    node {{
+                        entity_owner_id
+                    }}
                 }}
             }}
-        }}
     """
 
-    REALM_ID_BY_REALM_ENTITY_ID = """
-        query {{
-            realmModels (where: {{entity_id: "{realm_entity_id}"}}) {{
+    REALM_ID_BY_REALM_ENTITY_ID_FIELD = """
+            realm_{realm_entity_id}: realmModels (where: {{entity_id: "{realm_entity_id}"}}) {{
                 edges {{
                     node {{
                         realm_id
                     }}
                 }}
             }}
-        }}
     """
 
-    ORDER_ACCEPTED_EVENT_QUERY = EVENTS.format(event_hash=EventType.ORDER_ACCEPTED.value)
-    COMBAT_OUTCOME_EVENT_QUERY = EVENTS.format(event_hash=EventType.COMBAT_OUTCOME.value)
+    BATCH = """
+        query {{
+            {fields}
+        }}
+    """
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Coroutine, cast
+
+from overlore.sqlite.types import LastSeenEvent
+from overlore.torii.boot_sync import BACKFILLED_EVENT_TYPES
+from overlore.torii.constants import EventType
+from overlore.torii.parsing import get_event_type
+from overlore.types import ToriiEmittedEvent
+
+logger = logging.getLogger("overlore")
+
+EventCallback = Callable[[ToriiEmittedEvent], Coroutine[Any, Any, Any]]
+# Backfills the event types, from the last event seen live of each event key given, from their sync cursor otherwise
+Backfill = Callable[[list[EventType], dict[str, LastSeenEvent]], Awaitable[int]]
+# Persists the last event processed live of an event key
+StoreLastSeen = Callable[[str, LastSeenEvent], Any]
+
+
+class Reconciler:
+    """Makes sure no event is lost between the backfill and the live subscriptions.
+
+    reconcile() has to run every time a stream is (re)established with the event types it receives: it backfills
+    the events emitted before the stream started or while it was disconnected, from the last event of each type seen
+    live or from their last synced cursor before any was. Live events of those types received meanwhile are
+    buffered, then processed once the backfill is stored so they are always stored after the events they follow.
+    Streams must receive disjoint event types.
+
+    The last event of each type seen live is handed to store_last_seen, so that after a restart the first backfill
+    catches up from it given back in last_seen instead of paging again through the events received live."""
+
+    def __init__(
+        self,
+        backfill: Backfill,
+        last_seen: dict[str, LastSeenEvent] | None = None,
+        store_last_seen: StoreLastSeen | None = None,
+    ) -> None:
+        self.backfill = backfill
+        self.store_last_seen = store_last_seen
+        # keys of the event types being backfilled, their live events are buffered
+        self.backfilling: set[str] = set()
+        self.buffered: dict[str, deque[tuple[ToriiEmittedEvent, EventCallback]]] = {}
+        # last live event processed by event key
+        self.last_seen: dict[str, LastSeenEvent] = dict(last_seen) if last_seen is not None else {}
+        self._lock = asyncio.Lock()
+
+    async def reconcile(self, event_types: list[EventType] = BACKFILLED_EVENT_TYPES) -> int:
+        """Returns the number of events added by the backfill"""
+        event_keys = {event_type.value for event_type in event_types}
+        since = {event_key: self.last_seen[event_key] for event_key in event_keys if event_key in self.last_seen}
+
+        for event_type in event_types:
+            last_seen = self.last_seen.get(event_type.value)
+            if last_seen is None:
+                logger.info(f"Backfilling {event_type.name} events before processing live ones")
+            else:
+                logger.info(f"Backfilling the {event_type.name} events emitted since {last_seen['created_at']}")
+
+        # a failed backfill keeps buffering until the next reconciliation
+        self.backfilling |= event_keys
+        # backfills of different streams write the same tables, one at a time
+        async with self._lock:
+            added_count = await self.backfill(event_types, since)
+        # events received while the buffer is flushed join it, so they keep their order
+        for event_key in event_keys:
+            buffered = self.buffered.get(event_key)
+            while buffered:
+                await self.process(*buffered.popleft())
+            self.backfilling.discard(event_key)
+
+        logger.info(f"Backfill added {added_count} missed events")
+        return added_count
+
+    async def on_event(self, event: ToriiEmittedEvent, callback: EventCallback) -> None:
+        key = event_key(event)
+        if key in self.backfilling:
+            self.buffered.setdefault(key, deque()).append((event, callback))
+            return
+        await self.process(event, callback)
+
+    async def process(self, event: ToriiEmittedEvent, callback: EventCallback) -> None:
+        # a failed event must not stop the ones buffered after it
+        try:
+            await callback(event)
+        except Exception:
+            logger.exception("Unable to process event %s", event)
+        key = event_key(event)
+        self.last_seen[key] = LastSeenEvent(
+            torii_event_id=cast(str, event["eventEmitted"].get("id")), created_at=event["eventEmitted"]["createdAt"]
+        )
+        if self.store_last_seen is not None:
+            self.store_last_seen(key, self.last_seen[key])
+
+
+def event_key(event: ToriiEmittedEvent) -> str:
+    return get_event_type(keys=event["eventEmitted"]["keys"])
@@ -1,30 +1,59 @@
 import asyncio
 import logging
-import sys
+import time
 from enum import Enum
-from typing import Any, Callable, Coroutine, cast
+from functools import partial
+from typing import Any, Callable, Coroutine, Generator, TypedDict, cast
 
 import backoff
-from backoff._typing import Details
 from gql import Client, gql
 from gql.transport.websockets import WebsocketsTransport
 
 from overlore.config import BootConfig
 from overlore.errors import ErrorCodes
 from overlore.katana.client import KatanaClient
-from overlore.llm.client import AsyncOpenAiClient
+from overlore.llm.client import LlmClient
 from overlore.llm.constants import EmbeddingsModel
 from overlore.sqlite.discussion_db import DiscussionDatabase
 from overlore.sqlite.events_db import EventsDatabase
 from overlore.sqlite.npc_db import NpcDatabase
 from overlore.torii.constants import EventType
-from overlore.torii.parsing import parse_event, parse_npc_spawn_event
+from overlore.torii.parsing import get_event_type, parse_event, parse_npc_spawn_event
+from overlore.torii.reconciliation import Reconciler
 from overlore.types import ToriiEmittedEvent
 
 logger = logging.getLogger("overlore")
 
 OnEventCallbackType = Callable[[ToriiEmittedEvent, BootConfig | None], Coroutine[Any, Any, int]]
 
+StreamRunner = Callable[[Client], Coroutine[Any, Any, None]]
+
+MULTIPLEXED_SUBSCRIPTION_TASK_NAME = "multiplexed_subscription"
+# Events of a single type waiting for their handler before the multiplexed subscription stops reading
+HANDLER_QUEUE_SIZE = 256
+# Upper bound of the delay before a lost subscription reconnects
+MAX_RECONNECT_DELAY_S = 60
+# A subscription live for that long is considered recovered, its next reconnection starts from the shortest delays
+STABLE_STREAM_S = 60
+
+
+class StreamState(Enum):
+    CONNECTING = "connecting"
+    LIVE = "live"
+    BACKING_OFF = "backing_off"
+
+
+class StreamHealth(TypedDict):
+    state: StreamState
+    # consecutive failed connections
+    failures: int
+    last_error: str | None
+    live_since: float | None
+
+
+# Health of every supervised subscription by name
+STREAMS_HEALTH: dict[str, StreamHealth] = {}
+
 
 class Subscriptions(Enum):
     KEY_BASED_SUB_TEMPLATE = """
@@ -53,47 +82,179 @@ class Subscriptions(Enum):
     NONE = "None"
 
 
-def backoff_logging(details: Details) -> None:
-    # Retrieve exception type, value, and traceback
-    exc_type, exc_value, _ = sys.exc_info()
+async def torii_event_sub(
+    session: Client,
+    on_event_callback: OnEventCallbackType,
+    gql_subscription: Subscriptions,
+    config: BootConfig,
+    reconciler: Reconciler,
+) -> None:
+    logger.debug("subscribing to %s", gql_subscription)
+    async for result in session.subscribe(gql(gql_subscription.value)):  # type: ignore[attr-defined]
+        await reconciler.on_event(result, lambda event: on_event_callback(event, config))
 
-    # Format the exception information for logging
-    if exc_type is not None and exc_value is not None:
-        exc_info = f"{exc_type.__name__}: {exc_value}"
-    else:
-        exc_info = "No exception information"
 
-    # Format the exception information for logging
-    logger.warning(
-        f'Backing off {details["wait"]} seconds after {details["tries"]} tries calling function'
-        f' {details["target"].__name__} with args and kwargs {details["kwargs"]} due to {exc_info}',
-    )
+async def torii_multiplexed_sub(
+    session: Client,
+    callback_and_subs: list[tuple[Subscriptions, OnEventCallbackType]],
+    config: BootConfig,
+    reconciler: Reconciler,
+) -> None:
+    """Receives every event through ANY_EVENT_EMITTED and routes it by its key to the queue of its event type.
+    Each queue has its own worker, a slow handler only holds back the events of its type, see EventRouter"""
+    dispatch_table = {EventType[sub.name].value: callback for (sub, callback) in callback_and_subs}
+    router = EventRouter(list(dispatch_table), reconciler)
 
+    async def handle(queue: asyncio.Queue[ToriiEmittedEvent], callback: OnEventCallbackType) -> None:
+        while True:
+            event = await queue.get()
+            # a failed event must not stop its worker, nor the router and the other workers gathered with it
+            try:
+                await reconciler.on_event(event, lambda event: callback(event, config))
+            except Exception:
+                logger.exception("Unable to handle event %s", event)
+            finally:
+                queue.task_done()
 
-async def torii_event_sub(
-    session: Client, on_event_callback: OnEventCallbackType, gql_subscription: Subscriptions, config: BootConfig
+    tasks = [asyncio.create_task(router.route(session), name=Subscriptions.ANY_EVENT_EMITTED.name)] + [
+        asyncio.create_task(handle(router.queues[event_key], callback), name=f"{EventType(event_key).name}_HANDLER")
+        for event_key, callback in dispatch_table.items()
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in [*tasks, *router.recoveries]:
+            task.cancel()
+
+
+class EventRouter:
+    """Routes events to the queue of their event type without ever waiting. Events of a type whose queue is full are
+    dropped until its worker handled the queued ones, then the reconciler backfills them from the last one handled"""
+
+    def __init__(self, event_keys: list[str], reconciler: Reconciler) -> None:
+        self.queues: dict[str, asyncio.Queue[ToriiEmittedEvent]] = {
+            event_key: asyncio.Queue(maxsize=HANDLER_QUEUE_SIZE) for event_key in event_keys
+        }
+        self.reconciler = reconciler
+        # keys of the event types whose events are dropped
+        self.overflowing: set[str] = set()
+        self.recoveries: set[asyncio.Task[None]] = set()
+
+    async def route(self, session: Client) -> None:
+        logger.debug("subscribing to %s", Subscriptions.ANY_EVENT_EMITTED)
+        async for result in session.subscribe(gql(Subscriptions.ANY_EVENT_EMITTED.value)):  # type: ignore[attr-defined]
+            keys = result["eventEmitted"]["keys"]
+            event_key = get_event_type(keys=keys) if keys else None
+            if event_key is None or event_key not in self.queues or event_key in self.overflowing:
+                continue
+            try:
+                self.queues[event_key].put_nowait(result)
+            except asyncio.QueueFull:
+                logger.warning(f"Handler queue of {EventType(event_key).name} is full, dropping its events")
+                self.overflowing.add(event_key)
+                recovery = asyncio.create_task(self.recover(event_key))
+                self.recoveries.add(recovery)
+                recovery.add_done_callback(self.recoveries.discard)
+
+    async def recover(self, event_key: str) -> None:
+        # once the queued events are handled, the backfill starts from the last of them
+        await self.queues[event_key].join()
+        # reconcile() buffers the events of the type before it first yields, none can be lost in between
+        self.overflowing.discard(event_key)
+        try:
+            await self.reconciler.reconcile([EventType(event_key)])
+        except Exception as e:
+            logger.error(f"Backfill of the dropped {EventType(event_key).name} events failed: {e}")
+
+
+async def supervise_stream(
+    name: str, event_types: list[EventType], run: StreamRunner, config: BootConfig, reconciler: Reconciler
 ) -> None:
-    logger.debug("subscribing to %s", gql_subscription)
-    async for result in session.subscribe(gql(gql_subscription.value)):  # type: ignore[attr-defined]
+    """Keeps a stream subscribed on its own websocket whatever happens to the other ones. Each (re)connection
+    backfills the events of the stream's types from their last synced cursor. Failed attempts are retried forever,
+    after a delay drawn at random below a bound doubling up to MAX_RECONNECT_DELAY_S"""
+    health = STREAMS_HEALTH[name] = StreamHealth(
+        state=StreamState.CONNECTING, failures=0, last_error=None, live_since=None
+    )
+    delays = reconnect_delays()
+
+    while True:
+        health["state"] = StreamState.CONNECTING
+        logger.debug(f"attempting to establish subscription client for {name}...")
         try:
-            await on_event_callback(result, config)
-        except RuntimeError:
-            logger.error("Unable to process event %s in %s", result, gql_subscription)
+            async with Client(transport=WebsocketsTransport(url=config.env["TORII_WS"])) as session:
+                health["state"] = StreamState.LIVE
+                health["live_since"] = time.monotonic()
+                tasks = [asyncio.create_task(run(session)), asyncio.create_task(reconciler.reconcile(event_types))]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+            health["last_error"] = "subscription ended"
+        except Exception as e:
+            health["last_error"] = f"{e.__class__.__name__}: {e}"
+
+        # a stream that stayed live for a while starts over from the shortest delays
+        live_since = health["live_since"]
+        if live_since is not None and time.monotonic() - live_since >= STABLE_STREAM_S:
+            health["failures"] = 0
+            delays = reconnect_delays()
+        health["failures"] += 1
+        health["live_since"] = None
+        health["state"] = StreamState.BACKING_OFF
+
+        delay = backoff.full_jitter(next(delays))
+        logger.warning(
+            f"Subscription {name} lost after {health['failures']} consecutive failures ({health['last_error']}),"
+            f" reconnecting in {delay:.1f}s"
+        )
+        await asyncio.sleep(delay)
+
+
+def reconnect_delays() -> Generator[float, None, None]:
+    delays = backoff.expo(max_value=MAX_RECONNECT_DELAY_S)
+    # backoff generators yield None first
+    next(delays)
+    return cast(Generator[float, None, None], delays)
 
 
-@backoff.on_exception(backoff.expo, Exception, max_time=300, on_backoff=backoff_logging)
 async def use_torii_subscription(
-    config: BootConfig, callback_and_subs: list[tuple[Subscriptions, OnEventCallbackType]]
+    config: BootConfig, callback_and_subs: list[tuple[Subscriptions, OnEventCallbackType]], reconciler: Reconciler
 ) -> None:
-    transport = WebsocketsTransport(url=config.env["TORII_WS"])
-    client = Client(transport=transport)
-    logger.debug("attempting to establish subscription client...")
-    async with client as session:
-        tasks = [
-            asyncio.create_task(torii_event_sub(session, callback, sub, config), name=sub.name)
+    """Runs every stream under its own supervisor, a failing stream reconnects without interrupting the others"""
+    streams: list[tuple[str, list[EventType], StreamRunner]]
+    if config.multiplexed_subscription:
+        streams = [
+            (
+                MULTIPLEXED_SUBSCRIPTION_TASK_NAME,
+                [EventType[sub.name] for (sub, _) in callback_and_subs],
+                partial(
+                    torii_multiplexed_sub, callback_and_subs=callback_and_subs, config=config, reconciler=reconciler
+                ),
+            )
+        ]
+    else:
+        streams = [
+            (
+                sub.name,
+                [EventType[sub.name]],
+                partial(
+                    torii_event_sub,
+                    on_event_callback=callback,
+                    gql_subscription=sub,
+                    config=config,
+                    reconciler=reconciler,
+                ),
+            )
             for (sub, callback) in callback_and_subs
         ]
-        await asyncio.gather(*tasks)
+
+    tasks = [
+        asyncio.create_task(supervise_stream(name, event_types, run, config, reconciler), name=name)
+        for (name, event_types, run) in streams
+    ]
+    await asyncio.gather(*tasks)
 
 
 async def process_received_event(event: ToriiEmittedEvent, _: BootConfig | None = None) -> int:
@@ -107,25 +268,34 @@ async def process_received_event(event: ToriiEmittedEvent, _: BootConfig | None
 async def process_received_spawn_npc_event(
     event: ToriiEmittedEvent,
     config: BootConfig | None,
+    llm_client: LlmClient,
 ) -> int:
     if config is None:
         raise RuntimeError(ErrorCodes.EXPECTED_CONFIG)
     npc_db = NpcDatabase.instance()
     discussion_db = DiscussionDatabase.instance()
-    llm_client = AsyncOpenAiClient()
-    katana_ts = await KatanaClient(url=config.env["KATANA_URL"]).get_katana_ts()
 
     parsed_event = parse_npc_spawn_event(event=event["eventEmitted"])
 
     npc_entity_id = cast(int, parsed_event["npc_entity_id"])
     realm_entity_id = cast(int, parsed_event["realm_entity_id"])
 
-    row_id = npc_db.insert_npc_backstory(npc_entity_id, realm_entity_id)
+    # a spawn can be received again by a backfill, it is only done once its backstory thought is stored.
+    # npc.db and discussion.db can't share a transaction, a spawn that failed in between reuses its backstory
+    if discussion_db.count_npc_thoughts(npc_entity_id) > 0:
+        logger.info(f"Npc {npc_entity_id} is already stored")
+        return 0
+    katana_ts = await KatanaClient(url=config.env["KATANA_URL"]).get_katana_ts()
+
+    if not npc_db.fetch_npcs_backstories([npc_entity_id]):
+        npc_db.insert_npc_backstory(npc_entity_id, realm_entity_id)
 
     backstory = npc_db.fetch_npc_backstory(npc_entity_id=npc_entity_id)
 
     embedding = await llm_client.request_embedding(
-        backstory.backstory, model=EmbeddingsModel.TEXT_EMBEDDING_SMALL.value
+        backstory.backstory,
+        model=EmbeddingsModel.TEXT_EMBEDDING_SMALL.value,
+        dimensions=discussion_db.embedding_profile["dimensions"],
     )
 
     row_id = discussion_db.insert_npc_thought(
@@ -147,8 +317,10 @@ async def process_received_spawn_npc_event(
     return row_id
 
 
-TORII_SUBSCRIPTIONS: list[tuple[Subscriptions, OnEventCallbackType]] = [
-    (Subscriptions.COMBAT_OUTCOME, process_received_event),
-    (Subscriptions.ORDER_ACCEPTED, process_received_event),
-    (Subscriptions.NPC_SPAWNED, process_received_spawn_npc_event),
-]
+def create_torii_subscriptions(llm_client: LlmClient) -> list[tuple[Subscriptions, OnEventCallbackType]]:
+    """Every npc spawn shares llm_client, so their embeddings are batched and cached together"""
+    return [
+        (Subscriptions.COMBAT_OUTCOME, process_received_event),
+        (Subscriptions.ORDER_ACCEPTED, process_received_event),
+        (Subscriptions.NPC_SPAWNED, partial(process_received_spawn_npc_event, llm_client=llm_client)),
+    ]
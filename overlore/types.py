@@ -15,6 +15,8 @@ roles_str = ", ".join([f"{index} for {role}" for index, role in enumerate(ROLES)
 
 EventKeys = list[str]
 EventData = list[str]
+# Either floats or packed little-endian float32, the format vss0 stores embeddings in
+Embedding = list[float] | bytes
 
 
 class ToriiDataNode(TypedDict):
@@ -24,6 +26,11 @@ class ToriiDataNode(TypedDict):
     transactionHash: Optional[str]
 
 
+class ToriiEventEdge(TypedDict):
+    cursor: str
+    node: ToriiDataNode
+
+
 class ToriiEmittedEvent(TypedDict):
     eventEmitted: ToriiDataNode
 
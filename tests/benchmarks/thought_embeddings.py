@@ -0,0 +1,97 @@
+"""Recall and latency of the thought embedding profiles against the exact 1536 dimensions ranking, scored by sqlite
+and by the thought store. Npcs with ANN_MIN_THOUGHTS thoughts or more are searched through their inverted lists,
+try --npcs 1 --thoughts 20000.
+
+Run with `python -m tests.benchmarks.thought_embeddings`"""
+import argparse
+import math
+import random
+import tempfile
+import time
+
+from overlore.sqlite.discussion_db import DEFAULT_EMBEDDING_PROFILE, DiscussionDatabase, ThoughtEmbeddingProfile
+from overlore.sqlite.thought_store import NUMPY_AVAILABLE
+
+PROFILES = [ThoughtEmbeddingProfile(dimensions=dimensions) for dimensions in [1536, 512, 256]]
+SCORERS = ["sqlite", "thought store"] if NUMPY_AVAILABLE else ["sqlite"]
+
+
+def generate_embeddings(num: int, topics: int, rand: random.Random) -> list[list[float]]:
+    """Embeddings clustered around topics, most of their energy in the first dimensions like text-embedding-3"""
+    scales = [1.0 / math.sqrt(1.0 + i / 32.0) for i in range(0, 1536)]
+    centers = [[rand.gauss(0.0, scale) for scale in scales] for _ in range(0, topics)]
+    embeddings = []
+    for _ in range(0, num):
+        center = rand.choice(centers)
+        embedding = [value + rand.gauss(0.0, 0.5 * scale) for (value, scale) in zip(center, scales)]
+        norm = math.sqrt(sum(value * value for value in embedding))
+        embeddings.append([value / norm for value in embedding])
+    return embeddings
+
+
+def run(
+    profile: ThoughtEmbeddingProfile,
+    scorer: str,
+    path: str,
+    thoughts: list[list[float]],
+    queries: list[list[float]],
+    npc_entity_ids: list[int],
+) -> tuple[list[dict[int, str]], float, float]:
+    db = DiscussionDatabase.instance().init(path, embedding_profile=profile)
+    with db.transaction():
+        for i, embedding in enumerate(thoughts):
+            db.insert_npc_thought(
+                npc_entity_id=npc_entity_ids[i % len(npc_entity_ids)],
+                thought=f"{i}",
+                poignancy=i % 10,
+                katana_ts=i,
+                thought_embedding=embedding,
+            )
+    # the embeddings scored, whichever the scorer
+    size = db.execute_query("SELECT avg(length(embedding)) FROM npc_thought;", ())[0][0]
+    if scorer == "thought store":
+        db.warm_thought_store()
+
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        best_thoughts = db.get_highest_scoring_thoughts(query, npc_entity_ids, katana_ts=len(thoughts))
+        results.append({npc_entity_id: thought[0] for (npc_entity_id, thought) in best_thoughts.items()})
+    latency = (time.perf_counter() - start) / len(queries)
+    db.close_conn()
+
+    return (results, latency, size)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--thoughts", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--npcs", type=int, default=10)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    embeddings = generate_embeddings(args.thoughts + args.queries, topics=args.npcs * 4, rand=rand)
+    (thoughts, queries) = (embeddings[: args.thoughts], embeddings[args.thoughts :])
+    npc_entity_ids = list(range(1, args.npcs + 1))
+
+    with tempfile.TemporaryDirectory() as directory:
+        (exact, _, _) = run(
+            DEFAULT_EMBEDDING_PROFILE, "sqlite", f"{directory}/exact.db", thoughts, queries, npc_entity_ids
+        )
+
+        print(f"{args.thoughts} thoughts, {args.npcs} npcs, {args.queries} queries")
+        print(f"{'dimensions':>10} {'scorer':>14} {'recall@1':>9} {'latency ms':>11} {'bytes/thought':>14}")
+        for i, (profile, scorer) in enumerate((profile, scorer) for profile in PROFILES for scorer in SCORERS):
+            (results, latency, size) = run(profile, scorer, f"{directory}/{i}.db", thoughts, queries, npc_entity_ids)
+            matches = sum(
+                result[npc_entity_id] == expected[npc_entity_id]
+                for (result, expected) in zip(results, exact)
+                for npc_entity_id in expected
+            )
+            recall = matches / sum(len(expected) for expected in exact)
+            print(f"{profile['dimensions']:>10} {scorer:>14} {recall:>9.3f} {latency * 1000:>11.2f} {size:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
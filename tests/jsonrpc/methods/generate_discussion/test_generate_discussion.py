@@ -1,4 +1,6 @@
+import asyncio
 import json
+from typing import Any
 
 import pytest
 
@@ -19,6 +21,7 @@ from overlore.types import (
     Characteristics,
     DialogueThoughts,
     Discussion,
+    Embedding,
     NpcAndThoughts,
     NpcEntity,
     Thought,
@@ -84,6 +87,67 @@ async def test_generate_discussion_torii_unavailable(context: Context):
     assert error.value.args[0] == ErrorCodes.TORII_UNAVAILABLE
 
 
+@pytest.mark.asyncio
+async def test_generate_discussion_requests_run_concurrently(context: Context):
+    params = MethodParams(realm_id=1, user_input="Hello World!", realm_entity_id=1, order_id=1)
+    started: set[str] = set()
+
+    async def wait_for_the_others(name: str) -> None:
+        # only returns once the three requests are in flight at the same time
+        started.add(name)
+        while len(started) < 3:
+            await asyncio.sleep(0)
+
+    class WaitingToriiClient(MockToriiClient):
+        async def get_npcs_by_realm_entity_id(self, realm_entity_id: int) -> list[NpcEntity]:
+            await wait_for_the_others("torii")
+            return await super().get_npcs_by_realm_entity_id(realm_entity_id)
+
+    class WaitingKatanaClient(MockKatanaClient):
+        async def get_katana_ts(self) -> int:
+            await wait_for_the_others("katana")
+            return await super().get_katana_ts()
+
+    class WaitingLlmClient(MockLlmClient):
+        async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+            await wait_for_the_others("embedding")
+            return await super().request_embedding(input_str, *args, **kwargs)
+
+    context["torii_client"] = WaitingToriiClient(npcs_return=npcs)
+    context["katana_client"] = WaitingKatanaClient()
+    context["llm_client"] = WaitingLlmClient(embedding_return=valid_embedding, prompt_completion_return="")
+
+    discussion_builder = await asyncio.wait_for(DiscussionBuilder.create(context=context, params=params), timeout=1)
+
+    assert discussion_builder.katana_ts == KATANA_MOCK_TS
+    assert len(discussion_builder.npcs) == 2
+    assert discussion_builder.query_embedding == valid_embedding
+
+
+@pytest.mark.asyncio
+async def test_generate_discussion_failure_cancels_the_other_requests(context: Context):
+    params = MethodParams(realm_id=1, user_input="Hello World!", realm_entity_id=1, order_id=1)
+    cancelled: list[str] = []
+
+    class HangingKatanaClient(MockKatanaClient):
+        async def get_katana_ts(self) -> int:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append("katana")
+                raise
+            return await super().get_katana_ts()
+
+    context["torii_client"] = MockToriiClient(force_fail=True)
+    context["katana_client"] = HangingKatanaClient()
+
+    with pytest.raises(RuntimeError) as error:
+        _ = await asyncio.wait_for(DiscussionBuilder.create(context=context, params=params), timeout=1)
+
+    assert error.value.args[0] == ErrorCodes.TORII_UNAVAILABLE
+    assert cancelled == ["katana"]
+
+
 @pytest.fixture
 def context():
     npc_db = NpcDatabase.instance().init(":memory:")
@@ -1,9 +1,20 @@
+import threading
 from sqlite3 import Connection
 
 import pytest
 import sqlean
 
-from overlore.sqlite.base_db import BaseDatabase
+from overlore.sqlite.base_db import (
+    A_DISTANCE,
+    A_TIME,
+    DEFAULT_PRAGMA_PROFILE,
+    BaseDatabase,
+    PragmaProfile,
+    average,
+    average_sql,
+    decay_function,
+    decay_sql,
+)
 from tests.utils.base_db_test_utils import (
     insert_query,
     prepare_data,
@@ -17,7 +28,7 @@ from tests.utils.base_db_test_utils import (
 @pytest.fixture
 def db():
     db = BaseDatabase.__new__(BaseDatabase)
-    db._init(":memory:", [], ["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)"], [], lambda db: None)
+    db._init(":memory:", [], [["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)"]], [], lambda db: None)
     yield db
     db.close_conn()
 
@@ -50,6 +61,53 @@ def test_update(db):
         assert item["value"] == retrieved_entry, f"Expected value '{item['value']}', got '{retrieved_entry}'"
 
 
+def test_insert_skipped_by_conflict(db):
+    conflict_query = "INSERT INTO test_table (id, value) VALUES (?, ?) ON CONFLICT(id) DO NOTHING"
+
+    assert db._insert(conflict_query, (1, "first")) == 1
+    assert db._insert(conflict_query, (1, "second")) == 0, "Expected 0 when the insert was skipped"
+    assert db.execute_query(select_query, (1,))[0][0] == "first"
+
+
+def test_insert_many(db):
+    added_count = db._insert_many(insert_query, [(item["value"],) for item in test_data])
+
+    assert added_count == len(test_data), f"Expected {len(test_data)} added rows, got {added_count}"
+    for item in test_data:
+        retrieved_entry = db.execute_query(select_query, (item["rowid"],))[0][0]
+        assert item["value"] == retrieved_entry, f"Expected value '{item['value']}', got '{retrieved_entry}'"
+
+
+def test_transaction_commits_once(db):
+    with db.transaction():
+        for item in test_data:
+            db._insert(insert_query, (item["value"],))
+        assert db.db.in_transaction, "Expected writes to be held in an open transaction"
+
+    assert not db.db.in_transaction, "Expected the transaction to be committed on exit"
+    assert len(db.execute_query("SELECT * FROM test_table", ())) == len(test_data)
+
+
+def test_nested_transaction(db):
+    with db.transaction():
+        with db.transaction():
+            db._insert(insert_query, (test_data[0]["value"],))
+        assert db.db.in_transaction, "Expected the inner block to defer its commit to the outer one"
+
+    assert not db.db.in_transaction, "Expected the transaction to be committed on exit"
+
+
+def test_transaction_rollback(db):
+    prepare_data(db)
+    db.db.commit()
+
+    with pytest.raises(ValueError), db.transaction():
+        db._insert(insert_query, ("rolled back",))
+        raise ValueError()
+
+    assert len(db.execute_query("SELECT * FROM test_table", ())) == len(test_data)
+
+
 def test_close_conn(db):
     db.close_conn()
     with pytest.raises(sqlean.dbapi2.ProgrammingError):
@@ -69,6 +127,19 @@ def test_custom_function(db):
     assert result == 20, f"Expected custom function result 20, got {result}"
 
 
+def test_decay_sql_matches_decay_function(db):
+    for a in [A_DISTANCE, A_TIME, -1.0]:
+        for x in [-5000, -1, 0, 0.5, 1, 333.3, 9999, 10000, 10001, 604799, 604800, 604801, 10**9]:
+            result = db.execute_query(f"SELECT {decay_sql('?', '10', '?')}", (a, x))[0][0]
+            assert result == decay_function(a, 10, x), f"Expected {decay_function(a, 10, x)} for {a}*{x}, got {result}"
+
+
+def test_average_sql_matches_average(db):
+    for args in [(0.0, 0.0, 1.0), (9.9999, 3.3333333, 7.0), (10.0, 10.0, 10.0), (0.1, 0.2, 0.3)]:
+        result = db.execute_query(f"SELECT {average_sql('?', '?', '?')}", args)[0][0]
+        assert result == average(*args), f"Expected {average(*args)} for {args}, got {result}"
+
+
 def test_error_handling(db):
     # Test with a malformed query
     with pytest.raises(sqlean.dbapi2.OperationalError):
@@ -94,13 +165,88 @@ def test_load_extensions(db):
     assert result is not None, "Extension function did not execute correctly"
 
 
-def test_first_boot_queries(db):
-    first_boot_query = "CREATE TABLE IF NOT EXISTS first_boot_test (id INTEGER PRIMARY KEY, value TEXT)"
+def test_apply_migration(db):
+    migration = ["CREATE TABLE IF NOT EXISTS migration_test (id INTEGER PRIMARY KEY, value TEXT)"]
+
+    db._apply_migration(migration)
+
+    tables = db.execute_query("SELECT name FROM sqlite_master WHERE type='table' AND name='migration_test';", ())
+    assert len(tables) > 0, "Migration table was not created"
+
+
+def test_migrations_are_versioned(tmp_path):
+    path = str(tmp_path / "test.db")
+    migrations = [
+        ["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)"],
+        ["CREATE INDEX test_table_value_idx ON test_table (value)"],
+    ]
+
+    db = BaseDatabase.__new__(BaseDatabase)
+    db._init(path, [], migrations[:1], [], lambda db: None)
+    assert db.execute_query("PRAGMA user_version;", ())[0][0] == 1
+    db.close_conn()
+
+    # reopening runs the new migration only, re-running the first one would fail on the existing table
+    db._init(path, [], migrations, [], lambda db: None)
+    assert db.execute_query("PRAGMA user_version;", ())[0][0] == 2
+    indexes = db.execute_query("SELECT name FROM sqlite_master WHERE type='index' AND name='test_table_value_idx';", ())
+    assert len(indexes) == 1, "Index from the second migration was not created"
+    db.close_conn()
+
+
+def test_legacy_database_skips_first_migration(tmp_path):
+    path = str(tmp_path / "test.db")
+    migrations = [
+        ["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)"],
+        ["CREATE INDEX test_table_value_idx ON test_table (value)"],
+    ]
+    legacy_db = sqlean.connect(path)
+    legacy_db.execute(migrations[0][0])
+    legacy_db.close()
+
+    db = BaseDatabase.__new__(BaseDatabase)
+    db._init(path, [], migrations, [], lambda db: None)
+
+    assert db.execute_query("PRAGMA user_version;", ())[0][0] == 2
+    db.close_conn()
+
+
+def test_failed_migration_is_rolled_back(tmp_path):
+    path = str(tmp_path / "test.db")
+    migrations = [
+        ["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)"],
+        ["INSERT INTO test_table (value) VALUES ('migrated')", "SELEC * FROM test_table"],
+    ]
+
+    db = BaseDatabase.__new__(BaseDatabase)
+    with pytest.raises(sqlean.dbapi2.OperationalError):
+        db._init(path, [], migrations, [], lambda db: None)
+
+    assert db.db.execute("PRAGMA user_version;").fetchone()[0] == 1
+    assert db.db.execute("SELECT * FROM test_table").fetchall() == []
+    db.close_conn()
+
+
+def test_failed_first_migration_leaves_no_table(tmp_path):
+    path = str(tmp_path / "test.db")
+    migrations = [["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)", "SELEC * FROM test_table"]]
+
+    db = BaseDatabase.__new__(BaseDatabase)
+    with pytest.raises(sqlean.dbapi2.OperationalError):
+        db._init(path, [], migrations, [], lambda db: None)
+
+    # a leftover table would be taken for a legacy database on the next start
+    assert db.db.execute("SELECT name FROM sqlite_master WHERE type = 'table';").fetchall() == []
+    assert db._schema_version() == 0
+    db.close_conn()
 
-    db._use_first_boot_queries([first_boot_query])
 
-    tables = db.execute_query("SELECT name FROM sqlite_master WHERE type='table' AND name='first_boot_test';", ())
-    assert len(tables) > 0, "First boot table was not created"
+def test_transaction_rolls_back_schema_changes(db):
+    with pytest.raises(RuntimeError), db.transaction():
+        db.db.execute("CREATE TABLE rolled_back (id INTEGER PRIMARY KEY)")
+        raise RuntimeError
+
+    assert db.execute_query("SELECT name FROM sqlite_master WHERE name = 'rolled_back';", ()) == []
 
 
 def test_preload_function(db):
@@ -118,6 +264,85 @@ def test_thread_safety_configuration(db):
     assert any("THREADSAFE=1" in option for option, in threadsafety), "Database is not configured for thread safety"
 
 
+def test_default_pragma_profile(tmp_path):
+    db = BaseDatabase.__new__(BaseDatabase)
+    db._init(str(tmp_path / "test.db"), [], [], [], lambda db: None)
+
+    assert db.execute_query("PRAGMA journal_mode;", ())[0][0] == "wal"
+    assert db.execute_query("PRAGMA synchronous;", ())[0][0] == 1, "Expected synchronous to be NORMAL"
+    assert db.execute_query("PRAGMA temp_store;", ())[0][0] == 2, "Expected temp_store to be MEMORY"
+    assert db.execute_query("PRAGMA cache_size;", ())[0][0] == DEFAULT_PRAGMA_PROFILE["cache_size"]
+    assert db.execute_query("PRAGMA busy_timeout;", ())[0][0] == DEFAULT_PRAGMA_PROFILE["busy_timeout"]
+    db.close_conn()
+
+
+def test_custom_pragma_profile(tmp_path):
+    pragmas = PragmaProfile(
+        journal_mode="DELETE", synchronous="FULL", mmap_size=0, cache_size=-1024, temp_store="FILE", busy_timeout=100
+    )
+    db = BaseDatabase.__new__(BaseDatabase)
+    db._init(str(tmp_path / "test.db"), [], [], [], lambda db: None, pragmas)
+
+    assert db.execute_query("PRAGMA journal_mode;", ())[0][0] == "delete"
+    assert db.execute_query("PRAGMA synchronous;", ())[0][0] == 2, "Expected synchronous to be FULL"
+    assert db.execute_query("PRAGMA cache_size;", ())[0][0] == -1024
+    assert db.execute_query("PRAGMA busy_timeout;", ())[0][0] == 100
+    db.close_conn()
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    db = BaseDatabase.__new__(BaseDatabase)
+    db._init(
+        str(tmp_path / "test.db"),
+        [],
+        [["CREATE TABLE test_table (id INTEGER PRIMARY KEY, value TEXT)"]],
+        [("test_func", 1, lambda x: x * 2)],
+        lambda db: None,
+    )
+    yield db
+    db.close_conn()
+
+
+def test_reader_connection_per_thread(file_db):
+    readers = []
+
+    def read():
+        file_db.execute_query("SELECT * FROM test_table", ())
+        readers.append(file_db._reader())
+
+    threads = [threading.Thread(target=read) for _ in range(0, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(reader) for reader in readers}) == len(threads), "Expected one reader connection per thread"
+    assert all(reader is not file_db.db for reader in readers), "Expected readers to be distinct from the writer"
+
+
+def test_reader_sees_committed_writes(file_db):
+    for item in test_data:
+        file_db._insert(insert_query, (item["value"],))
+
+    assert len(file_db.execute_query("SELECT * FROM test_table", ())) == len(test_data)
+    assert file_db.execute_query("SELECT test_func(id) FROM test_table WHERE id = 1", ())[0][0] == 2
+
+
+def test_read_inside_transaction_uses_writer(file_db):
+    with file_db.transaction():
+        file_db._insert(insert_query, ("uncommitted",))
+        assert len(file_db.execute_query("SELECT * FROM test_table", ())) == 1
+
+        reader_records = file_db._reader().execute("SELECT * FROM test_table").fetchall()
+        assert len(reader_records) == 0, "Expected readers not to see uncommitted writes"
+
+
+def test_reader_is_query_only(file_db):
+    with pytest.raises(sqlean.dbapi2.OperationalError):
+        file_db._reader().execute(insert_query, ("value",))
+
+
 def test_init_call(db):
     with pytest.raises(RuntimeError):
         db.__init__()
@@ -0,0 +1,214 @@
+import asyncio
+import re
+import threading
+from typing import Any
+
+import pytest
+
+from overlore.errors import ErrorCodes
+from overlore.sqlite.events_db import EventsDatabase
+from overlore.sqlite.types import LastSeenEvent
+from overlore.torii import boot_sync, client
+from overlore.torii.boot_sync import BootSync
+from overlore.torii.client import ToriiClient
+from overlore.torii.constants import EventType
+from overlore.torii.parsing import parse_event
+from overlore.types import ToriiEmittedEvent
+
+
+def trade_event(index: int) -> dict[str, Any]:
+    return {
+        "id": f"0x{index:064x}:0x0000:0x0023",
+        "keys": [
+            "0x27319ec70e0f69f3988d0a1a75dd2cc3715d4d7a60acec45b51fe577a5f2bf1",
+            "0x7d",
+            "0x63cbe849cf6325e727a8d6f82f25fad7dc7eb9433767f5c1b8c59189e36c9b6",
+        ],
+        "data": ["0x4b", "0x2", "0x49", "0x1", "0x1", "0x8", "0x1388", "0x1", "0x1", "0x1388", "0x65a1dafd"],
+        "createdAt": f"2024-01-02 14:36:{index:02}",
+    }
+
+
+def spawn_event(index: int) -> dict[str, Any]:
+    return {
+        "id": f"0x{index:064x}:0x0000:0x0024",
+        "keys": [EventType.NPC_SPAWNED.value],
+        "data": [hex(index), "0x1"],
+        "createdAt": f"2024-01-02 14:36:{index:02}",
+    }
+
+
+def last_seen(event: dict[str, Any]) -> LastSeenEvent:
+    return LastSeenEvent(torii_event_id=event["id"], created_at=event["createdAt"])
+
+
+class PagingToriiClient(ToriiClient):
+    """Serves the trade and spawn events as Torii would, the cursor of an event being its index"""
+
+    def __init__(self, trade_events: list[dict[str, Any]], spawn_events: list[dict[str, Any]] | None = None) -> None:
+        super().__init__(url="")
+        self.trade_events = trade_events
+        self.spawn_events = spawn_events if spawn_events is not None else []
+        self.queries: list[str] = []
+
+    async def run_torii_query(self, query: str) -> Any:
+        self.queries.append(query)
+        events = []
+        if EventType.ORDER_ACCEPTED.value in query:
+            events = self.trade_events
+        elif EventType.NPC_SPAWNED.value in query:
+            events = self.spawn_events
+        if "last:" in query:
+            last = int(re.findall(r"last: (\d+)", query)[0])
+            before = re.search(r'before: "(\d+)"', query)
+            end = int(before.group(1)) if before is not None else len(events)
+            start = max(0, end - last)
+        else:
+            first = int(re.findall(r"first: (\d+)", query)[0])
+            after = re.search(r'after: "(\d+)"', query)
+            start = int(after.group(1)) + 1 if after is not None else 0
+            end = start + first
+        return {
+            "events": {
+                "pageInfo": {"hasNextPage": end < len(events), "hasPreviousPage": start > 0},
+                "edges": [{"cursor": str(start + i), "node": node} for i, node in enumerate(events[start:end])],
+            }
+        }
+
+
+@pytest.fixture
+def events_db(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(client, "SYNC_PAGE_SIZE", 2)
+    monkeypatch.setattr(boot_sync, "WRITE_BATCH_SIZE", 3)
+    db = EventsDatabase.instance().init(":memory:")
+    db.realms.init("./tests/data/test_geodata.json")
+    yield db
+    db.close_conn()
+
+
+@pytest.mark.asyncio
+async def test_boot_sync_pages_and_resumes(events_db: EventsDatabase):
+    torii_client = PagingToriiClient([trade_event(i) for i in range(5)])
+    assert await BootSync(torii_client).run() == 5
+
+    assert len(events_db.get_all()) == 5
+    sync_position = events_db.fetch_sync_position(EventType.ORDER_ACCEPTED.value)
+    assert sync_position is not None
+    assert sync_position["cursor"] == "4"
+    assert sync_position["created_at"] == "2024-01-02 14:36:04"
+    # 3 pages of trades, 1 empty page of combats
+    assert len(torii_client.queries) == 4
+
+    torii_client = PagingToriiClient([trade_event(i) for i in range(7)])
+    assert await BootSync(torii_client).run() == 2
+
+    assert len(events_db.get_all()) == 7
+    trade_queries = [query for query in torii_client.queries if EventType.ORDER_ACCEPTED.value in query]
+    assert len(trade_queries) == 1
+    assert 'after: "4"' in trade_queries[0]
+
+
+@pytest.mark.asyncio
+async def test_boot_sync_fetchers_wait_for_the_writer(events_db: EventsDatabase, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(boot_sync, "PAGES_BUFFERED", 1)
+    torii_client = PagingToriiClient([trade_event(i) for i in range(20)])
+    insert_events = events_db.insert_events
+    writer_released = threading.Event()
+
+    def blocked_insert_events(*args: Any) -> int:
+        writer_released.wait()
+        return insert_events(*args)
+
+    monkeypatch.setattr(events_db, "insert_events", blocked_insert_events)
+    sync = asyncio.create_task(BootSync(torii_client).run())
+    try:
+        await asyncio.sleep(0.1)
+        # a page in the writer, one in each queue, one in the parser and one in the trade fetcher
+        trade_queries = [query for query in torii_client.queries if EventType.ORDER_ACCEPTED.value in query]
+        assert len(trade_queries) == 5
+    finally:
+        writer_released.set()
+
+    assert await sync == 20
+    assert len(events_db.get_all()) == 20
+
+
+@pytest.mark.asyncio
+async def test_boot_sync_catches_up_from_the_last_event_seen(events_db: EventsDatabase):
+    trade_events = [trade_event(i) for i in range(7)]
+    torii_client = PagingToriiClient(trade_events)
+    since = {EventType.ORDER_ACCEPTED.value: last_seen(trade_events[2])}
+
+    assert await BootSync(torii_client, [EventType.ORDER_ACCEPTED], since).run() == 4
+
+    assert len(events_db.get_all()) == 4
+    # the pages after the last event seen, newest first, without paging from the sync position
+    assert len(torii_client.queries) == 3
+    assert all("last: 2" in query for query in torii_client.queries)
+    sync_position = events_db.fetch_sync_position(EventType.ORDER_ACCEPTED.value)
+    assert sync_position is not None
+    assert sync_position["cursor"] == "6"
+
+    # nothing missed, the sync position still follows the newest event
+    trade_events.append(trade_event(7))
+    since = {EventType.ORDER_ACCEPTED.value: last_seen(trade_events[7])}
+    assert await BootSync(PagingToriiClient(trade_events), [EventType.ORDER_ACCEPTED], since).run() == 1
+    sync_position = events_db.fetch_sync_position(EventType.ORDER_ACCEPTED.value)
+    assert sync_position is not None
+    assert sync_position["cursor"] == "7"
+
+
+@pytest.mark.asyncio
+async def test_boot_sync_hands_spawns_to_the_spawn_callback(events_db: EventsDatabase):
+    spawned: list[str] = []
+
+    async def on_spawn(event: ToriiEmittedEvent) -> int:
+        spawned.append(event["eventEmitted"]["createdAt"][-2:])
+        if len(spawned) == 2:
+            raise RuntimeError(ErrorCodes.NPC_BACKSTORY_NOT_FOUND)
+        return len(spawned)
+
+    torii_client = PagingToriiClient([], [spawn_event(i) for i in range(5)])
+    assert await BootSync(torii_client, [EventType.NPC_SPAWNED], on_spawn=on_spawn).run() == 4
+
+    assert spawned == ["00", "01", "02", "03", "04"]
+    assert events_db.get_all() == []
+    sync_position = events_db.fetch_sync_position(EventType.NPC_SPAWNED.value)
+    assert sync_position is not None
+    assert sync_position["cursor"] == "4"
+
+
+@pytest.mark.asyncio
+async def test_boot_sync_failed_spawns_dont_stop_the_events(events_db: EventsDatabase):
+    async def on_spawn(event: ToriiEmittedEvent) -> int:
+        raise ConnectionError("OpenAI is unavailable")
+
+    torii_client = PagingToriiClient([trade_event(i) for i in range(5)], [spawn_event(i) for i in range(3)])
+    sync = BootSync(torii_client, [EventType.ORDER_ACCEPTED, EventType.NPC_SPAWNED], on_spawn=on_spawn)
+    assert await sync.run() == 5
+
+    assert len(events_db.get_all()) == 5
+    assert events_db.fetch_sync_position(EventType.ORDER_ACCEPTED.value) is not None
+
+
+@pytest.mark.asyncio
+async def test_boot_sync_resumes_from_the_events_stored_live(events_db: EventsDatabase):
+    trade_events = [trade_event(i) for i in range(6)]
+    assert await BootSync(PagingToriiClient(trade_events[:2]), [EventType.ORDER_ACCEPTED]).run() == 2
+    # received live before a restart
+    for event in trade_events[2:5]:
+        events_db.insert_event(parse_event(event=event))  # type: ignore[arg-type]
+        events_db.store_last_seen(EventType.ORDER_ACCEPTED.value, last_seen(event))
+
+    since = events_db.fetch_last_seen()
+    assert since == {EventType.ORDER_ACCEPTED.value: last_seen(trade_events[4])}
+    torii_client = PagingToriiClient(trade_events)
+    assert await BootSync(torii_client, [EventType.ORDER_ACCEPTED], since).run() == 1
+    assert len(events_db.get_all()) == 6
+    # only the newest page was fetched again
+    assert len(torii_client.queries) == 1
+
+    # a backfill synced past the last event seen live
+    trade_events.extend([trade_event(6), trade_event(7)])
+    assert await BootSync(PagingToriiClient(trade_events), [EventType.ORDER_ACCEPTED]).run() == 2
+    assert events_db.fetch_last_seen() == {}
@@ -1,7 +1,17 @@
 import pytest
 
 from overlore.errors import ErrorCodes
-from overlore.sqlite.discussion_db import DiscussionDatabase
+from overlore.sqlite import thought_store
+from overlore.sqlite.discussion_db import (
+    DEFAULT_EMBEDDING_PROFILE,
+    THOUGHT_SCORE_QUERY,
+    DiscussionDatabase,
+    ThoughtEmbeddingProfile,
+    fit_embedding,
+    pack_embedding,
+    unpack_embedding,
+)
+from overlore.sqlite.thought_store import NUMPY_AVAILABLE
 from overlore.sqlite.types import StorableDiscussion
 from overlore.types import Characteristics, DialogueSegment, Discussion, NpcEntity
 from tests.utils.discussion_db_test_utils import (
@@ -186,6 +196,227 @@ def test_get_higest_scoring_thought_with_poignancy_increase(db: DiscussionDataba
     assert least != highest_scoring_though
 
 
+def test_file_db_reads_new_embeddings(tmp_path):
+    db = DiscussionDatabase.instance().init(str(tmp_path / "discussion.db"))
+    thoughts_filler = ThoughtsDatabaseFiller(database=db)
+
+    thoughts_filler.populate_with_time_increase(1)
+    db.get_highest_scoring_thought(query_embedding=[1.0] * 1536, npc_entity_id=1, katana_ts=1)
+    last_inserted_id = thoughts_filler.populate_with_time_increase(2)
+
+    (highest_scoring_thought, _, _, _) = db.get_highest_scoring_thought(
+        query_embedding=[1.0] * 1536, npc_entity_id=1, katana_ts=2
+    )
+
+    assert highest_scoring_thought == db.fetch_npc_thought_by_row_id(last_inserted_id)
+    # the thoughts were scored by a pooled reader, not the writer
+    assert len(db._reader_connections) == 1
+    db.close_conn()
+
+
+def test_thoughts_are_read_through_their_npc(tmp_path, monkeypatch):
+    path = str(tmp_path / "discussion.db")
+    monkeypatch.setattr(DiscussionDatabase, "MIGRATIONS", DiscussionDatabase.MIGRATIONS[:2])
+    # the embeddings of a version 2 database are only stored in vss_npc_thought
+    monkeypatch.setattr(DiscussionDatabase, "_apply_embedding_profile", lambda self, embedding_profile: None)
+    db = DiscussionDatabase.instance().init(path)
+    for i, npc_entity_id in enumerate([1, 2, 1], start=1):
+        db._insert(
+            "INSERT INTO npc_thought (npc_entity_id, thought, poignancy, ts) VALUES (?, ?, 1, 1);",
+            (npc_entity_id, f"{i}"),
+        )
+        db._insert(
+            "INSERT INTO vss_npc_thought (rowid, embedding) VALUES (?, ?);", (i, pack_embedding([float(i)] * 1536))
+        )
+    db.close_conn()
+    monkeypatch.undo()
+
+    db = DiscussionDatabase.instance().init(path)
+    plan = db.execute_query(f"EXPLAIN QUERY PLAN {THOUGHT_SCORE_QUERY}", (1, 1, b"", "[1]"))
+    stored_embeddings = db.execute_query("SELECT embedding FROM npc_thought ORDER BY rowid ASC;", ())
+
+    assert any("npc_thought_npc_entity_id_idx" in step[3] for step in plan)
+    assert not any("vss_npc_thought" in step[3] for step in plan)
+    assert [unpack_embedding(row[0])[0] for row in stored_embeddings] == [1.0, 2.0, 3.0]
+    assert db.execute_query("SELECT name FROM sqlite_master WHERE name = 'vss_npc_thought';", ()) == []
+    assert db.get_highest_scoring_thoughts([1.0] * 1536, [1, 2], katana_ts=1).keys() == {1, 2}
+    db.close_conn()
+
+
+@pytest.mark.skipif(not NUMPY_AVAILABLE, reason="the thought store requires numpy")
+def test_thought_store_only_holds_committed_thoughts():
+    db = DiscussionDatabase.instance().init(":memory:", thought_store=True)
+    thoughts_filler = ThoughtsDatabaseFiller(database=db)
+    assert db.thought_store is not None
+
+    with pytest.raises(RuntimeError), db.transaction():
+        thoughts_filler.populate_with_random_embeddings(10, [1, 2])
+        raise RuntimeError("rolled back")
+    with db.transaction():
+        thoughts_filler.populate_with_random_embeddings(10, [1, 2])
+        assert len(db.thought_store) == 0
+
+    assert len(db.thought_store) == 10
+    db.close_conn()
+
+
+def test_get_highest_scoring_thoughts_of_many_npcs(db: DiscussionDatabase):
+    npc_entity_ids = [1, 2, 3, 4]
+    embeddings = ThoughtsDatabaseFiller(database=db).populate_with_random_embeddings(40, npc_entity_ids)
+
+    thoughts = db.get_highest_scoring_thoughts(
+        query_embedding=embeddings[5], npc_entity_ids=[*npc_entity_ids, 999], katana_ts=1
+    )
+
+    assert set(thoughts.keys()) == set(npc_entity_ids)
+    assert thoughts[npc_entity_ids[6 % len(npc_entity_ids)]][0] == "6"
+    for npc_entity_id in npc_entity_ids:
+        assert thoughts[npc_entity_id] == db.get_highest_scoring_thought(
+            query_embedding=embeddings[5], npc_entity_id=npc_entity_id, katana_ts=1
+        )
+
+
+@pytest.mark.skipif(not NUMPY_AVAILABLE, reason="the thought store requires numpy")
+def test_thought_store_matches_sqlite():
+    db = DiscussionDatabase.instance().init(":memory:")
+    npc_entity_ids = [1, 2, 3]
+    thoughts_filler = ThoughtsDatabaseFiller(database=db)
+    embeddings = thoughts_filler.populate_with_random_embeddings(30, npc_entity_ids)
+    thoughts_filler.populate_with_time_increase(10)
+
+    db.warm_thought_store()
+    # kept in sync once warm
+    embeddings += thoughts_filler.populate_with_random_embeddings(30, npc_entity_ids, seed=1)
+    assert db.thought_store is not None
+    assert len(db.thought_store) == 70
+
+    for i in [0, 17, 45]:
+        for katana_ts in [1, 10, 1000000]:
+            stored_thoughts = db.get_highest_scoring_thoughts(embeddings[i], npc_entity_ids, katana_ts)
+            thought_store = db.thought_store
+            db.thought_store = None
+            thoughts = db.get_highest_scoring_thoughts(embeddings[i], npc_entity_ids, katana_ts)
+            db.thought_store = thought_store
+
+            assert stored_thoughts.keys() == thoughts.keys()
+            for npc_entity_id, (thought, ts, cos_similarity, score) in thoughts.items():
+                assert stored_thoughts[npc_entity_id][:2] == (thought, ts)
+                assert stored_thoughts[npc_entity_id][2:] == pytest.approx((cos_similarity, score), abs=1e-4)
+    db.close_conn()
+
+
+@pytest.mark.skipif(not NUMPY_AVAILABLE, reason="the thought store requires numpy")
+def test_thought_store_searches_the_inverted_lists_of_large_npcs(monkeypatch):
+    monkeypatch.setattr(thought_store, "ANN_MIN_THOUGHTS", 64)
+    monkeypatch.setattr(thought_store, "ANN_PROBES", 2)
+    db = DiscussionDatabase.instance().init(":memory:", thought_store=True)
+    embeddings = ThoughtsDatabaseFiller(database=db).populate_with_random_embeddings(300, [1, 2])
+    assert db.thought_store is not None
+
+    npc = db.thought_store._npcs[1]
+    assert npc.inverted_lists is not None
+    # retrained once the thoughts of the npc doubled past the threshold
+    assert npc.trained_count == 128
+    for i in [0, 99, 298]:
+        query = thought_store.to_vector(embeddings[i])
+        assert len(npc.inverted_lists.search(query / float(query @ query) ** 0.5, 2)) < npc.count
+        # a stored thought always falls in the list of its closest centroid
+        (thought, _, cos_similarity, _) = db.get_highest_scoring_thoughts(embeddings[i], [1, 2], katana_ts=1)[
+            [1, 2][(i + 1) % 2]
+        ]
+        assert thought == f"{i + 1}"
+        assert cos_similarity == pytest.approx(10.0)
+    db.close_conn()
+
+
+def test_packed_embeddings(db: DiscussionDatabase):
+    embedded_vector = [float(i) / 1536 for i in range(0, 1536)]
+    packed = pack_embedding(embedded_vector)
+
+    assert len(packed) == 4 * 1536
+    assert unpack_embedding(packed) == pytest.approx(embedded_vector)
+
+    db.insert_npc_thought(npc_entity_id=1, thought="floats", poignancy=1, katana_ts=1, thought_embedding=[1.0] * 1536)
+    row_id = db.insert_npc_thought(
+        npc_entity_id=1, thought="packed", poignancy=1, katana_ts=1, thought_embedding=packed
+    )
+    stored_embedding = db.execute_query("SELECT embedding FROM npc_thought WHERE rowid = ?;", (row_id,))[0][0]
+
+    assert stored_embedding == packed
+    (thought, _, cos_similarity, _) = db.get_highest_scoring_thought(
+        query_embedding=packed, npc_entity_id=1, katana_ts=1
+    )
+    assert thought == "packed"
+    assert cos_similarity == pytest.approx(10.0)
+    assert db.get_highest_scoring_thought(query_embedding=embedded_vector, npc_entity_id=1, katana_ts=1)[0] == thought
+
+
+def test_reduced_embedding_profile(tmp_path):
+    path = str(tmp_path / "discussion.db")
+    db = DiscussionDatabase.instance().init(path)
+    embeddings = ThoughtsDatabaseFiller(database=db).populate_with_random_embeddings(20, [1, 2])
+    full_thoughts = db.get_highest_scoring_thoughts(embeddings[3], [1, 2], katana_ts=1)
+    db.close_conn()
+
+    embedding_profile = ThoughtEmbeddingProfile(dimensions=256)
+    db = DiscussionDatabase.instance().init(path, embedding_profile=embedding_profile)
+    stored_embedding = db.execute_query("SELECT embedding FROM npc_thought WHERE rowid = 4;", ())[0][0]
+    reduced_thoughts = db.get_highest_scoring_thoughts(embeddings[3], [1, 2], katana_ts=1)
+
+    assert db._stored_embedding_profile() == embedding_profile
+    assert unpack_embedding(stored_embedding) == pytest.approx(
+        unpack_embedding(fit_embedding(embeddings[3], 256)), abs=1e-3
+    )
+    assert reduced_thoughts[1][0] == full_thoughts[1][0] == "4"
+    # new thoughts are shortened as well
+    row_id = db.insert_npc_thought(
+        npc_entity_id=1, thought="new", poignancy=1, katana_ts=1, thought_embedding=[1.0] * 1536
+    )
+    stored_embedding = db.execute_query("SELECT embedding FROM npc_thought WHERE rowid = ?;", (row_id,))[0][0]
+    assert len(stored_embedding) == 4 * 256
+    db.close_conn()
+
+    with pytest.raises(RuntimeError) as error:
+        DiscussionDatabase.instance().init(path)
+    assert error.value.args[0] == ErrorCodes.EMBEDDING_DIMENSIONS_TOO_LARGE
+    DiscussionDatabase.instance().close_conn()
+
+
+def test_failed_embedding_rebuild_keeps_the_stored_embeddings(tmp_path, monkeypatch):
+    path = str(tmp_path / "discussion.db")
+    db = DiscussionDatabase.instance().init(path)
+    embeddings = ThoughtsDatabaseFiller(database=db).populate_with_random_embeddings(20, [1, 2])
+    db.close_conn()
+
+    insert_many = db._insert_many
+
+    def fail(query, values):
+        insert_many(query, values)
+        raise RuntimeError(query)
+
+    monkeypatch.setattr(db, "_insert_many", fail)
+    with pytest.raises(RuntimeError):
+        DiscussionDatabase.instance().init(path, embedding_profile=ThoughtEmbeddingProfile(dimensions=256))
+    db.close_conn()
+    monkeypatch.undo()
+
+    db = DiscussionDatabase.instance().init(path)
+    assert db._stored_embedding_profile() == DEFAULT_EMBEDDING_PROFILE
+    assert db.execute_query("SELECT DISTINCT length(embedding) FROM npc_thought;", ()) == [(4 * 1536,)]
+    assert db.get_highest_scoring_thoughts(embeddings[3], [1, 2], katana_ts=1)[1][0] == "4"
+    db.close_conn()
+
+
+def test_lookups_use_indexes(db: DiscussionDatabase):
+    discussion_plan = db.execute_query(
+        "EXPLAIN QUERY PLAN SELECT discussion FROM discussion WHERE realm_id = ? AND ts >= ? AND ts <= ?;", (1, 0, 1)
+    )
+    thought_plan = db.execute_query("EXPLAIN QUERY PLAN SELECT * FROM npc_thought WHERE npc_entity_id = ?;", (1,))
+
+    assert "discussion_realm_id_ts_idx" in discussion_plan[0][3]
+    assert "npc_thought_npc_entity_id_idx" in thought_plan[0][3]
+
+
 JOHN_ENTITY_ID = 1
 FRED_ENTITY_ID = 2
 
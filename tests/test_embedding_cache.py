@@ -0,0 +1,110 @@
+from typing import Any
+
+import pytest
+
+from overlore.llm.client import LlmClient
+from overlore.llm.embedding_cache import CachedLlmClient
+from overlore.sqlite.discussion_db import pack_embedding
+from overlore.sqlite.embedding_cache_db import EmbeddingCacheDatabase
+from overlore.types import Embedding
+
+MODEL = "text-embedding-3-small"
+
+
+class CountingLlmClient(LlmClient):
+    def __init__(self) -> None:
+        self.embedding_requests = 0
+        self.batches: list[list[str]] = []
+
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+        self.embedding_requests += 1
+        return [float(len(input_str)), float(kwargs.get("dimensions") or 0)]
+
+    async def request_embeddings(self, input_strs: list[str], *args: Any, **kwargs: Any) -> list[Embedding]:
+        self.batches.append(input_strs)
+        return await super().request_embeddings(input_strs, *args, **kwargs)
+
+    async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
+        return prompt
+
+
+@pytest.fixture
+def db():
+    # every hit moves the embedding forward, so the eviction order is exact
+    db = EmbeddingCacheDatabase.instance().init(":memory:", max_entries=3, touch_interval_s=0)
+    yield db
+    db.close_conn()
+
+
+@pytest.mark.asyncio
+async def test_repeated_inputs_skip_the_client(db: EmbeddingCacheDatabase):
+    llm_client = CountingLlmClient()
+    cached_client = CachedLlmClient(llm_client)
+
+    embedding = await cached_client.request_embedding("hello", model=MODEL)
+    assert embedding == pack_embedding([5.0, 0.0])
+    assert await cached_client.request_embedding("hello", model=MODEL) == embedding
+    # a fresh client only has the database
+    assert await CachedLlmClient(llm_client).request_embedding("hello", model=MODEL) == embedding
+
+    assert llm_client.embedding_requests == 1
+    assert cached_client.metrics == {"memory_hits": 1, "disk_hits": 0, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_cache_key_includes_model_and_dimensions(db: EmbeddingCacheDatabase):
+    llm_client = CountingLlmClient()
+    cached_client = CachedLlmClient(llm_client)
+
+    await cached_client.request_embedding("hello", model=MODEL)
+    embedding = await cached_client.request_embedding("hello", model=MODEL, dimensions=256)
+    await cached_client.request_embedding("hello", model="text-embedding-3-large")
+
+    assert embedding == pack_embedding([5.0, 256.0])
+    assert llm_client.embedding_requests == 3
+    assert db.count_embeddings() == 3
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_embeddings_are_evicted(db: EmbeddingCacheDatabase):
+    llm_client = CountingLlmClient()
+    cached_client = CachedLlmClient(llm_client, memory_cache_size=2)
+
+    for text in ["a", "b", "c", "a", "d"]:
+        await cached_client.request_embedding(text, model=MODEL)
+
+    assert len(cached_client.memory_cache) == 2
+    assert db.count_embeddings() == 3
+    # "b" was the least recently used one
+    await cached_client.request_embedding("b", model=MODEL)
+    assert llm_client.embedding_requests == 5
+    await cached_client.request_embedding("a", model=MODEL)
+    assert llm_client.embedding_requests == 5
+    assert cached_client.metrics["disk_hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_only_requests_the_misses(db: EmbeddingCacheDatabase):
+    llm_client = CountingLlmClient()
+    cached_client = CachedLlmClient(llm_client)
+
+    await cached_client.request_embedding("b", model=MODEL)
+    embeddings = await cached_client.request_embeddings(["a", "b", "cc"], model=MODEL)
+
+    assert embeddings == [pack_embedding([1.0, 0.0]), pack_embedding([1.0, 0.0]), pack_embedding([2.0, 0.0])]
+    assert llm_client.batches == [["b"], ["a", "cc"]]
+    assert cached_client.metrics == {"memory_hits": 1, "disk_hits": 0, "misses": 3}
+
+
+@pytest.mark.asyncio
+async def test_recent_disk_hits_skip_the_write(db: EmbeddingCacheDatabase):
+    db.touch_interval_s = 60
+    await CachedLlmClient(CountingLlmClient()).request_embedding("hello", model=MODEL)
+    last_used = db.execute_query("SELECT last_used FROM embedding_cache;", ())[0][0]
+    changes = db.db.total_changes
+
+    # a fresh client only has the database
+    await CachedLlmClient(CountingLlmClient()).request_embedding("hello", model=MODEL)
+
+    assert db.db.total_changes == changes
+    assert db.execute_query("SELECT last_used FROM embedding_cache;", ())[0][0] == last_used
@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from overlore.errors import ErrorCodes
+from overlore.llm.client import LlmClient
+from overlore.llm.coalescer import CoalescingLlmClient
+from overlore.types import Embedding
+
+MODEL = "text-embedding-3-small"
+
+
+class BatchRecordingLlmClient(LlmClient):
+    def __init__(self, fail: bool = False, dropped: int = 0) -> None:
+        self.batches: list[list[str]] = []
+        self.fail = fail
+        self.dropped = dropped
+
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+        return (await self.request_embeddings([input_str], *args, **kwargs))[0]
+
+    async def request_embeddings(self, input_strs: list[str], *args: Any, **kwargs: Any) -> list[Embedding]:
+        self.batches.append(input_strs)
+        if self.fail:
+            raise RuntimeError("embeddings unavailable")
+        return [
+            [float(len(input_str)), float(kwargs.get("dimensions") or 0)]
+            for input_str in input_strs[: len(input_strs) - self.dropped]
+        ]
+
+    async def request_prompt_completion(self, prompt: str, instructions: str, *args: Any, **kwargs: Any) -> str:
+        return prompt
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_a_batch():
+    llm_client = BatchRecordingLlmClient()
+    coalescer = CoalescingLlmClient(llm_client, max_wait_s=0.01)
+
+    embeddings = await asyncio.gather(
+        coalescer.request_embedding("a", model=MODEL),
+        coalescer.request_embeddings(["bb", "ccc"], model=MODEL),
+        coalescer.request_embedding("dddd", model=MODEL),
+    )
+
+    assert embeddings == [[1.0, 0.0], [[2.0, 0.0], [3.0, 0.0]], [4.0, 0.0]]
+    assert llm_client.batches == [["a", "bb", "ccc", "dddd"]]
+
+
+@pytest.mark.asyncio
+async def test_batches_are_split_by_size_and_arguments():
+    llm_client = BatchRecordingLlmClient()
+    coalescer = CoalescingLlmClient(llm_client, max_wait_s=0.01, max_batch=2)
+
+    embeddings = await asyncio.gather(
+        coalescer.request_embeddings(["a", "b", "c"], model=MODEL),
+        coalescer.request_embedding("d", model=MODEL, dimensions=256),
+    )
+
+    assert embeddings == [[[1.0, 0.0], [1.0, 0.0], [1.0, 0.0]], [1.0, 256.0]]
+    assert sorted(llm_client.batches) == [["a", "b"], ["c"], ["d"]]
+
+
+@pytest.mark.asyncio
+async def test_failures_reach_every_waiting_request():
+    coalescer = CoalescingLlmClient(BatchRecordingLlmClient(fail=True), max_wait_s=0.01)
+
+    results = await asyncio.gather(
+        coalescer.request_embedding("a", model=MODEL),
+        coalescer.request_embedding("b", model=MODEL),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_inputs_without_embedding_fail():
+    coalescer = CoalescingLlmClient(BatchRecordingLlmClient(dropped=1), max_wait_s=0.01)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(
+            coalescer.request_embedding("a", model=MODEL),
+            coalescer.request_embedding("bb", model=MODEL),
+            return_exceptions=True,
+        ),
+        timeout=1,
+    )
+
+    assert results[0] == [1.0, 0.0]
+    assert isinstance(results[1], RuntimeError)
+    assert results[1].args[0] == ErrorCodes.MISSING_EMBEDDINGS
@@ -1,7 +1,10 @@
 import pytest
 
+from overlore.sqlite.base_db import MAX_DISTANCE_M, MAX_TIME_S
 from overlore.sqlite.events_db import EventsDatabase
+from overlore.torii.parsing import parse_event
 from overlore.torii.subscriptions import process_received_event
+from tests.utils.events_db_test_utils import CURRENT_TIME, generate_events, most_relevant_event_id
 
 
 def init_db() -> EventsDatabase:
@@ -648,3 +651,92 @@ async def test_fetch_most_relevant_event_something():
         )
         is None
     )
+
+
+def test_insert_events_batch():
+    db = init_db()
+
+    events = [
+        parse_event(
+            {
+                "id": f"0x00000000000000000000000000000000000000000000000000000000000001c8:0x0000:{i:#06x}",
+                "keys": [
+                    "0x1736c207163ad481e2a196c0fb6394f90c66c2e2b52e0c03d4a077ac6cea918",
+                    "0x4b",
+                    "0x1",
+                    "0x49",
+                    "0x2",
+                    "0x1b0a83a27a357e0574393ab06c0c774db7312a0993538cc0186d054f75ee84e",
+                ],
+                "data": ["0x1", "0x53", "0x0", "0x0", "0x64", "0x65a1bec0"],
+                "createdAt": "2024-01-02 12:35:45",
+            }
+        )
+        for i in range(0, 10)
+    ]
+
+    assert db.insert_events(events) == len(events)
+    # replaying the same history doesn't store anything new
+    assert db.insert_events(events) == 0
+    assert [event[0] for event in db.get_all()] == list(range(1, len(events) + 1))
+
+
+@pytest.mark.asyncio
+async def test_replayed_event_is_ignored():
+    db = init_db()
+    event = {
+        "eventEmitted": {
+            "id": "0x00000000000000000000000000000000000000000000000000000000000001c8:0x0000:0x0002",
+            "keys": [
+                "0x1736c207163ad481e2a196c0fb6394f90c66c2e2b52e0c03d4a077ac6cea918",
+                "0x4b",
+                "0x1",
+                "0x49",
+                "0x2",
+                "0x1b0a83a27a357e0574393ab06c0c774db7312a0993538cc0186d054f75ee84e",
+            ],
+            "data": ["0x1", "0x53", "0x0", "0x0", "0x64", "0x65a1bec0"],
+            "createdAt": "2024-01-02 12:35:45",
+        }
+    }
+
+    assert await process_received_event(event) == 1
+    assert await process_received_event(event) == 0
+    assert len(db.get_all()) == 1
+
+
+def test_fetch_most_relevant_event_matches_python_scoring():
+    db = init_db()
+    db.insert_events(generate_events(500))
+    events = db.get_all()
+
+    for realm_position in [(0.0, 0.0), (5000.0, 12000.0), (20000.0, 20000.0), (39999.0, 1.0)]:
+        ignored_event_ids: list[int] = []
+        for _ in range(0, 5):
+            expected_id = most_relevant_event_id(events, realm_position, CURRENT_TIME, ignored_event_ids)
+            most_relevant_event = db.fetch_most_relevant_event(realm_position, CURRENT_TIME, ignored_event_ids)
+
+            assert most_relevant_event is not None
+            assert most_relevant_event[0] == expected_id
+            ignored_event_ids.append(expected_id)
+
+
+def test_fetch_most_relevant_event_outside_of_windows():
+    db = init_db()
+    events = generate_events(50)
+    for event in events:
+        # too old and too far for both decays
+        event["ts"] = CURRENT_TIME - int(MAX_TIME_S) * 2
+        event["active_pos"] = (10 * MAX_DISTANCE_M, 10 * MAX_DISTANCE_M)
+        event["passive_pos"] = (10 * MAX_DISTANCE_M, 10 * MAX_DISTANCE_M)
+    events[10]["importance"] = 10.0
+    events[20]["importance"] = 10.0
+    db.insert_events(events)
+
+    most_relevant_event = db.fetch_most_relevant_event((0.0, 0.0), CURRENT_TIME, [])
+    assert most_relevant_event is not None
+    assert most_relevant_event[0] == 11
+
+    most_relevant_event = db.fetch_most_relevant_event((0.0, 0.0), CURRENT_TIME, [11])
+    assert most_relevant_event is not None
+    assert most_relevant_event[0] == 21
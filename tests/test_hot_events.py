@@ -0,0 +1,98 @@
+import pytest
+
+from overlore.sqlite import hot_events
+from overlore.sqlite.base_db import MAX_TIME_S
+from overlore.sqlite.events_db import EventsDatabase
+from overlore.sqlite.hot_events import NUMPY_AVAILABLE, HotEventIndex
+from tests.utils.events_db_test_utils import CURRENT_TIME, generate_events, most_relevant_event_id
+
+pytestmark = pytest.mark.skipif(not NUMPY_AVAILABLE, reason="the hot event index requires numpy")
+
+REALM_POSITIONS = [(0.0, 0.0), (5000.0, 12000.0), (20000.0, 20000.0), (39999.0, 1.0)]
+
+
+def init_db() -> EventsDatabase:
+    db = EventsDatabase.instance().init(":memory:")
+    db.realms.init("./tests/data/test_geodata.json")
+    return db
+
+
+def assert_matches_sql(db: EventsDatabase, current_time: int, expect_hot: bool) -> None:
+    events = db.get_all()
+    for realm_position in REALM_POSITIONS:
+        ignored_event_ids: list[int] = []
+        for _ in range(0, 5):
+            expected_id = most_relevant_event_id(events, realm_position, current_time, ignored_event_ids)
+            most_relevant_event = db.fetch_most_relevant_event(realm_position, current_time, ignored_event_ids)
+            hot_id = db.hot_events.best(realm_position, current_time, set(ignored_event_ids))
+            queried_event = db.query_most_relevant_event(realm_position, current_time, ignored_event_ids)
+
+            assert most_relevant_event is not None
+            assert most_relevant_event == queried_event
+            assert most_relevant_event[0] == expected_id
+            assert (hot_id is not None) == expect_hot
+            if hot_id is not None:
+                assert hot_id == expected_id
+            ignored_event_ids.append(expected_id)
+
+
+def test_cold_index_does_not_answer():
+    index = HotEventIndex()
+
+    assert not index.warm
+    assert index.best((0.0, 0.0), CURRENT_TIME, set()) is None
+
+
+def test_hot_index_matches_sql():
+    db = init_db()
+    db.insert_events(generate_events(300, max_age=MAX_TIME_S - 3600))
+
+    assert_matches_sql(db, CURRENT_TIME, expect_hot=True)
+    assert len(db.hot_events) == 300
+
+
+def test_hot_index_grows(monkeypatch):
+    monkeypatch.setattr(hot_events, "INITIAL_CAPACITY", 16)
+    db = init_db()
+    events = generate_events(200, max_age=MAX_TIME_S - 3600)
+    db.insert_events(events[:100])
+    db.fetch_most_relevant_event((0.0, 0.0), CURRENT_TIME, [])
+    db.insert_events(events[100:])
+
+    assert_matches_sql(db, CURRENT_TIME, expect_hot=True)
+    assert len(db.hot_events) == 200
+
+
+def test_hot_index_appends_new_events():
+    db = init_db()
+    events = generate_events(101, max_age=MAX_TIME_S - 3600)
+    db.insert_events(events[:100])
+    db.fetch_most_relevant_event((0.0, 0.0), CURRENT_TIME, [])
+
+    events[100]["importance"] = 10.0
+    events[100]["ts"] = CURRENT_TIME
+    events[100]["active_pos"] = (0.0, 0.0)
+    added_id = db.insert_event(events[100])
+
+    assert len(db.hot_events) == 101
+    assert db.hot_events.best((0.0, 0.0), CURRENT_TIME, set()) == added_id
+
+
+def test_hot_index_evicts_old_events():
+    db = init_db()
+    db.insert_events(generate_events(300, max_age=MAX_TIME_S - 3600))
+    db.fetch_most_relevant_event((0.0, 0.0), CURRENT_TIME, [])
+
+    # half the events fell out of the window, the most important of them can beat the index so it falls back to SQL
+    later = CURRENT_TIME + int(MAX_TIME_S / 2)
+    assert_matches_sql(db, later, expect_hot=False)
+    assert 0 < len(db.hot_events) < 300
+    assert db.hot_events.max_evicted_importance > 9.0
+
+
+def test_hot_index_does_not_go_back_in_time():
+    db = init_db()
+    db.insert_events(generate_events(10, max_age=MAX_TIME_S - 3600))
+    db.fetch_most_relevant_event((0.0, 0.0), CURRENT_TIME, [])
+
+    assert db.hot_events.best((0.0, 0.0), CURRENT_TIME - 1, set()) is None
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from overlore.http_sessions import HttpSessions
+
+TORII_URL = "http://localhost:8080/graphql"
+KATANA_URL = "http://localhost:5050"
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_reused_per_url():
+    http_sessions = HttpSessions.instance()
+
+    session = http_sessions.session(TORII_URL)
+    assert http_sessions.session(TORII_URL) is session
+    assert http_sessions.session(KATANA_URL) is not session
+
+    await http_sessions.close()
+    assert session.closed
+    assert http_sessions.session(TORII_URL) is not session
+    await http_sessions.close()
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_not_shared_across_event_loops():
+    http_sessions = HttpSessions.instance()
+
+    async def open_and_close_session() -> object:
+        session = http_sessions.session(TORII_URL)
+        await http_sessions.close()
+        return session
+
+    session = http_sessions.session(TORII_URL)
+    other_loop_session = await asyncio.to_thread(asyncio.run, open_and_close_session())
+
+    assert other_loop_session is not session
+    # closing the other loop's sessions left this one open
+    assert not session.closed
+    await http_sessions.close()
+
+
+def test_instance_is_created_once_across_threads(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(HttpSessions, "_instance", None)
+    barrier = threading.Barrier(8)
+
+    def create() -> HttpSessions:
+        barrier.wait()
+        http_sessions = HttpSessions.instance()
+        # never seen half built
+        assert http_sessions._sessions == {}
+        return http_sessions
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        instances = list(executor.map(lambda _: create(), range(8)))
+
+    assert all(http_sessions is instances[0] for http_sessions in instances)
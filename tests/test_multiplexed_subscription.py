@@ -0,0 +1,162 @@
+import asyncio
+from typing import Any, AsyncIterator
+
+import pytest
+
+from overlore.config import BootConfig
+from overlore.mocks import MockBootConfig
+from overlore.sqlite.types import LastSeenEvent
+from overlore.torii import subscriptions
+from overlore.torii.constants import EventType
+from overlore.torii.reconciliation import Reconciler
+from overlore.torii.subscriptions import Subscriptions, torii_multiplexed_sub
+from overlore.types import ToriiEmittedEvent
+from tests.utils.torii_test_utils import live_event
+
+
+class FakeSession:
+    def __init__(self, events: list[ToriiEmittedEvent]) -> None:
+        self.events = events
+        self.subscriptions: list[Any] = []
+
+    async def subscribe(self, document: Any) -> AsyncIterator[ToriiEmittedEvent]:
+        self.subscriptions.append(document)
+        for event in self.events:
+            yield event
+        # a live subscription never ends
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_slow_handler_does_not_stall_other_event_types():
+    handled: list[str] = []
+    spawn_released = asyncio.Event()
+    all_handled = asyncio.Event()
+
+    async def process_event(event: ToriiEmittedEvent, _: BootConfig | None = None) -> int:
+        handled.append(event["eventEmitted"]["createdAt"][-2:])
+        if len(handled) == 4:
+            all_handled.set()
+        return 0
+
+    async def process_spawn(event: ToriiEmittedEvent, config: BootConfig | None) -> int:
+        await spawn_released.wait()
+        return await process_event(event, config)
+
+    session = FakeSession(
+        [
+            live_event(EventType.NPC_SPAWNED, 1),
+            live_event(EventType.ORDER_ACCEPTED, 2),
+            live_event(EventType.TRANSFER, 3),
+            live_event(EventType.COMBAT_OUTCOME, 4),
+            live_event(EventType.ORDER_ACCEPTED, 5),
+        ]
+    )
+    callback_and_subs = [
+        (Subscriptions.COMBAT_OUTCOME, process_event),
+        (Subscriptions.ORDER_ACCEPTED, process_event),
+        (Subscriptions.NPC_SPAWNED, process_spawn),
+    ]
+    subscription = asyncio.create_task(
+        torii_multiplexed_sub(session, callback_and_subs, MockBootConfig(), Reconciler(backfill=None))  # type: ignore[arg-type]
+    )
+
+    await asyncio.sleep(0.01)
+    # transfers have no handler, the spawn is still being handled
+    assert sorted(handled) == ["02", "04", "05"]
+    spawn_released.set()
+    await asyncio.wait_for(all_handled.wait(), timeout=1)
+    assert handled[-1] == "01"
+    assert len(session.subscriptions) == 1
+
+    subscription.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await subscription
+
+
+@pytest.mark.asyncio
+async def test_full_handler_queue_drops_then_backfills(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(subscriptions, "HANDLER_QUEUE_SIZE", 1)
+    handled: list[str] = []
+    backfilled: list[dict[str, LastSeenEvent]] = []
+    spawn_released = asyncio.Event()
+
+    async def backfill(event_types: list[EventType], since: dict[str, LastSeenEvent]) -> int:
+        backfilled.append(since)
+        return 1
+
+    async def process_event(event: ToriiEmittedEvent, _: BootConfig | None = None) -> int:
+        handled.append(event["eventEmitted"]["createdAt"][-2:])
+        return 0
+
+    async def process_spawn(event: ToriiEmittedEvent, config: BootConfig | None) -> int:
+        await spawn_released.wait()
+        return await process_event(event, config)
+
+    session = FakeSession(
+        [
+            live_event(EventType.NPC_SPAWNED, 1),
+            live_event(EventType.NPC_SPAWNED, 2),
+            live_event(EventType.NPC_SPAWNED, 3),
+            live_event(EventType.ORDER_ACCEPTED, 4),
+        ]
+    )
+    callback_and_subs = [
+        (Subscriptions.ORDER_ACCEPTED, process_event),
+        (Subscriptions.NPC_SPAWNED, process_spawn),
+    ]
+    subscription = asyncio.create_task(
+        torii_multiplexed_sub(session, callback_and_subs, MockBootConfig(), Reconciler(backfill=backfill))  # type: ignore[arg-type]
+    )
+
+    await asyncio.sleep(0.01)
+    # the following spawns found the queue full, the router went on with the trade
+    assert handled == ["04"]
+    spawn_released.set()
+    await asyncio.sleep(0.01)
+
+    assert handled == ["04", "01"]
+    # the dropped spawns are backfilled from the last one handled
+    assert [since[EventType.NPC_SPAWNED.value]["created_at"] for since in backfilled] == ["2024-01-02 14:36:01"]
+
+    subscription.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await subscription
+
+
+@pytest.mark.asyncio
+async def test_failed_handler_does_not_stop_the_subscription():
+    handled: list[str] = []
+    reconciler = Reconciler(backfill=None)  # type: ignore[arg-type]
+
+    async def failing_on_event(event: ToriiEmittedEvent, callback: Any) -> None:
+        if event["eventEmitted"]["createdAt"].endswith("01"):
+            raise ValueError("unexpected event")
+        handled.append(event["eventEmitted"]["createdAt"][-2:])
+
+    reconciler.on_event = failing_on_event  # type: ignore[method-assign]
+
+    async def process_event(event: ToriiEmittedEvent, _: BootConfig | None = None) -> int:
+        return 0
+
+    session = FakeSession(
+        [
+            live_event(EventType.ORDER_ACCEPTED, 1),
+            live_event(EventType.COMBAT_OUTCOME, 2),
+            live_event(EventType.ORDER_ACCEPTED, 3),
+        ]
+    )
+    callback_and_subs = [
+        (Subscriptions.COMBAT_OUTCOME, process_event),
+        (Subscriptions.ORDER_ACCEPTED, process_event),
+    ]
+    subscription = asyncio.create_task(torii_multiplexed_sub(session, callback_and_subs, MockBootConfig(), reconciler))  # type: ignore[arg-type]
+
+    await asyncio.sleep(0.01)
+    assert sorted(handled) == ["02", "03"]
+    assert not subscription.done()
+    assert len(session.subscriptions) == 1
+
+    subscription.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await subscription
@@ -52,4 +52,14 @@ def test_fetch_npc_backstory_not_found_error(db):
         db.fetch_npc_backstory(INVALID_NPC_ENTITY_ID)
 
 
+def test_lookups_use_indexes(db):
+    backstory_plan = db.execute_query(
+        "EXPLAIN QUERY PLAN SELECT backstory, poignancy FROM npc_backstory WHERE npc_entity_id = ?;", (1,)
+    )
+    profile_plan = db.execute_query("EXPLAIN QUERY PLAN SELECT * FROM npc_profile WHERE realm_entity_id = ?;", (1,))
+
+    assert "npc_backstory_npc_entity_id_idx" in backstory_plan[0][3]
+    assert "npc_profile_realm_entity_id_idx" in profile_plan[0][3]
+
+
 INVALID_NPC_ENTITY_ID = 999
@@ -0,0 +1,79 @@
+from typing import Any
+
+import pytest
+
+from overlore.errors import ErrorCodes
+from overlore.mocks import MockBootConfig, MockKatanaClient, MockLlmClient
+from overlore.sqlite.discussion_db import DiscussionDatabase
+from overlore.sqlite.npc_db import NpcDatabase
+from overlore.torii import subscriptions
+from overlore.torii.constants import EventType
+from overlore.torii.subscriptions import process_received_spawn_npc_event
+from overlore.types import Embedding, ToriiEmittedEvent
+from tests.utils.npc_db_test_utils import prepare_data, test_data
+
+REALM_ENTITY_ID = test_data[0]["realm_entity_id"]
+NPC_ENTITY_ID = 7
+
+
+class UnavailableLlmClient(MockLlmClient):
+    def __init__(self, failures: int) -> None:
+        super().__init__(embedding_return=[1.0] * 1536, prompt_completion_return="")
+        self.failures = failures
+
+    async def request_embedding(self, input_str: str, *args: Any, **kwargs: Any) -> Embedding:
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("OpenAI is unavailable")
+        return await super().request_embedding(input_str, *args, **kwargs)
+
+
+@pytest.fixture
+def config(monkeypatch):
+    npc_db = NpcDatabase.instance().init(":memory:")
+    discussion_db = DiscussionDatabase.instance().init(":memory:")
+    prepare_data(npc_db)
+    monkeypatch.setattr(subscriptions, "KatanaClient", lambda url: MockKatanaClient())
+    config = MockBootConfig()
+    config.env["KATANA_URL"] = "http://katana"
+    yield config
+    npc_db.close_conn()
+    discussion_db.close_conn()
+
+
+def spawn_event() -> ToriiEmittedEvent:
+    return {
+        "eventEmitted": {
+            "id": "0x01:0x0000:0x0024",
+            "keys": [EventType.NPC_SPAWNED.value],
+            "data": [hex(REALM_ENTITY_ID), hex(NPC_ENTITY_ID)],
+            "createdAt": "2024-01-02 14:36:01",
+        }
+    }  # type: ignore[typeddict-item]
+
+
+@pytest.mark.asyncio
+async def test_spawn_replayed_after_a_failed_embedding_stores_its_thought(config):
+    llm_client = UnavailableLlmClient(failures=1)
+
+    with pytest.raises(ConnectionError):
+        await process_received_spawn_npc_event(spawn_event(), config, llm_client)
+    # replayed by the reconnection catch up or the backfill
+    assert await process_received_spawn_npc_event(spawn_event(), config, llm_client) > 0
+    assert await process_received_spawn_npc_event(spawn_event(), config, llm_client) == 0
+
+    discussion_db = DiscussionDatabase.instance()
+    assert discussion_db.count_npc_thoughts(NPC_ENTITY_ID) == 1
+    assert len(NpcDatabase.instance().fetch_npcs_backstories([NPC_ENTITY_ID])) == 1
+    (thought, _, _, _) = discussion_db.get_highest_scoring_thought([1.0] * 1536, NPC_ENTITY_ID, katana_ts=1)
+    assert thought == test_data[0]["profile"]["backstory"].backstory
+
+
+@pytest.mark.asyncio
+async def test_spawn_without_profile_fails(config):
+    event = spawn_event()
+    event["eventEmitted"]["data"] = [hex(999), hex(NPC_ENTITY_ID)]
+
+    with pytest.raises(RuntimeError) as error:
+        await process_received_spawn_npc_event(event, config, UnavailableLlmClient(failures=0))
+    assert error.value.args[0] == ErrorCodes.NPC_BACKSTORY_NOT_FOUND.value
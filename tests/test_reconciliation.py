@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+from overlore.sqlite.types import LastSeenEvent
+from overlore.torii.constants import EventType
+from overlore.torii.reconciliation import Reconciler
+from overlore.types import ToriiEmittedEvent
+from tests.utils.torii_test_utils import live_event
+
+
+class BlockedBackfill:
+    def __init__(self, fail: bool = False) -> None:
+        self.released = asyncio.Event()
+        self.fail = fail
+        self.processed: list[str] = []
+        self.since: list[dict[str, LastSeenEvent]] = []
+
+    async def __call__(self, event_types: list[EventType], since: dict[str, LastSeenEvent]) -> int:
+        self.since.append(since)
+        await self.released.wait()
+        if self.fail:
+            raise RuntimeError("torii unavailable")
+        self.processed.append("backfill")
+        return 1
+
+    async def callback(self, event: ToriiEmittedEvent) -> None:
+        self.processed.append(event["eventEmitted"]["createdAt"][-2:])
+
+
+@pytest.mark.asyncio
+async def test_live_events_wait_for_the_backfill():
+    backfill = BlockedBackfill()
+    reconciler = Reconciler(backfill=backfill)
+    reconciliation = asyncio.create_task(reconciler.reconcile())
+    await asyncio.sleep(0)
+
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 1), backfill.callback)
+    await reconciler.on_event(live_event(EventType.COMBAT_OUTCOME, 2), backfill.callback)
+    await reconciler.on_event(live_event(EventType.NPC_SPAWNED, 3), backfill.callback)
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 5), backfill.callback)
+    assert backfill.processed == []
+
+    backfill.released.set()
+    assert await reconciliation == 1
+    assert backfill.processed[0] == "backfill"
+    # each event type keeps its order
+    assert [index for index in backfill.processed if index in ["01", "05"]] == ["01", "05"]
+    assert sorted(backfill.processed[1:]) == ["01", "02", "03", "05"]
+
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 4), backfill.callback)
+    assert backfill.processed[-1] == "04"
+    assert reconciler.last_seen[EventType.ORDER_ACCEPTED.value] == {
+        "torii_event_id": f"0x{4:064x}:0x0000:0x0000",
+        "created_at": "2024-01-02 14:36:04",
+    }
+
+
+@pytest.mark.asyncio
+async def test_failed_backfill_keeps_buffering():
+    failing_backfill = BlockedBackfill(fail=True)
+    failing_backfill.released.set()
+    reconciler = Reconciler(backfill=failing_backfill)
+    with pytest.raises(RuntimeError):
+        await reconciler.reconcile()
+
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 1), failing_backfill.callback)
+    assert failing_backfill.processed == []
+
+    backfill = BlockedBackfill()
+    backfill.released.set()
+    reconciler.backfill = backfill
+    await reconciler.reconcile()
+    assert failing_backfill.processed == ["01"]
+    assert backfill.processed == ["backfill"]
+
+
+@pytest.mark.asyncio
+async def test_streams_only_buffer_their_own_event_types():
+    backfill = BlockedBackfill()
+    reconciler = Reconciler(backfill=backfill)
+    reconciliation = asyncio.create_task(reconciler.reconcile([EventType.COMBAT_OUTCOME]))
+    await asyncio.sleep(0)
+
+    await reconciler.on_event(live_event(EventType.COMBAT_OUTCOME, 1), backfill.callback)
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 2), backfill.callback)
+    assert backfill.processed == ["02"]
+
+    backfill.released.set()
+    await reconciliation
+    assert backfill.processed == ["02", "backfill", "01"]
+
+
+@pytest.mark.asyncio
+async def test_reconnections_backfill_from_the_last_event_seen():
+    backfill = BlockedBackfill()
+    backfill.released.set()
+    reconciler = Reconciler(backfill=backfill)
+
+    await reconciler.reconcile([EventType.NPC_SPAWNED])
+    await reconciler.on_event(live_event(EventType.NPC_SPAWNED, 1), backfill.callback)
+    await reconciler.on_event(live_event(EventType.NPC_SPAWNED, 2), backfill.callback)
+    await reconciler.reconcile([EventType.NPC_SPAWNED])
+
+    assert backfill.since == [
+        {},
+        {
+            EventType.NPC_SPAWNED.value: {
+                "torii_event_id": f"0x{2:064x}:0x0000:0x0000",
+                "created_at": "2024-01-02 14:36:02",
+            }
+        },
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_events_dont_stop_the_buffered_ones():
+    backfill = BlockedBackfill()
+    reconciler = Reconciler(backfill=backfill)
+    reconciliation = asyncio.create_task(reconciler.reconcile([EventType.ORDER_ACCEPTED]))
+    await asyncio.sleep(0)
+
+    async def failing_callback(event: ToriiEmittedEvent) -> None:
+        raise ConnectionError("OpenAI is unavailable")
+
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 1), failing_callback)
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 2), backfill.callback)
+
+    backfill.released.set()
+    assert await reconciliation == 1
+    assert backfill.processed == ["backfill", "02"]
+    assert reconciler.backfilling == set()
+
+    await reconciler.on_event(live_event(EventType.ORDER_ACCEPTED, 3), failing_callback)
+    assert reconciler.last_seen[EventType.ORDER_ACCEPTED.value]["created_at"] == "2024-01-02 14:36:03"
+
+
+@pytest.mark.asyncio
+async def test_live_events_seen_are_stored():
+    backfill = BlockedBackfill()
+    backfill.released.set()
+    stored: dict[str, LastSeenEvent] = {}
+    last_seen = {
+        EventType.NPC_SPAWNED.value: LastSeenEvent(
+            torii_event_id=f"0x{1:064x}:0x0000:0x0000", created_at="2024-01-02 14:36:01"
+        )
+    }
+    reconciler = Reconciler(backfill=backfill, last_seen=last_seen, store_last_seen=stored.__setitem__)
+
+    # the first backfill after a restart catches up from the events stored live
+    await reconciler.reconcile([EventType.NPC_SPAWNED])
+    assert backfill.since == [last_seen]
+
+    await reconciler.on_event(live_event(EventType.NPC_SPAWNED, 2), backfill.callback)
+    assert stored == {
+        EventType.NPC_SPAWNED.value: {
+            "torii_event_id": f"0x{2:064x}:0x0000:0x0000",
+            "created_at": "2024-01-02 14:36:02",
+        }
+    }
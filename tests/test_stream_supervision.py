@@ -0,0 +1,80 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from overlore.sqlite.types import LastSeenEvent
+from overlore.torii import subscriptions
+from overlore.torii.constants import EventType
+from overlore.torii.reconciliation import Reconciler
+from overlore.torii.subscriptions import STREAMS_HEALTH, StreamState, supervise_stream
+
+
+class FakeClient:
+    def __init__(self, transport: Any) -> None:
+        pass
+
+    async def __aenter__(self) -> "FakeClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+
+class FakeConfig:
+    def __init__(self) -> None:
+        self.env = {"TORII_WS": "ws://localhost:8080/graphql/ws"}
+
+
+@pytest.fixture(autouse=True)
+def fake_websocket(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(subscriptions, "Client", FakeClient)
+    monkeypatch.setattr(subscriptions, "WebsocketsTransport", lambda url: url)
+    monkeypatch.setattr(subscriptions, "MAX_RECONNECT_DELAY_S", 0.001)
+
+
+@pytest.mark.asyncio
+async def test_flaky_stream_reconnects_alone():
+    backfilled: list[list[EventType]] = []
+
+    async def backfill(event_types: list[EventType], since: dict[str, LastSeenEvent]) -> int:
+        backfilled.append(event_types)
+        return 0
+
+    reconciler = Reconciler(backfill=backfill)
+    connections = {"flaky": 0, "steady": 0}
+
+    async def flaky(session: Any) -> None:
+        connections["flaky"] += 1
+        raise ConnectionError("websocket closed")
+
+    async def steady(session: Any) -> None:
+        connections["steady"] += 1
+        await asyncio.Event().wait()
+
+    tasks = [
+        asyncio.create_task(
+            supervise_stream("flaky", [EventType.ORDER_ACCEPTED], flaky, FakeConfig(), reconciler)  # type: ignore[arg-type]
+        ),
+        asyncio.create_task(
+            supervise_stream("steady", [EventType.NPC_SPAWNED], steady, FakeConfig(), reconciler)  # type: ignore[arg-type]
+        ),
+    ]
+    while connections["flaky"] < 10:
+        await asyncio.sleep(0.001)
+
+    assert connections["steady"] == 1
+    assert STREAMS_HEALTH["steady"]["state"] == StreamState.LIVE
+    assert STREAMS_HEALTH["flaky"]["failures"] >= 9
+    assert STREAMS_HEALTH["flaky"]["last_error"] == "ConnectionError: websocket closed"
+    # every reconnection of the flaky stream backfilled its event type, the steady one only once
+    assert backfilled.count([EventType.NPC_SPAWNED]) == 1
+    assert all(
+        event_types == [EventType.ORDER_ACCEPTED]
+        for event_types in backfilled
+        if event_types != [EventType.NPC_SPAWNED]
+    )
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,58 @@
+from typing import Any
+
+import pytest
+
+from overlore.torii.client import ToriiClient
+
+# npc entity id -> realm entity id -> realm id
+ENTITY_OWNERS = {10: 100, 11: 100, 12: 101}
+REALM_IDS = {100: 1, 101: 2}
+
+
+class RecordingToriiClient(ToriiClient):
+    def __init__(self) -> None:
+        super().__init__(url="")
+        self.queries: list[str] = []
+
+    async def run_torii_query(self, query: str) -> Any:
+        self.queries.append(query)
+        if "npcModels" in query:
+            return {"npcModels": {"edges": []}}
+        return {
+            **{
+                f"npc_{npc_entity_id}": {"edges": [{"node": {"entity_owner_id": hex(realm_entity_id)}}]}
+                for npc_entity_id, realm_entity_id in ENTITY_OWNERS.items()
+            },
+            **{
+                f"realm_{realm_entity_id}": {"edges": [{"node": {"realm_id": hex(realm_id)}}]}
+                for realm_entity_id, realm_id in REALM_IDS.items()
+            },
+        }
+
+
+@pytest.fixture
+def torii_client():
+    ToriiClient.origin_realm_ids.clear()
+    yield RecordingToriiClient()
+    ToriiClient.origin_realm_ids.clear()
+
+
+@pytest.mark.asyncio
+async def test_origin_realms_are_resolved_in_two_queries(torii_client: RecordingToriiClient):
+    origin_realm_ids = await torii_client.get_realm_ids_from_npc_entity_ids([10, 11, 12])
+
+    assert origin_realm_ids == {10: 1, 11: 1, 12: 2}
+    assert len(torii_client.queries) == 2
+    assert all(f"npc_{npc_entity_id}:" in torii_client.queries[0] for npc_entity_id in ENTITY_OWNERS)
+    # both npcs of realm 100 share its alias
+    assert torii_client.queries[1].count("realm_100:") == 1
+
+
+@pytest.mark.asyncio
+async def test_origin_realms_are_memoized(torii_client: RecordingToriiClient):
+    await torii_client.get_realm_ids_from_npc_entity_ids([10, 11])
+    assert await RecordingToriiClient().get_realm_id_from_npc_entity_id(11) == 1
+
+    await torii_client.get_realm_ids_from_npc_entity_ids([10, 12])
+    assert len(torii_client.queries) == 4
+    assert "npc_10:" not in torii_client.queries[2]
@@ -1,3 +1,5 @@
+import random
+
 from overlore.sqlite.discussion_db import DiscussionDatabase
 
 given_discussion_values_for_single_realm = [
@@ -74,3 +76,19 @@ class ThoughtsDatabaseFiller:
                 npc_entity_id=1, thought=f"{i}", poignancy=i, katana_ts=1, thought_embedding=embedded_vector
             )
         return last_inserted_id
+
+    def populate_with_random_embeddings(self, num: int, npc_entity_ids: list[int], seed: int = 0) -> list[list[float]]:
+        rand = random.Random(seed)
+        embeddings = []
+
+        for i in range(1, num + 1):
+            embedded_vector = [rand.uniform(-1.0, 1.0) for _ in range(0, 1536)]
+            self.database.insert_npc_thought(
+                npc_entity_id=npc_entity_ids[i % len(npc_entity_ids)],
+                thought=f"{i}",
+                poignancy=1,
+                katana_ts=1,
+                thought_embedding=embedded_vector,
+            )
+            embeddings.append(embedded_vector)
+        return embeddings
@@ -0,0 +1,58 @@
+import math
+import random
+
+from overlore.eternum.types import RealmPosition
+from overlore.sqlite.base_db import A_DISTANCE, A_TIME, MAX_DISTANCE_M, MAX_TIME_S, average, decay_function
+from overlore.sqlite.types import StoredEvent
+from overlore.types import ParsedEvent
+
+CURRENT_TIME = 1711618313
+
+
+def generate_events(num: int, seed: int = 0, max_age: float = 3 * MAX_TIME_S) -> list[ParsedEvent]:
+    rand = random.Random(seed)
+
+    def position() -> RealmPosition:
+        return (rand.uniform(0.0, 4 * MAX_DISTANCE_M), rand.uniform(0.0, 4 * MAX_DISTANCE_M))
+
+    return [
+        ParsedEvent(
+            torii_event_id=hex(i),
+            event_type=0,
+            active_realm_entity_id=1,
+            active_realm_id=1,
+            passive_realm_entity_id=2,
+            passive_realm_id=2,
+            importance=rand.uniform(0.0, 10.0),
+            ts=CURRENT_TIME - rand.randint(-3600, int(max_age)),
+            type_specific_data="{}",
+            active_pos=position(),
+            passive_pos=position(),
+        )
+        for i in range(0, num)
+    ]
+
+
+def distance(a: RealmPosition, b: RealmPosition) -> float:
+    return math.sqrt((a[0] - b[0]) * (a[0] - b[0]) + (a[1] - b[1]) * (a[1] - b[1]))
+
+
+def most_relevant_event_id(
+    events: list[StoredEvent], realm_position: RealmPosition, current_time: int, ignored_event_ids: list[int]
+) -> int | None:
+    """Scores every event in Python, ties go to the event stored first"""
+    best_id = None
+    best_score = -1.0
+    for event in events:
+        if event[0] in ignored_event_ids:
+            continue
+        closest = min(distance(realm_position, event[9]), distance(realm_position, event[10]))  # type: ignore[arg-type]
+        score = average(
+            decay_function(A_DISTANCE, 10, closest),
+            decay_function(A_TIME, 10, current_time - event[7]),  # type: ignore[operator]
+            event[6],
+        )
+        if score > best_score:
+            best_id = event[0]
+            best_score = score
+    return best_id  # type: ignore[return-value]
@@ -0,0 +1,14 @@
+from overlore.torii.constants import EventType
+from overlore.types import ToriiEmittedEvent
+
+
+def live_event(event_type: EventType, index: int) -> ToriiEmittedEvent:
+    """Event as received by a subscription, without data, the index orders its id and creation time"""
+    return {
+        "eventEmitted": {
+            "id": f"0x{index:064x}:0x0000:0x0000",
+            "keys": [event_type.value],
+            "data": [],
+            "createdAt": f"2024-01-02 14:36:{index:02}",
+        }
+    }  # type: ignore[typeddict-item]